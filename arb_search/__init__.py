@@ -1,5 +1,69 @@
-from .api_handler import API_Handler
-from .apis import TheOddsAPI_V4, Betfair
+import importlib
+from typing import TYPE_CHECKING, Any, Dict, List
+
+from .config import Config, config
+from .metrics import MetricsRegistry, metrics
 from .sport_types import SportType
-from .user_event import *
-from .utils import BookmakerStoredDict
+
+# everything else is imported on first use, so importing arb_search doesn't import betting_event, numpy or the API
+# backends and their clients until they are needed
+_LAZY_IMPORTS: Dict[str, str] = {
+    'API_Handler': '.api_handler',
+    'CalculatorCache': '.calculator_cache',
+    'TheOddsAPI_V4': '.apis',
+    'Betfair': '.apis',
+    'ReplayBetfair': '.apis',
+    'ReplayTheOddsAPI': '.apis',
+    'replay_clock': '.apis',
+    'CaptureWriter': '.capture',
+    'ReplayClock': '.capture',
+    'read_capture': '.capture',
+    'replay_calculator_cache': '.capture',
+    'CalculatorDispatcher': '.dispatch',
+    'TokenBucket': '.dispatch',
+    'EntityRegistry': '.entity_registry',
+    'ArbitragePreScreen': '.prescreen',
+    'CycleStats': '.scanner',
+    'RefreshScheduler': '.scanner',
+    'Scanner': '.scanner',
+    'Codec': '.serialization',
+    'JSONCodec': '.serialization',
+    'MsgpackZstdCodec': '.serialization',
+    'dump_file': '.serialization',
+    'get_codec': '.serialization',
+    'load_file': '.serialization',
+    'UserBet': '.user_event',
+    'UserBookmaker': '.user_event',
+    'UserEvent': '.user_event',
+    'OddsBook': '.user_event',
+    'BetDelta': '.user_event',
+    'BookmakerStoredDict': '.utils',
+}
+
+__all__ = ['Config', 'config', 'MetricsRegistry', 'metrics', 'SportType', *_LAZY_IMPORTS]
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(_LAZY_IMPORTS))
+
+
+if TYPE_CHECKING:
+    from .api_handler import API_Handler
+    from .apis import Betfair, ReplayBetfair, ReplayTheOddsAPI, TheOddsAPI_V4, replay_clock
+    from .calculator_cache import CalculatorCache
+    from .capture import CaptureWriter, ReplayClock, read_capture, replay_calculator_cache
+    from .dispatch import CalculatorDispatcher, TokenBucket
+    from .entity_registry import EntityRegistry
+    from .prescreen import ArbitragePreScreen
+    from .scanner import CycleStats, RefreshScheduler, Scanner
+    from .serialization import Codec, JSONCodec, MsgpackZstdCodec, dump_file, get_codec, load_file
+    from .user_event import BetDelta, OddsBook, UserBet, UserBookmaker, UserEvent
+    from .utils import BookmakerStoredDict
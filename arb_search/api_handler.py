@@ -1,19 +1,37 @@
 import threading
+import time
+from datetime import datetime
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from typing import Dict, List, Optional, Tuple, Type
 
 from arb_search.apis.base_api import API_Instance
+from arb_search.user_event import BetDelta
 from arb_search.user_event.event import UserEvent
 
+from .entity_registry import EntityRegistry
+from .metrics import metrics
 from .sport_types import SportType
 from .utils import StoredDict, BookmakerStoredDict
 
 
 class API_Handler:
-    def __init__(self, apis: List[API_Instance], name_comparison_table: Optional[StoredDict] = None, bookmaker_table: Optional[BookmakerStoredDict] = None) -> None:
+    def __init__(self, apis: List[API_Instance], name_comparison_table: Optional[StoredDict] = None, bookmaker_table: Optional[BookmakerStoredDict] = None,
+                 gather_timeouts: Optional[Dict[str, float]] = None, registry: Optional[EntityRegistry] = None,
+                 default_gather_timeout: float = 300.0) -> None:
         self.apis: List[API_Instance] = apis
+
+        # per-API deadline (seconds, keyed by api.name) used by the concurrent gather, default_gather_timeout for the rest
+        if gather_timeouts is None:
+            gather_timeouts = {}
+        self.gather_timeouts: Dict[str, float] = gather_timeouts
+        self.default_gather_timeout = default_gather_timeout
+        self.failed_apis: Dict[str, BaseException] = {}
+        # gathers of the concurrent gather by API, kept after a missed deadline until their thread finishes
+        self._gathers_in_flight: Dict[API_Instance, Future] = {}    # type: ignore
     
         if name_comparison_table is None:
-            name_comparison_table = StoredDict('storage/API_terminology_db.pkl')
+            name_comparison_table = StoredDict('storage/API_terminology_db.pkl', write_behind= True)
         self.name_comparison_table: StoredDict = name_comparison_table
 
         if bookmaker_table is None:
@@ -24,52 +42,193 @@ class API_Handler:
             if api.name not in self.name_comparison_table:
                 self.name_comparison_table[api.name] = {"team_names": {}, "league_names": {}}
 
-    def gather_all_sport_type(self, sport_types: List[SportType], gather_new_leagues: bool= False) -> List[UserEvent]:
-        apis_events: Dict[API_Instance, List[UserEvent]] = {} # type: ignore
-
+        if registry is None:
+            registry = EntityRegistry()
+        self.registry: EntityRegistry = registry
+        self.registry.import_name_table(self.name_comparison_table)
+
+    def gather_all_sport_type(self, sport_types: List[SportType], gather_new_leagues: bool= False, concurrent: bool = True, timeout: Optional[float] = None) -> List[UserEvent]:
+        """Gather events from every API and match them.
+
+        Args:
+            sport_types (List[SportType]): The sport types to gather.
+            gather_new_leagues (bool): Gather every league rather than only the ones already in the name table.
+            concurrent (bool): Run each API's gather_events in its own thread.
+            timeout (float): Deadline in seconds for each API, self.default_gather_timeout if None, overridden per API
+                by self.gather_timeouts. APIs that fail or miss their deadline are left out and recorded in
+                self.failed_apis. A gather that misses its deadline can't be stopped: its daemon thread runs on,
+                spending quota and adding to the bookmaker table (under its lock) and the API's caches, its events
+                are discarded and the API is skipped by later gathers until it has finished. Interpreter exit doesn't
+                wait for it.
+        """
+        league_names_table: Dict[API_Instance, Optional[List[str]]] = {}    # type: ignore
         for api in self.apis:
-            league_names = list(self.name_comparison_table[api.name]["league_names"].values())
-            if gather_new_leagues:
-                league_names = None
-            # TODO: add threading
-            apis_events[api] = api.gather_events(sport_types= sport_types, leagues= league_names)
-
-
-        return self.match_events(apis_events)
+            league_names_table[api] = None if gather_new_leagues else list(self.name_comparison_table[api.name]["league_names"].values())
 
+        apis_events: Dict[API_Instance, List[UserEvent]] = {} # type: ignore
+        if concurrent:
+            apis_events = self._gather_concurrent(sport_types, league_names_table, timeout)
+        else:
+            for api in self.apis:
+                apis_events[api] = self._gather(api, sport_types, league_names_table[api])
+
+        with metrics.timer("match_seconds"):
+            events = self.match_events(apis_events)
+        metrics.inc("events_total", len(events))
+        for event in events:
+            event.compact()     # UserBets are only created again for the events whose bets are read
+        return events
+
+    def _gather_concurrent(self, sport_types: List[SportType], league_names_table: Dict[API_Instance, Optional[List[str]]], timeout: Optional[float] = None) -> Dict[API_Instance, List[UserEvent]]:
+        apis_events: Dict[API_Instance, List[UserEvent]] = {} # type: ignore
+        self.failed_apis = {}
+        if timeout is None:
+            timeout = self.default_gather_timeout
 
-    def update_bet_data(self, event: UserEvent, bet_indexes: List[int]) -> bool:
-        recalculation_needed = False
+        start = time.monotonic()
+        futures: Dict[API_Instance, Future] = {}    # type: ignore
+        for api in self.apis:
+            previous = self._gathers_in_flight.get(api)
+            if previous is not None and not previous.done():
+                self.failed_apis[api.name] = RuntimeError(f"{api.name}'s previous gather is still running")
+                metrics.inc("gather_failures_total", api= api.name, reason= "still_running")
+                print(f"{api.name}'s previous gather is still running, continuing without it")
+                continue
+            futures[api] = self._gathers_in_flight[api] = self._start_gather(api, sport_types, league_names_table[api])
+
+        for api, future in futures.items():
+            api_timeout = self.gather_timeouts.get(api.name, timeout)
+            try:
+                apis_events[api] = future.result(timeout= max(0.0, start + api_timeout - time.monotonic()))
+            except FutureTimeoutError as e:
+                # the gather carries on in its thread, whatever it returns is dropped
+                self.failed_apis[api.name] = e
+                metrics.inc("gather_failures_total", api= api.name, reason= "timeout")
+                print(f"{api.name} did not finish within {api_timeout}s, continuing without it")
+            except Exception as e:
+                self.failed_apis[api.name] = e
+                metrics.inc("gather_failures_total", api= api.name, reason= "error")
+                print(f"{api.name} failed to gather events ({e!r}), continuing without it")
+
+        return apis_events
+
+    def _start_gather(self, api: API_Instance, sport_types: List[SportType], leagues: Optional[List[str]]) -> Future:
+        """Run _gather in a daemon thread, so a gather stuck past its deadline doesn't hold up interpreter exit."""
+        future: Future = Future()
+
+        def run() -> None:
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(self._gather(api, sport_types, leagues))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target= run, name= f"gather-{api.name}", daemon= True).start()
+        return future
+
+    def _gather(self, api: API_Instance, sport_types: List[SportType], leagues: Optional[List[str]]) -> List[UserEvent]:
+        with metrics.timer("gather_seconds", api= api.name):
+            events = api.gather_events(sport_types= sport_types, leagues= leagues)
+        metrics.inc("events_gathered_total", len(events), api= api.name)
+        return events
+
+    def update_bet_data(self, event: UserEvent, bet_indexes: List[int]) -> BetDelta:
+        """Refresh the bets at bet_indexes from every API of the event, the returned delta is truthy when they need recalculating."""
+        delta = BetDelta()
+        watched_ids = set(id(event.bets[i]) for i in bet_indexes)
         for api in event.api_specific_data.keys():
-            recalculation_needed |= api.update_bet_data(event, bet_indexes)
+            # an API may have moved or removed bets, so the indexes are found again for each one
+            with metrics.timer("update_bet_data_seconds", api= api.name):
+                delta |= api.update_bet_data(event, [i for i, bet in enumerate(event.bets) if id(bet) in watched_ids])
 
-        return recalculation_needed
+        return delta
 
 
     def match_events(self, apis_events: Dict[API_Instance, List[UserEvent]]) -> List[UserEvent]:
+        """Merge the events found by more than one API into a single event.
+
+        The events of the second API in each pair are indexed by start time and by their canonical team and league
+        names, so each event is only compared with the events that start at the same time. Events whose names are
+        all in the name table are matched with a single lookup, the rest fall back to events_match.
+        """
         apis_list = list(apis_events.keys())
+        comparison_data: Dict[int, Tuple[str, str, str, str]] = {}
+        table_updated = False
 
         for api_1 in apis_list[:-1]:
             for api_2 in apis_list[apis_list.index(api_1) + 1:]:
+                known_index, unknown_index = self._build_match_index(api_2, apis_events[api_2], comparison_data)
+                matched_ids = set()
 
-                event_1_idx = 0
-                while event_1_idx < len(apis_events[api_1]):
+                for event_1 in apis_events[api_1]:
+                    known_candidates = known_index.get(event_1.start_time)
+                    unknown_candidates = unknown_index.get(event_1.start_time)
+                    if not known_candidates and not unknown_candidates:
+                        continue
 
-                    event_2_idx = -1
-                    while event_2_idx < len(apis_events[api_2]) - 1:
-                        event_2_idx += 1
+                    _, home_name, away_name, league_name = self._comparison_data(api_1, event_1, comparison_data)
+                    # names of the first api are the canonical names, see events_match
+                    event_1.entity_ids = (self._set_name(api_1.name, "team_names", home_name, home_name),
+                                          self._set_name(api_1.name, "team_names", away_name, away_name),
+                                          self._set_name(api_1.name, "league_names", league_name, league_name))
+                    table_updated = True
+
+                    event_2: Optional[UserEvent] = None
+                    if known_candidates:
+                        same_names = known_candidates.get(event_1.entity_ids)
+                        if same_names:
+                            event_2 = same_names.pop(0)
+
+                    if event_2 is None and unknown_candidates:
+                        for candidate in unknown_candidates:
+                            if self.events_match((event_1, candidate), (api_1, api_2)):
+                                event_2 = candidate
+                                unknown_candidates.remove(candidate)
+                                break
+
+                    if event_2 is not None:
+                        event_1.update_from_event(event_2, api_2)
+                        matched_ids.add(id(event_2))
+
+                metrics.inc("events_merged_total", len(matched_ids), api= api_2.name)
+                if matched_ids:
+                    apis_events[api_2][:] = [event for event in apis_events[api_2] if id(event) not in matched_ids]
+
+        if table_updated:
+            self.name_comparison_table.mark_dirty()
+        self.name_comparison_table.flush()
 
-                        event_1 = apis_events[api_1][event_1_idx]
-                        event_2 = apis_events[api_2][event_2_idx]
+        return [event for events in apis_events.values() for event in events]
 
-                        if self.events_match((event_1, event_2), (api_1, api_2)):
-                            event_1.update_from_event(event_2, api_2)
-                            del apis_events[api_2][event_2_idx]
-                            break
+    def _comparison_data(self, api: API_Instance, event: UserEvent, comparison_data: Dict[int, Tuple[str, str, str, str]]) -> Tuple[str, str, str, str]:
+        if id(event) not in comparison_data:
+            comparison_data[id(event)] = api.read_event_comparison_data(event)
+        return comparison_data[id(event)]
+
+    def _build_match_index(self, api: API_Instance, events: List[UserEvent], comparison_data: Dict[int, Tuple[str, str, str, str]]
+                          ) -> Tuple[Dict[Optional[datetime], Dict[Tuple[int, int, int], List[UserEvent]]], Dict[Optional[datetime], List[UserEvent]]]:
+        """Index events by start time, then by canonical (home, away, league) ids when all three names are known."""
+        known_index: Dict[Optional[datetime], Dict[Tuple[int, int, int], List[UserEvent]]] = {}
+        unknown_index: Dict[Optional[datetime], List[UserEvent]] = {}
+
+        for event in events:
+            _, home_name, away_name, league_name = self._comparison_data(api, event, comparison_data)
+            home_id = self.registry.lookup("team_names", api.name, home_name)
+            away_id = self.registry.lookup("team_names", api.name, away_name)
+            league_id = self.registry.lookup("league_names", api.name, league_name)
+
+            if home_id is not None and away_id is not None and league_id is not None:
+                event.entity_ids = (home_id, away_id, league_id)
+                known_index.setdefault(event.start_time, {}).setdefault(event.entity_ids, []).append(event)
+            else:
+                unknown_index.setdefault(event.start_time, []).append(event)
 
-                    event_1_idx += 1
-        
-        return [event for events in apis_events.values() for event in events]
+        return known_index, unknown_index
+
+    def _set_name(self, api_name: str, kind: str, alias: str, canonical_name: str) -> int:
+        """Point api_name's alias at canonical_name in both the name table and the registry, return the canonical id."""
+        self.name_comparison_table[api_name][kind][alias] = canonical_name
+        return self.registry.add_alias(kind, api_name, alias, canonical_name)
 
     def events_match(self, events: Tuple[UserEvent, UserEvent], apis: Tuple[API_Instance, API_Instance]) -> bool:
         """Return True if the events match, False otherwise."""
@@ -98,9 +257,9 @@ class API_Handler:
                 self.name_comparison_table[api_name] = {"team_names": {}, "league_names": {}}
 
             if i == default_index:
-                self.name_comparison_table[api_name]["team_names"][home_name] = home_name
-                self.name_comparison_table[api_name]["team_names"][away_name] = away_name
-                self.name_comparison_table[api_name]["league_names"][league_name] = league_name
+                self._set_name(api_name, "team_names", home_name, home_name)
+                self._set_name(api_name, "team_names", away_name, away_name)
+                self._set_name(api_name, "league_names", league_name, league_name)
 
             if home_name in self.name_comparison_table[api_name]["team_names"]:
                 home_common_names.append(self.name_comparison_table[api_name]["team_names"][home_name])
@@ -119,7 +278,7 @@ class API_Handler:
 
             i += 1
 
-        self.name_comparison_table.save()
+        self.name_comparison_table.mark_dirty()
 
         if len(set(home_common_names)) == 1 and len(set(away_common_names)) == 1 and len(set(league_common_names)) == 1:
             if not new_value:
@@ -131,11 +290,13 @@ class API_Handler:
                     i += 1
                     if i == default_index:
                         continue
-                    self.name_comparison_table[api_name]["team_names"][home_name] =     self.name_comparison_table[api_names[default_index]]["team_names"][home_names[default_index]]
-                    self.name_comparison_table[api_name]["team_names"][away_name] =     self.name_comparison_table[api_names[default_index]]["team_names"][away_names[default_index]]
-                    self.name_comparison_table[api_name]["league_names"][league_name] = self.name_comparison_table[api_names[default_index]]["league_names"][league_names[default_index]]
+                    self._set_name(api_name, "team_names", home_name,     self.name_comparison_table[api_names[default_index]]["team_names"][home_names[default_index]])
+                    self._set_name(api_name, "team_names", away_name,     self.name_comparison_table[api_names[default_index]]["team_names"][away_names[default_index]])
+                    self._set_name(api_name, "league_names", league_name, self.name_comparison_table[api_names[default_index]]["league_names"][league_names[default_index]])
 
-                self.name_comparison_table.save()
+                # answers from the user are written straight away
+                self.name_comparison_table.mark_dirty()
+                self.name_comparison_table.flush()
                 return True
         return False
 
@@ -1,3 +1,35 @@
-from .base_api import API_Instance, BaseAPI
-from .the_odds_api import TheOddsAPI_V4
-from .betfair import Betfair
+import importlib
+from typing import TYPE_CHECKING, Any, Dict, List
+
+# imported on first use, an API's client library (betfairlightweight, requests) is only loaded when the API is
+_LAZY_IMPORTS: Dict[str, str] = {
+    'API_Instance': '.base_api',
+    'BaseAPI': '.base_api',
+    'TheOddsAPI_V4': '.the_odds_api',
+    'Betfair': '.betfair',
+    'ReplayBetfair': '.replay',
+    'ReplayBetting': '.replay',
+    'ReplayTheOddsAPI': '.replay',
+    'replay_clock': '.replay',
+}
+
+__all__ = list(_LAZY_IMPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(_LAZY_IMPORTS))
+
+
+if TYPE_CHECKING:
+    from .base_api import API_Instance, BaseAPI
+    from .betfair import Betfair
+    from .replay import ReplayBetfair, ReplayBetting, ReplayTheOddsAPI, replay_clock
+    from .the_odds_api import TheOddsAPI_V4
@@ -2,7 +2,7 @@ from abc import ABC, abstractmethod
 from typing import List, Optional, Tuple, Type, TypeVar
 
 from arb_search.sport_types import SportType
-from arb_search.user_event import UserEvent
+from arb_search.user_event import BetDelta, UserEvent
 from arb_search.utils import BookmakerStoredDict
 
 
@@ -20,7 +20,8 @@ class BaseAPI(ABC):
         pass
 
     @abstractmethod
-    def update_bet_data(self, event: UserEvent, bet_indexes: List[int]) -> bool:
+    def update_bet_data(self, event: UserEvent, bet_indexes: List[int]) -> BetDelta:
+        """Refresh the prices of the markets of the bets at bet_indexes and report what changed about those bets."""
         pass
 
     @abstractmethod
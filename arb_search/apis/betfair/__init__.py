@@ -1,2 +1,4 @@
 from .betfair import Betfair
+from .stream import BetfairMarketStream
+from .stream_server import LocalStreamServer
 from .utils import betfair_to_datetime, datetime_to_betfair_format
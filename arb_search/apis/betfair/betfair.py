@@ -1,4 +1,3 @@
-import json
 import threading
 from time import sleep
 from datetime import datetime, timedelta
@@ -9,14 +8,17 @@ from betfairlightweight import APIClient, filters
 from betfairlightweight.filters import price_projection
 
 from arb_search.apis.base_api import API_Instance, BaseAPI
-from arb_search.apis.utils import fixed_count_bin_packer
+from arb_search.capture import CaptureWriter
+from arb_search.config import config
+from arb_search.metrics import metrics
 from arb_search.sport_types import SportType
-from arb_search.user_event import UserBet, UserBookmaker, UserEvent
-from arb_search.utils import BookmakerStoredDict, StoredDict, team_name_matcher
+from arb_search.user_event import BetDelta, UserBet, UserBookmaker, UserEvent
+from arb_search.utils import BookmakerStoredDict, StoredDict, get_team_name_matcher
 
 from betting_event import BetType
 
 from .endpoints.betting import Betting_Limitless
+from .stream import BetfairMarketStream
 from .utils import (betfair_to_datetime, datetime_to_betfair_format,
                     price_projection_weight)
 
@@ -38,16 +40,23 @@ MARKET_TYPE_CODES = {
 }
 
 class Betfair(BaseAPI, APIClient):
-    def __init__(self, bookmaker_table: BookmakerStoredDict, default_start_time_range: Optional[Tuple[datetime, datetime]] = None) -> None:
-
-        APIClient.__init__(self, **json.load(open('settings/api_keys.json', 'r'))["betfair_api"], lightweight= True)
+    def __init__(self, bookmaker_table: BookmakerStoredDict, default_start_time_range: Optional[Tuple[datetime, datetime]] = None,
+                 capture: Optional[CaptureWriter] = None) -> None:
+        """
+        Args:
+            bookmaker_table (BookmakerStoredDict): Shared bookmaker table.
+            default_start_time_range (Tuple[datetime, datetime]): Default market start time range of gather_events.
+            capture (CaptureWriter): Records every catalogue and market book response, see ReplayBetfair.
+        """
+
+        APIClient.__init__(self, **config.api_key("betfair_api"), lightweight= True)
         BaseAPI.__init__(self, "betfair", bookmaker_table)
 
         self.bookmaker_name = "betfair_ex_uk"
         if self.bookmaker_name not in bookmaker_table:
             bookmaker_table[self.bookmaker_name] = UserBookmaker(self.bookmaker_name)
 
-        settings = json.load(open('settings/settings.json', 'r'))["apis"]["betfair"]
+        settings = config.load('settings')["apis"]["betfair"]
 
         if default_start_time_range is None:
             default_start_time_range = (datetime.now(), datetime.now() + timedelta(hours=settings["default_hours_range"]))
@@ -56,7 +65,26 @@ class Betfair(BaseAPI, APIClient):
         self._competitions_table = StoredDict('storage/betfair/competitions.pkl')
 
         self.betting = Betting_Limitless(self)
-        self.login()
+        self.streams: List[BetfairMarketStream] = []
+        self._market_streams: Dict[str, BetfairMarketStream] = {}
+        self._stream_events: Dict[str, UserEvent] = {}
+        self.capture = capture
+        # logged in on the first request, see _ensure_login
+        self._login_lock = threading.Lock()
+
+    def _ensure_login(self) -> None:
+        """Log in if there is no session yet, or it is past half its timeout."""
+        if not self.session_expired:
+            return
+        with self._login_lock:
+            if self.session_expired:
+                self.login()
+
+    @property
+    def request_headers(self) -> dict:
+        # every betting request reads its headers here, so this is where the first one logs in
+        self._ensure_login()
+        return super().request_headers
 
     def gather_events(self, sport_types: List[SportType], leagues: Optional[List[str]] = None, start_time_range: Optional[Tuple[datetime, datetime]] = None) -> List[UserEvent]:
         events_table: Dict[str, UserEvent] = {}
@@ -86,6 +114,8 @@ class Betfair(BaseAPI, APIClient):
         # market_projection = ['COMPETITION', 'EVENT', 'EVENT_TYPE', 'MARKET_START_TIME', 'MARKET_DESCRIPTION', 'RUNNER_DESCRIPTION', 'RUNNER_METADATA']
 
         markets = self.betting.list_all_market_catalogue(filter=market_filter, market_projection=['EVENT', 'COMPETITION', 'RUNNER_DESCRIPTION'])
+        if self.capture is not None:
+            self.capture.record(self.name, 'listMarketCatalogue', market_filter, markets)
 
         for market in markets:
             if not market["event"]["id"] in events_table:
@@ -98,74 +128,178 @@ class Betfair(BaseAPI, APIClient):
             if "competition" not in events_table[market["event"]["id"]].api_specific_data[self] and "competition" in market:
                 events_table[market["event"]["id"]].api_specific_data[self]["competition"] = market["competition"]
 
-            events_table[market["event"]["id"]].api_specific_data[self]["markets"][market["marketId"]] = {
+            market_data = {
                 "marketName": market["marketName"],
                 "totalMatched": market["totalMatched"],
                 "runners": market["runners"]
             }
+            market_data["outcomes"] = self._parse_market(events_table[market["event"]["id"]], market_data)
+            events_table[market["event"]["id"]].api_specific_data[self]["markets"][market["marketId"]] = market_data
 
             events_table[market["event"]["id"]].api_specific_data[self]["total_runner_count"] += len(market["runners"])
 
         return self.update_events(list(events_table.values()))
 
-    def update_bet_data(self, event: UserEvent, bet_indexes: List[int]) -> bool:
-        new_bets: List[UserBet] = []
-        bet_indexes.sort()
-        updates_needed = False
-        bets = [event.bets[index] for index in bet_indexes]
-        market_books = self.betting.list_market_book(
-            [bet.api_specific_data[self]["market_id"] for bet in bets if self in bet.api_specific_data and "market_id" in bet.api_specific_data[self]],
-            price_projection= price_projection(price_data=['EX_BEST_OFFERS']),
-            order_projection= 'EXECUTABLE')
-        
-        for market_book in market_books:
-            for current_runner, new_runner in zip(event.api_specific_data[self]["markets"][market_book['marketId']]["runners"], market_book["runners"]):
-                assert current_runner["selectionId"] == new_runner["selectionId"]
-                new_runner.update(current_runner)
-            new_bets.extend(self._build_bets(event, market_book)) # type: ignore
-        
-        
-        for old_index in bet_indexes[::-1]:
-            old_bet = event.bets[old_index]
-            if old_bet not in new_bets:
-                updates_needed = True
-                event.bets.remove(old_bet)
+    def update_bet_data(self, event: UserEvent, bet_indexes: List[int]) -> BetDelta:
+        """Refresh the markets of the bets at bet_indexes, from the stream's ladders when it has them. See UserEvent.refresh_bets."""
+        # the event's lock keeps a running stream from changing its bets meanwhile
+        with event.lock:
+            bets = [event.bets[index] for index in bet_indexes if "market_id" in event.bets[index].api_specific_data.get(self, {})]
+            market_ids = list(dict.fromkeys(bet.api_specific_data[self]["market_id"] for bet in bets))
+            if not market_ids:
+                return BetDelta()
+
+            streams = [self._market_streams.get(market_id) for market_id in market_ids]
+            if all(stream is not None and stream.running and stream.has_market(market_id) for stream, market_id in zip(streams, market_ids)):
+                market_books = [market_book for stream, market_id in zip(streams, market_ids) for market_book in stream.snap([market_id])]    # type: ignore
             else:
-                new_bet = new_bets[new_bets.index(old_bet)]
-                new_bet.wager = old_bet.wager
-                new_bet.previous_wager = old_bet.previous_wager
-                if old_bet.wager > new_bet.volume:
-                    updates_needed = True
-                event.add_bet(new_bet)
-
-        return updates_needed
+                market_books = self.betting.list_market_book(
+                    market_ids,
+                    price_projection= price_projection(price_data=['EX_BEST_OFFERS']),
+                    order_projection= 'EXECUTABLE')
+                if self.capture is not None:
+                    self.capture.record(self.name, 'listMarketBook', {'marketIds': market_ids}, market_books)
+
+            # markets missing from the response are closed, their bets are gone
+            new_bets: List[UserBet] = []
+            with metrics.timer('build_seconds', api= self.name):
+                for market_book in market_books:
+                    if market_book.get("status") not in ("SUSPENDED", "CLOSED"):
+                        new_bets.extend(self._build_bets(event, market_book))
+            metrics.inc('bets_built_total', len(new_bets), api= self.name)
+
+            refreshed_market_ids = set(market_ids)
+            return event.refresh_bets(
+                new_bets,
+                refreshed= lambda bet: bet.api_specific_data.get(self, {}).get("market_id") in refreshed_market_ids,
+                watched= bets,
+                outcome_side= self._outcome_side
+            )
+
+    def start_stream(self, events: List[UserEvent], wait: bool = True, markets_per_stream: int = 200, **stream_kwargs) -> List[BetfairMarketStream]:
+        """Subscribe to the markets of events on the Exchange Stream API and keep their bets up to date in place.
+
+        A subscription holds at most markets_per_stream markets, more are split over several streams, each its own
+        connection. While the streams run update_bet_data reads prices from the local ladders instead of calling
+        listMarketBook.
+
+        Args:
+            events (List[UserEvent]): Events gathered by this API.
+            wait (bool): Block until the subscription images have been applied to the events.
+            markets_per_stream (int): Betfair allows 200 markets per subscription unless the account has a higher limit.
+            **stream_kwargs: Passed to BetfairMarketStream, e.g. host, port and use_ssl for a LocalStreamServer.
+        """
+        self.stop_stream()
+        self._ensure_login()
+        self._stream_events = {market_id: event for event in events for market_id in event.api_specific_data[self]["markets"]}
+        market_ids = list(self._stream_events)
+        for start in range(0, len(market_ids), markets_per_stream):
+            stream = BetfairMarketStream(self, self._apply_market_book, max_markets= markets_per_stream, **stream_kwargs)
+            stream.start(market_ids[start:start + markets_per_stream])
+            self.streams.append(stream)
+            self._market_streams.update((market_id, stream) for market_id in stream.market_ids)
+
+        for stream in self.streams:
+            if wait and not stream.wait_for_image(timeout= 30):
+                print("Betfair stream image not received within 30s")
+        return self.streams
+
+    def stop_stream(self) -> None:
+        for stream in self.streams:
+            stream.stop()
+        self.streams = []
+        self._market_streams = {}
+        self._stream_events = {}
+
+    def _apply_market_book(self, market_book: dict) -> None:
+        """Bring the prices of one market in line with a market book from the stream.
+
+        Prices still on offer are updated in place, in the event's odds book if it is compacted and otherwise in its
+        bets, new prices are appended. Prices that have gone are removed unless a wager has been placed on them, those
+        are kept with a volume of 0 so update_bet_data still reports them.
+        """
+        market_id = market_book["marketId"]
+        event = self._stream_events.get(market_id)
+        if event is None:
+            return
+
+        if market_book.get("status") in ("SUSPENDED", "CLOSED"):
+            new_bets: List[UserBet] = []
+        else:
+            new_bets = self._build_bets(event, market_book)
+        new_bets_table = {(bet.api_specific_data[self]["selection_id"], bet.value, bet.lay, bet.odds): bet for bet in new_bets}
+
+        with event.lock:
+            if event.compacted:
+                book = event.odds_book
+                gone = []
+                for row in range(len(book)):
+                    data = book.sources[book.source[row]].get(self)
+                    if data is None or data.get("market_id") != market_id:
+                        continue
+                    new_bet = new_bets_table.pop((data["selection_id"], book.outcome_key(row)[1], bool(book.lay[row]), book.odds[row]), None)
+                    if new_bet is not None:
+                        book.volume[row] = new_bet.volume
+                        book.update_time[row] = new_bet.update_time.timestamp()
+                    elif book.wager[row] > 0:
+                        book.volume[row] = 0.0
+                    else:
+                        gone.append(row)
+                book.remove_rows(gone)
+                book.extend(new_bets_table.values())
+                return
+
+            bets = event.bets
+            gone = []
+            for index, bet in enumerate(bets):
+                data = bet.api_specific_data.get(self)
+                if data is None or data.get("market_id") != market_id:
+                    continue
+                new_bet = new_bets_table.pop((data["selection_id"], bet.value, bet.lay, bet.odds), None)
+                if new_bet is not None:
+                    bet.volume = new_bet.volume
+                    bet.update_time = new_bet.update_time
+                elif bet.wager > 0:
+                    bet.volume = 0.0
+                else:
+                    gone.append(index)
+            for index in reversed(gone):
+                del bets[index]
+            bets.extend(new_bets_table.values())
 
     def update_events(self, events: List[UserEvent]) -> List[UserEvent]:
         price_projection_dict = price_projection(price_data=['EX_BEST_OFFERS'])
         market_id_runners_table: Dict[str, int] = {}
 
         for event in events:
-            for market_id in event.api_specific_data[self]["markets"].keys():
-                market_id_runners_table[market_id] = event.api_specific_data[self]["total_runner_count"]
+            for market_id, market_data in event.api_specific_data[self]["markets"].items():
+                market_id_runners_table[market_id] = len(market_data["runners"])
 
         all_market_books = self.betting.list_all_market_book(market_id_runners_table, price_projection= price_projection_dict, order_projection= 'EXECUTABLE', lightweight= True)
+        if self.capture is not None:
+            self.capture.record(self.name, 'listMarketBook', {'marketIds': list(market_id_runners_table)}, list(all_market_books.values()))
 
         for event in events:
             new_bets = []
-            for market_id in event.api_specific_data[self]["markets"].keys():
-                market_book = all_market_books.pop(market_id)
-                for current_runner, new_runner in zip(event.api_specific_data[self]["markets"][market_book['marketId']]["runners"], market_book["runners"]):
-                    assert current_runner["selectionId"] == new_runner["selectionId"]
-                    new_runner.update(current_runner)
-                # for new_bet in self._build_bets(event, market_book):
-                #     event.add_bet(new_bet)
-                new_bets.extend(self._build_bets(event, market_book))
-
-            if event.bets == []:
-                event.bets = new_bets
-            else:
-                for new_bet in new_bets:
-                    event.add_bet(new_bet)
+            market_ids = event.api_specific_data[self]["markets"].keys()
+            with metrics.timer('build_seconds', api= self.name):
+                for market_id in market_ids:
+                    market_book = all_market_books.pop(market_id, None)
+                    if market_book is not None and market_book.get("status") not in ("SUSPENDED", "CLOSED"):
+                        new_bets.extend(self._build_bets(event, market_book))
+            metrics.inc('bets_built_total', len(new_bets), api= self.name)
+
+            # a running stream rewrites the bets of its events on its own thread
+            with event.lock:
+                if event.bet_count == 0:
+                    event.bets = new_bets
+                else:
+                    event.refresh_bets(
+                        new_bets,
+                        refreshed= lambda bet: bet.api_specific_data.get(self, {}).get("market_id") in market_ids,
+                        watched= [bet for bet in event.bets if bet.wager > 0],
+                        outcome_side= self._outcome_side
+                    )
 
         return events
     
@@ -177,10 +311,52 @@ class Betfair(BaseAPI, APIClient):
             raise ValueError("Expected 4 values in result, but got {}".format(len(result)))
         return tuple(result) # type: ignore
 
+    def _outcome_side(self, bet: UserBet) -> Tuple[str, int, str, bool]:
+        data = bet.api_specific_data[self]
+        return (data["market_id"], data["selection_id"], bet.value, bet.lay)
+
     def _build_bets(self, event: UserEvent, market_book: dict) -> List[UserBet]:
+        """Turn a market book's prices into bets, the runners' bet types and values come from the catalogue's parsed outcomes."""
         bets_list = []
         market_data = event.api_specific_data[self]["markets"][market_book['marketId']]
+        if "outcomes" not in market_data:
+            market_data["outcomes"] = self._parse_market(event, market_data)
+        outcomes = market_data["outcomes"]
+        bookmaker = self.bookmaker_table[self.bookmaker_name]
+
+        for runner in market_book["runners"]:
+            outcome = outcomes.get((runner["selectionId"], runner["handicap"]))
+            if outcome is None:
+                continue
+            bet_type, bet_value = outcome
+            ex = runner.get("ex", {})
+            for market_key in ("availableToBack", "availableToLay"):
+                for price in ex.get(market_key, ()):    #TODO: add previous_wager here
+                    bets_list.append(
+                        UserBet(
+                            bet_type= bet_type,
+                            value= bet_value,
+                            odds= price["price"],
+                            bookmaker= bookmaker,
+                            lay= (market_key == "availableToLay"),
+                            volume= price["size"],
+                            api_specific_data= {
+                                self: {
+                                    "market_id": market_book['marketId'],
+                                    "selection_id": runner['selectionId']
+                                }
+                            }
+                        )
+                    )
 
+        return bets_list
+
+    def _parse_market(self, event: UserEvent, market_data: dict) -> Dict[Tuple[int, float], Tuple[BetType, str]]:
+        """Work out the bet type and value of each of a catalogue market's runners, keyed by (selectionId, handicap).
+
+        A market's runners never change, so this is done once when the catalogue is loaded. Runners without a bet value
+        ('Any Other Score') are left out.
+        """
         _home_team, _away_team = event.api_specific_data[self]["name"].split(' v ')
 
         team_table = {
@@ -190,7 +366,7 @@ class Betfair(BaseAPI, APIClient):
             "draw": "draw"
         }
 
-        team_names = list(team_table.keys())
+        team_name_matcher = get_team_name_matcher(tuple(team_table.keys())).match
 
         if not market_data["marketName"] == "Asian Handicap" and any(runner["handicap"] != 0.0 for runner in market_data["runners"]):
             raise ValueError(f"Non-zero handicap in non-asian handicap market {market_data['marketName']}")
@@ -202,7 +378,7 @@ class Betfair(BaseAPI, APIClient):
 
         elif market_data["marketName"] == "Match Odds":
             bet_type = BetType.MatchWinner
-            bet_values = [team_table[team_name_matcher(runner["runnerName"], team_names)] for runner in market_data["runners"]]
+            bet_values = [team_table[team_name_matcher(runner["runnerName"])] for runner in market_data["runners"]]
 
         elif market_data["marketName"] == "Double Chance":
             bet_type = BetType.DoubleChance
@@ -214,7 +390,7 @@ class Betfair(BaseAPI, APIClient):
 
         elif market_data["marketName"] == "Asian Handicap":
             bet_type = BetType.AsianHandicap
-            bet_values = [f'{team_table[team_name_matcher(runner["runnerName"], team_names)]} {runner["handicap"]}' for runner in market_data["runners"]]
+            bet_values = [f'{team_table[team_name_matcher(runner["runnerName"])]} {runner["handicap"]}' for runner in market_data["runners"]]
             # remove values that start with "draw"
             bet_value = [value for value in bet_values if not value.startswith("draw")] # TODO: figure out how to implement this for betfair
 
@@ -224,11 +400,11 @@ class Betfair(BaseAPI, APIClient):
 
         # elif market_data["marketName"].lower().endswith(" win to nil"):
         #     bet_type = BetType.Team_WinToNil
-        #     bet_values = [f'{team_table[team_name_matcher(market_data["marketName"][:-11].lower(), team_names)]} {runner["runnerName"].lower()}' for runner in market_data["runners"]]
+        #     bet_values = [f'{team_table[team_name_matcher(market_data["marketName"][:-11])]} {runner["runnerName"].lower()}' for runner in market_data["runners"]]
 
         elif market_data["marketName"] == "Match Odds and Both teams to Score":
             bet_type = BetType.Result_BothTeamsScore
-            bet_values = [team_table[team_name_matcher(runner["runnerName"][:runner["runnerName"].index("/")].lower(), team_names)] + runner["runnerName"][runner["runnerName"].index("/"):].lower() for runner in market_data["runners"]]
+            bet_values = [team_table[team_name_matcher(runner["runnerName"][:runner["runnerName"].index("/")])] + runner["runnerName"][runner["runnerName"].index("/"):].lower() for runner in market_data["runners"]]
 
         elif market_data["marketName"] == "Total Goals Odd/Even":
             bet_type = BetType.OddEven
@@ -236,7 +412,7 @@ class Betfair(BaseAPI, APIClient):
 
         elif market_data["marketName"].startswith("Match Odds and Over/Under") and market_data["marketName"].endswith(" Goals"):
             bet_type = BetType.Result_OverUnder
-            bet_values = [f'{team_table[team_name_matcher(runner["runnerName"][:runner["runnerName"].index("/")].lower(), team_names)]}/{runner["runnerName"][runner["runnerName"].index("/") + 1:-6].lower()}' for runner in market_data["runners"]]
+            bet_values = [f'{team_table[team_name_matcher(runner["runnerName"][:runner["runnerName"].index("/")])]}/{runner["runnerName"][runner["runnerName"].index("/") + 1:-6].lower()}' for runner in market_data["runners"]]
 
         elif market_data["marketName"].lower().startswith(_home_team.lower()) or market_data["marketName"].lower().startswith(_away_team.lower()):
             if market_data["marketName"].lower().startswith(_home_team.lower()):
@@ -260,26 +436,9 @@ class Betfair(BaseAPI, APIClient):
         else:
             raise ValueError(f"Unknown market type '{market_data['marketName']}'")
 
-        for runner_index, (bet_value, ex) in enumerate(zip(bet_values, [runner["ex"] for runner in market_book["runners"]])):
-            for market_key in ex:
-                if market_key not in ["availableToBack", "availableToLay"]:
-                    continue    #TODO: add previous_wager here
-                for price in ex[market_key]:
-                    bets_list.append(
-                        UserBet(
-                            bet_type= bet_type,
-                            value= bet_value,
-                            odds= price["price"],
-                            bookmaker= self.bookmaker_table[self.bookmaker_name],
-                            lay= (market_key == "availableToLay"),
-                            volume= price["size"],
-                            api_specific_data= {
-                                self: {
-                                    "market_id": market_book['marketId'],
-                                    "selection_id": market_book['runners'][runner_index]['selectionId']
-                                }
-                            }
-                        )
-                    )
+        if bet_type == BetType.ExactScore:
+            runners = [runner for runner in market_data["runners"] if not runner["runnerName"].startswith('Any')]
+        else:
+            runners = market_data["runners"]
 
-        return bets_list
+        return {(runner["selectionId"], runner["handicap"]): (bet_type, bet_value) for runner, bet_value in zip(runners, bet_values)}
@@ -1,37 +1,154 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime
-from time import sleep
-from typing import Dict, Iterator, List, Optional, Union
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta
+from time import perf_counter, sleep
+from typing import Dict, List, Optional, Tuple, Union
 
 import requests
 from betfairlightweight import metadata, resources
 from betfairlightweight.endpoints import Betting
 from betfairlightweight.filters import market_filter
 from betfairlightweight.metadata import list_market_book
-from ..utils import price_projection_weight
+from ....metrics import metrics
+from ...utils import weighted_bin_packer
+from ..utils import betfair_to_datetime, datetime_to_betfair_format, price_projection_weight
 
 class Betting_Limitless(Betting):
 
+    def request(self, method: str, params: dict, session: requests.Session) -> tuple:
+        """Betting.request, recording the call's latency, response size and JSON parse time in metrics."""
+        if not metrics.enabled:
+            return super().request(method, params, session)
+
+        endpoint = method.split('/')[-1]
+        start = perf_counter()
+        try:
+            response, response_json, elapsed_time = super().request(method, params, session)
+        except Exception:
+            metrics.inc('http_requests_total', api= 'betfair', endpoint= endpoint, status= 'error')
+            raise
+        total_time = perf_counter() - start
+
+        metrics.inc('http_requests_total', api= 'betfair', endpoint= endpoint, status= str(response.status_code))
+        metrics.observe('http_request_seconds', elapsed_time, api= 'betfair', endpoint= endpoint)
+        metrics.observe('parse_seconds', max(total_time - elapsed_time, 0.0), api= 'betfair', endpoint= endpoint)
+        metrics.inc('http_response_bytes_total', len(response.content), api= 'betfair', endpoint= endpoint)
+        return response, response_json, elapsed_time
+
     def list_all_market_catalogue(
             self,
             filter: dict = market_filter(),
             market_projection: Optional[list] = None,
             locale: Optional[str] = None,
             session: Optional[requests.Session] = None,
-            lightweight: bool = True
+            lightweight: bool = True,
+            partitions: int = 8,
+            max_workers: int = 8,
+            min_window: timedelta = timedelta(minutes= 1)
         ) -> Union[list, List[resources.MarketCatalogue]]:
+        """Return every market matching filter, however many pages that takes.
+
+        The filter's marketStartTime range is split into equal windows that are fetched concurrently. A window whose
+        page comes back full is split in half and both halves are fetched, windows no longer than min_window are paged
+        through serially instead. Windows share their boundary times, markets are de-duplicated by marketId. Without
+        both a from and a to time the range can't be split and the markets are paged through serially.
+
+        Args:
+            partitions (int): Windows the time range is split into to begin with.
+            max_workers (int): Maximum requests in flight.
+            min_window (timedelta): Shortest window that is split further, markets mostly start on the minute.
+        """
+        time_range = filter.get('marketStartTime') or {}
+        if 'from' not in time_range or 'to' not in time_range:
+            return self._list_market_catalogue_serial(filter, market_projection, locale, session, lightweight)
+
+        market_projection = list(market_projection) if market_projection is not None else []
+        max_results = self._catalogue_max_results(market_projection)
+        if 'EVENT' not in market_projection:
+            market_projection.append('EVENT')   # required for openDate
+
+        start, end = betfair_to_datetime(time_range['from']), betfair_to_datetime(time_range['to'])
+        step = (end - start) / max(partitions, 1)
+        windows = [(start + step * i, start + step * (i + 1) if i < partitions - 1 else end) for i in range(max(partitions, 1))]
+
+        window_results: List[Tuple[datetime, list]] = []
+        with ThreadPoolExecutor(max_workers= max_workers) as executor:
+            pending: Dict[Future, Tuple[datetime, datetime]] = {}
+
+            def submit(window: Tuple[datetime, datetime], serial: bool = False) -> None:
+                future = executor.submit(self._list_market_catalogue_window, filter, window, market_projection, max_results, locale, session, lightweight, serial)
+                pending[future] = window
+
+            for window in windows:
+                submit(window)
+
+            while pending:
+                done, _ = wait(pending.keys(), return_when= FIRST_COMPLETED)
+                for future in done:
+                    window_start, window_end = pending.pop(future)
+                    markets, complete = future.result()
+                    if complete:
+                        window_results.append((window_start, markets))
+                    elif window_end - window_start > min_window:
+                        middle = window_start + (window_end - window_start) / 2
+                        submit((window_start, middle))
+                        submit((middle, window_end))
+                    else:
+                        submit((window_start, window_end), serial= True)
 
-        max_results: int = 1000
         results: Dict[str, dict] = {}
-        from_str = ''
+        for _, markets in sorted(window_results, key= lambda window_result: window_result[0]):
+            for market in markets:
+                results.setdefault(market['marketId'], market)
+
+        return list(results.values())
+
+    def _list_market_catalogue_window(
+            self,
+            filter: dict,
+            window: Tuple[datetime, datetime],
+            market_projection: list,
+            max_results: int,
+            locale: Optional[str],
+            session: Optional[requests.Session],
+            lightweight: bool,
+            serial: bool = False
+        ) -> Tuple[list, bool]:
+        """Fetch the markets starting within window, returns them and whether they are all the window holds."""
+        window_filter = dict(filter)
+        window_filter['marketStartTime'] = {**filter['marketStartTime'],
+                                            'from': datetime_to_betfair_format(window[0]),
+                                            'to': datetime_to_betfair_format(window[1])}
+
+        if serial:
+            return self._list_market_catalogue_serial(window_filter, list(market_projection), locale, session, lightweight), True
+
+        markets: list = super().list_market_catalogue(window_filter, market_projection, 'FIRST_TO_START', max_results, locale, session, lightweight) # type: ignore
+        return markets, len(markets) < max_results
 
+    @staticmethod
+    def _catalogue_max_results(market_projection: Optional[list]) -> int:
+        max_results = 1000
         if market_projection is not None:
             request_weight = sum([metadata.list_market_catalogue.get(key, 0) for key in market_projection])
             if request_weight != 0:
                 max_results = 200 // request_weight
-        else:
-            market_projection = []
+        return max_results
 
+    def _list_market_catalogue_serial(
+            self,
+            filter: dict = market_filter(),
+            market_projection: Optional[list] = None,
+            locale: Optional[str] = None,
+            session: Optional[requests.Session] = None,
+            lightweight: bool = True
+        ) -> Union[list, List[resources.MarketCatalogue]]:
+
+        max_results: int = self._catalogue_max_results(market_projection)
+        results: Dict[str, dict] = {}
+        from_str = ''
+
+        if market_projection is None:
+            market_projection = []
         if 'EVENT' not in market_projection:
             market_projection.append('EVENT')   # required for openDate
 
@@ -79,17 +196,28 @@ class Betting_Limitless(Betting):
             bet_ids: Optional[list] = None,
             locale: Optional[str] = None,
             session: Optional[requests.Session] = None,
-            lightweight: bool = True
+            lightweight: bool = True,
+            max_runners: int = 250
         ) -> Dict[str, dict]:
+        """listMarketBook for any number of markets, split into as few requests as the limits allow.
+
+        A request may hold at most max_runners runners and 200 points of data weight. Betfair charges the price
+        projection's weight once per market, whatever its runner count, so the data weight limits the market count to
+        200 // weight and the runner count is a limit of its own. Markets are packed with weighted_bin_packer, weighted
+        by runner count, and the requests are sent concurrently.
+
+        Args:
+            market_id_runners_table (Dict[str, int]): The number of runners in each market.
+            max_runners (int): Maximum runners per request.
+        """
         results = {}
 
-        weight = price_projection_weight(price_projection)
-        chunk_size = 200 // weight
+        max_markets = max(200 // price_projection_weight(price_projection), 1)
 
         with ThreadPoolExecutor() as executor:
             futures = []
 
-            for market_ids in self._market_and_runner_limiter(market_id_runners_table, chunk_size):
+            for market_ids in weighted_bin_packer(market_id_runners_table, max_runners, max_markets):
                 futures.append(executor.submit(super().list_market_book, market_ids, price_projection, order_projection, match_projection, include_overall_position, partition_matched_by_strategy_ref, customer_strategy_refs, currency_code, matched_since, bet_ids, locale, session, lightweight))
 
             for future in as_completed(futures):
@@ -97,25 +225,3 @@ class Betting_Limitless(Betting):
                 results.update({market_book['marketId']: market_book for market_book in market_books})
 
         return results
-
-    @staticmethod
-    def _market_and_runner_limiter(market_id_runners_table: Dict[str, int], max_market_count: int, max_runners: int = 250) -> Iterator[List[str]]:
-        market_count = 0
-        runner_count = 0
-
-        market_ids: List[str] = []
-
-        for market_id, market_runners_count in market_id_runners_table.items():
-            market_count += 1
-            runner_count += market_runners_count
-            if market_count >= max_market_count or market_runners_count >= max_runners:
-                yield market_ids
-                market_count = 1
-                runner_count = market_runners_count
-                market_ids = []
-
-            market_ids.append(market_id)
-
-        if market_ids:
-            yield market_ids
-
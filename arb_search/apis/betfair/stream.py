@@ -0,0 +1,173 @@
+import queue
+import socket
+import ssl
+import threading
+from time import sleep
+from typing import Callable, List, Optional, Set
+
+from betfairlightweight import APIClient, filters
+from betfairlightweight.exceptions import ListenerError, SocketError
+from betfairlightweight.streaming import BetfairStream, StreamListener
+
+
+class _BetfairStream(BetfairStream):
+    """BetfairStream that can connect to any host and port, over plain TCP when use_ssl is False."""
+
+    def __init__(self, unique_id: int, listener: StreamListener, app_key: str, session_token: str, timeout: float,
+                 buffer_size: int, host: Optional[str], port: int = 443, use_ssl: bool = True) -> None:
+        super().__init__(unique_id, listener, app_key, session_token, timeout, buffer_size, None)
+        if host is not None:
+            self.host = self.HOSTS[host] if host in self.HOSTS else host
+        self.port = port
+        self.use_ssl = use_ssl
+
+    def _create_socket(self) -> socket.socket:
+        s = socket.create_connection((self.host, self.port), timeout= self.timeout)
+        if self.use_ssl:
+            s = ssl.create_default_context().wrap_socket(s, server_hostname= self.host)
+        s.settimeout(self.timeout)
+        return s
+
+
+class BetfairMarketStream:
+    """Keeps a local price ladder for each subscribed market up to date from the Betfair Exchange Stream API.
+
+    The subscription's image and every delta after it are applied to betfairlightweight's market caches by the socket
+    thread. The updated market books (listMarketBook format dicts) are handed to on_market_update from a second thread
+    so slow consumers don't hold up the socket. If the connection drops it is reopened and resubscribed from the last
+    clk, so only the changes missed while disconnected are sent. One subscription holds at most max_markets markets,
+    more need several streams.
+    """
+
+    def __init__(self, client: APIClient, on_market_update: Optional[Callable[[dict], None]] = None,
+                 fields: Optional[List[str]] = None, ladder_levels: int = 3, conflate_ms: Optional[int] = None,
+                 heartbeat_ms: Optional[int] = None, host: Optional[str] = None, port: int = 443, use_ssl: bool = True,
+                 timeout: float = 64, reconnect_delay: float = 2.0, max_reconnects: int = 10, max_markets: int = 200) -> None:
+        """
+        Args:
+            client (APIClient): Logged in client, its app key and session token authenticate the stream.
+            on_market_update (Callable[[dict], None]): Called with each updated market book.
+            fields (List[str]): Market data fields, defaults to EX_BEST_OFFERS and EX_MARKET_DEF.
+            ladder_levels (int): Price levels kept per side for EX_BEST_OFFERS.
+            conflate_ms (int): Conflation rate asked of the server.
+            heartbeat_ms (int): Heartbeat rate asked of the server.
+            host (str): Betfair host name ('integration', 'sports_data') or any other address, defaults to the live stream.
+            port (int): Port to connect to.
+            use_ssl (bool): Wrap the connection in TLS, disable for a LocalStreamServer.
+            timeout (float): Socket timeout, must be longer than the heartbeat rate.
+            reconnect_delay (float): Seconds to wait before reconnecting after the connection drops.
+            max_reconnects (int): Reconnect attempts before giving up.
+            max_markets (int): Markets one subscription may hold, Betfair allows 200 unless the account has a higher limit.
+        """
+        self.client = client
+        self.on_market_update = on_market_update
+        self.fields = fields if fields is not None else ['EX_BEST_OFFERS', 'EX_MARKET_DEF']
+        self.ladder_levels = ladder_levels
+        self.conflate_ms = conflate_ms
+        self.heartbeat_ms = heartbeat_ms
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnects = max_reconnects
+        self.max_markets = max_markets
+
+        self.output_queue: "queue.Queue[List[dict]]" = queue.Queue()
+        self.listener = StreamListener(output_queue= self.output_queue, max_latency= None, lightweight= True)
+        self._stream = _BetfairStream(0, self.listener, client.app_key, client.session_token, timeout, 1024 * 64,
+                                      host, port, use_ssl)
+
+        self.market_ids: List[str] = []
+        self._market_id_set: Set[str] = set()
+        self.updates_applied: int = 0
+        self.error: Optional[BaseException] = None
+        self._stopped = threading.Event()
+        self._subscribed = threading.Event()
+        self._read_thread: Optional[threading.Thread] = None
+        self._apply_thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._read_thread is not None and self._read_thread.is_alive()
+
+    def start(self, market_ids: List[str]) -> None:
+        """Subscribe to market_ids and start the reading and applying threads."""
+        if self.running:
+            raise RuntimeError("Stream already running")
+        if len(market_ids) > self.max_markets:
+            raise ValueError(f"{len(market_ids)} markets is over the limit of {self.max_markets} per subscription")
+        self.market_ids = list(market_ids)
+        self._market_id_set = set(market_ids)
+        self._stopped.clear()
+        self._subscribe()
+
+        self._apply_thread = threading.Thread(target= self._apply_loop, name= "betfair-stream-apply", daemon= True)
+        self._apply_thread.start()
+        self._read_thread = threading.Thread(target= self._read_loop, name= "betfair-stream-read", daemon= True)
+        self._read_thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._stream.stop()
+        for thread in (self._read_thread, self._apply_thread):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join(timeout= 5)
+
+    def wait_for_image(self, timeout: Optional[float] = None) -> bool:
+        """Block until the subscription image has been applied, returns False on timeout."""
+        return self._subscribed.wait(timeout)
+
+    def has_market(self, market_id: str) -> bool:
+        """Whether market_id is subscribed and the subscription image has arrived, so snap has its ladder."""
+        return market_id in self._market_id_set and self._subscribed.is_set()
+
+    def snap(self, market_ids: Optional[List[str]] = None) -> List[dict]:
+        """Current market books from the local ladders, no request is made."""
+        return self.listener.snap(market_ids)
+
+    def _subscribe(self, initial_clk: Optional[str] = None, clk: Optional[str] = None) -> None:
+        self._stream.subscribe_to_markets(
+            market_filter= filters.streaming_market_filter(market_ids= self.market_ids),
+            market_data_filter= filters.streaming_market_data_filter(fields= self.fields, ladder_levels= self.ladder_levels),
+            initial_clk= initial_clk,
+            clk= clk,
+            conflate_ms= self.conflate_ms,
+            heartbeat_ms= self.heartbeat_ms
+        )
+
+    def _read_loop(self) -> None:
+        reconnects = 0
+        resubscribe = False
+        while not self._stopped.is_set():
+            try:
+                if resubscribe:
+                    self._subscribe(self.listener.initial_clk, self.listener.clk)
+                self._stream.start()
+            except (SocketError, ListenerError) as e:
+                if self._stopped.is_set():
+                    break
+                if reconnects >= self.max_reconnects:
+                    print(f"Betfair stream gave up after {reconnects} reconnects: {e}")
+                    self.error = e
+                    break
+                reconnects += 1
+                resubscribe = True
+                print(f"Betfair stream disconnected ({e}), reconnecting")
+                sleep(self.reconnect_delay)
+            else:
+                break
+        self._stopped.set()
+
+    def _apply_loop(self) -> None:
+        while not self._stopped.is_set() or not self.output_queue.empty():
+            try:
+                market_books = self.output_queue.get(timeout= 0.1)
+            except queue.Empty:
+                market_books = []
+            for market_book in market_books:
+                if self.on_market_update is not None:
+                    try:
+                        self.on_market_update(market_book)
+                    except Exception as e:
+                        print(f"Failed to apply stream update for market {market_book.get('marketId')}: {e}")
+                self.updates_applied += 1
+            # the image is queued before initialClk can be read here, so once both are seen it has been applied
+            if not self._subscribed.is_set() and self.listener.initial_clk is not None and self.output_queue.empty():
+                self._subscribed.set()
@@ -0,0 +1,210 @@
+import json
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+RunnerKey = Tuple[int, float]     # (selectionId, handicap)
+
+
+class _StreamHandler(socketserver.StreamRequestHandler):
+    server: "_ThreadingServer"
+
+    def handle(self) -> None:
+        owner = self.server.owner
+        self.subscription_id: Optional[int] = None
+        self.send_lock = threading.Lock()
+        self.send({"op": "connection", "connectionId": f"local-{id(self)}"})
+
+        while True:
+            try:
+                line = self.rfile.readline()
+            except OSError:
+                break
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+            except ValueError:
+                continue
+            owner._handle(self, request)
+
+        owner._disconnected(self)
+
+    def send(self, message: dict) -> None:
+        data = (json.dumps(message) + "\r\n").encode("utf-8")
+        with self.send_lock:
+            try:
+                self.wfile.write(data)
+                self.wfile.flush()
+            except OSError:
+                pass
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    owner: "LocalStreamServer"
+
+
+class LocalStreamServer:
+    """Stand-in for the Betfair Exchange Stream API, serving markets held in memory over plain TCP.
+
+    Speaks enough of the protocol for BetfairMarketStream: connection, authentication, heartbeat and marketSubscription
+    messages, a SUB_IMAGE of the subscribed markets, then an UPDATE for every call to set_prices. Prices are sent as
+    EX_BEST_OFFERS level ladders ([level, price, size], size 0 removes a level) limited to the subscription's
+    ladderLevels. Any app key and session token are accepted.
+
+    Example:
+        server = LocalStreamServer()
+        server.add_market("1.23", [(47972, 0.0), (47973, 0.0)])
+        server.set_prices("1.23", 47972, back= {2.0: 10.0}, lay= {2.02: 5.0})
+        server.start()
+        stream = BetfairMarketStream(client, host= server.host, port= server.port, use_ssl= False)
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._server = _ThreadingServer((host, port), _StreamHandler, bind_and_activate= True)
+        self._server.owner = self
+        self.host, self.port = self._server.server_address[:2]
+
+        # market_id -> runner -> side ("back"/"lay") -> price -> size
+        self.markets: Dict[str, Dict[RunnerKey, Dict[str, Dict[float, float]]]] = {}
+        self.market_status: Dict[str, str] = {}
+        self._clients: Dict[_StreamHandler, Tuple[List[str], int]] = {}     # client -> (market ids, ladder levels)
+        self._clk = 0
+        self._lock = threading.RLock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target= self._server.serve_forever, name= "local-stream-server", daemon= True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        with self._lock:
+            for client in list(self._clients):
+                self._close(client)
+        self._server.server_close()
+
+    def __enter__(self) -> 'LocalStreamServer':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def add_market(self, market_id: str, runners: List[RunnerKey], status: str = "OPEN") -> None:
+        with self._lock:
+            self.markets[market_id] = {(selection_id, float(handicap)): {"back": {}, "lay": {}} for selection_id, handicap in runners}
+            self.market_status[market_id] = status
+
+    def set_prices(self, market_id: str, selection_id: int, back: Optional[Dict[float, float]] = None,
+                   lay: Optional[Dict[float, float]] = None, handicap: float = 0.0) -> None:
+        """Change the sizes available at prices on one runner, a size of 0 removes the price. Subscribers get the delta."""
+        with self._lock:
+            runner = self.markets[market_id][(selection_id, float(handicap))]
+            before = {client: self._runner_levels(runner, levels) for client, (market_ids, levels) in self._clients.items() if market_id in market_ids}
+
+            for side, prices in (("back", back), ("lay", lay)):
+                for price, size in (prices or {}).items():
+                    if size:
+                        runner[side][price] = size
+                    else:
+                        runner[side].pop(price, None)
+
+            for client, old_levels in before.items():
+                new_levels = self._runner_levels(runner, self._clients[client][1])
+                change = {"id": selection_id, "hc": handicap}
+                for side, key in (("back", "batb"), ("lay", "batl")):
+                    diff = self._level_diff(old_levels[side], new_levels[side])
+                    if diff:
+                        change[key] = diff
+                if len(change) > 2:
+                    self._send_change(client, "UPDATE", [{"id": market_id, "rc": [change]}])
+
+    def set_status(self, market_id: str, status: str) -> None:
+        """Change a market's status (OPEN, SUSPENDED, CLOSED), subscribers get the new market definition."""
+        with self._lock:
+            self.market_status[market_id] = status
+            for client, (market_ids, _) in self._clients.items():
+                if market_id in market_ids:
+                    self._send_change(client, "UPDATE", [{"id": market_id, "marketDefinition": self._market_definition(market_id)}])
+
+    def disconnect_all(self) -> None:
+        """Drop every client connection, to exercise reconnects."""
+        with self._lock:
+            for client in list(self._clients):
+                self._close(client)
+
+    def _handle(self, client: _StreamHandler, request: dict) -> None:
+        op = request.get("op")
+        request_id = request.get("id")
+
+        if op in ("authentication", "heartbeat"):
+            client.send({"op": "status", "id": request_id, "statusCode": "SUCCESS", "connectionClosed": False})
+
+        elif op == "marketSubscription":
+            market_ids = [market_id for market_id in (request.get("marketFilter") or {}).get("marketIds", []) if market_id in self.markets]
+            levels = (request.get("marketDataFilter") or {}).get("ladderLevels") or 3
+            client.send({"op": "status", "id": request_id, "statusCode": "SUCCESS", "connectionClosed": False})
+            with self._lock:
+                client.subscription_id = request_id
+                self._clients[client] = (market_ids, levels)
+                changes = []
+                for market_id in market_ids:
+                    rc = []
+                    for (selection_id, handicap), runner in self.markets[market_id].items():
+                        runner_levels = self._runner_levels(runner, levels)
+                        rc.append({"id": selection_id, "hc": handicap, "batb": runner_levels["back"], "batl": runner_levels["lay"]})
+                    changes.append({"id": market_id, "img": True, "marketDefinition": self._market_definition(market_id), "rc": rc})
+                # a resubscription (clk given) is answered with a fresh image too, which the client treats the same
+                self._send_change(client, "SUB_IMAGE", changes, initial= True)
+
+        else:
+            client.send({"op": "status", "id": request_id, "statusCode": "FAILURE", "errorCode": "INVALID_REQUEST",
+                         "errorMessage": f"Unsupported op {op}", "connectionClosed": False})
+
+    def _send_change(self, client: _StreamHandler, change_type: str, market_changes: List[dict], initial: bool = False) -> None:
+        self._clk += 1
+        message = {"op": "mcm", "id": client.subscription_id, "clk": str(self._clk), "pt": int(time.time() * 1000),
+                   "ct": change_type, "mc": market_changes}
+        if initial:
+            message["initialClk"] = str(self._clk)
+        client.send(message)
+
+    def _market_definition(self, market_id: str) -> dict:
+        return {
+            "status": self.market_status[market_id],
+            "inPlay": False,
+            "version": self._clk,
+            "runners": [{"id": selection_id, "hc": handicap, "status": "ACTIVE", "sortPriority": i + 1}
+                        for i, (selection_id, handicap) in enumerate(self.markets[market_id])]
+        }
+
+    @staticmethod
+    def _runner_levels(runner: Dict[str, Dict[float, float]], levels: int) -> Dict[str, List[List[float]]]:
+        back = sorted(runner["back"].items(), reverse= True)[:levels]
+        lay = sorted(runner["lay"].items())[:levels]
+        return {
+            "back": [[level, price, size] for level, (price, size) in enumerate(back)],
+            "lay": [[level, price, size] for level, (price, size) in enumerate(lay)]
+        }
+
+    @staticmethod
+    def _level_diff(old: List[List[float]], new: List[List[float]]) -> List[List[float]]:
+        diff = [level for level in new if level not in old]
+        diff += [[level, 0, 0] for level in range(len(new), len(old))]
+        return diff
+
+    def _disconnected(self, client: _StreamHandler) -> None:
+        with self._lock:
+            self._clients.pop(client, None)
+
+    def _close(self, client: _StreamHandler) -> None:
+        self._clients.pop(client, None)
+        try:
+            client.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
@@ -0,0 +1,151 @@
+import json
+import tempfile
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from arb_search.capture import ReplayClock, ResponseQueues
+from arb_search.user_event import UserBookmaker
+from arb_search.utils import BookmakerStoredDict
+
+from .base_api import BaseAPI
+from .betfair import Betfair
+from .the_odds_api import TheOddsAPI_V4, TheOddsAPIError
+
+
+def replay_clock(records: Iterable[dict], speed: Optional[float] = None) -> ReplayClock:
+    """A clock starting at the first record, to share between the replay APIs of one capture."""
+    return ReplayClock(min((record['t'] for record in records), default= 0.0), speed)
+
+
+class ReplayTheOddsAPI(TheOddsAPI_V4):
+    """TheOddsAPI_V4 answering its requests from a capture instead of the network, without an API key or quota.
+
+    Requests are matched to captured responses by endpoint and parameters, apart from the commence time range, which
+    follows the clock. A request made more than once gets the responses in the order they were captured, then the
+    last one again. The response cache is kept in a temporary folder, so replayed and real responses never mix.
+
+    Example:
+        records = list(read_capture('storage/captures'))
+        clock = replay_clock(records, speed= 1.0)
+        handler = API_Handler([ReplayTheOddsAPI(bookmaker_table, records, clock= clock), ReplayBetfair(bookmaker_table, records, clock= clock)])
+    """
+    IGNORED_PARAMS = ('commenceTimeFrom', 'commenceTimeTo')
+
+    def __init__(self, bookmaker_table: BookmakerStoredDict, records: Iterable[dict], default_start_time_range: Optional[Tuple[Optional[datetime], Optional[datetime]]] = None,
+                 speed: Optional[float] = None, clock: Optional[ReplayClock] = None, **kwargs) -> None:
+        """
+        Args:
+            records (Iterable[dict]): Capture records, see read_capture. Records of other APIs are skipped.
+            speed (float): Replay speed of a clock of its own, see ReplayClock. None replays as fast as possible.
+            clock (ReplayClock): Clock shared with other replay APIs, overrides speed.
+            **kwargs: Passed to TheOddsAPI_V4.
+        """
+        super().__init__(bookmaker_table, default_start_time_range, api_key= 'replay', **kwargs)
+        own_records = [record for record in records if record['source'] == self.name]
+        self.responses = ResponseQueues()
+        for record in own_records:
+            self.responses.add(self._replay_key(record['endpoint'], record['request']), record)
+        self.clock = clock if clock is not None else replay_clock(own_records, speed)
+
+        self._cache_dir = tempfile.TemporaryDirectory(prefix= 'replay-')
+        self.cache_dir = self._cache_dir.name
+
+    def _replay_key(self, endpoint: str, params: Dict[str, str]) -> Tuple[str, str]:
+        return endpoint, json.dumps({key: value for key, value in params.items() if key not in self.IGNORED_PARAMS}, sort_keys= True)
+
+    def _fetch(self, endpoint: str, params: dict) -> requests.Response:
+        normalized_params = self._normalize_params(params)
+        record = self.responses.next(self._replay_key(endpoint, normalized_params))
+        if record is None:
+            raise TheOddsAPIError(f'No captured response for {endpoint} with {normalized_params}', 404)
+        self.clock.wait(record['t'])
+
+        response = requests.Response()
+        response.status_code = record['response']['status']
+        response.headers = CaseInsensitiveDict(record['response']['headers'])
+        response._content = record['response']['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = f'{self.BASE_URL}/{endpoint}'
+
+        if response.status_code != 200:
+            raise TheOddsAPIError(f'Failed to get odds: status_code {response.status_code}, response body {response.text}', response.status_code)
+        return response
+
+
+class ReplayBetting:
+    """Stands in for Betting_Limitless, answering catalogue and market book requests from captured responses.
+
+    Filters are ignored: each catalogue request gets the next captured catalogue, and every market gets its captured
+    books in order, then the last one again. Markets that were never captured are left out, as closed markets are.
+    """
+
+    def __init__(self, records: Iterable[dict], clock: ReplayClock, source: str = 'betfair') -> None:
+        self.clock = clock
+        self.catalogues = ResponseQueues()
+        self.market_books = ResponseQueues()
+        for record in records:
+            if record['source'] != source:
+                continue
+            if record['endpoint'] == 'listMarketCatalogue':
+                self.catalogues.add(None, record)
+            elif record['endpoint'] == 'listMarketBook':
+                for market_book in record['response']:
+                    self.market_books.add(market_book['marketId'], {'t': record['t'], 'market_book': market_book})
+
+    def list_all_market_catalogue(self, *args, **kwargs) -> List[dict]:
+        record = self.catalogues.next(None)
+        if record is None:
+            return []
+        self.clock.wait(record['t'])
+        return record['response']
+
+    def list_all_market_book(self, market_id_runners_table: Dict[str, int], *args, **kwargs) -> Dict[str, dict]:
+        return {market_book['marketId']: market_book for market_book in self._market_books(market_id_runners_table)}
+
+    def list_market_book(self, market_ids: List[str], *args, **kwargs) -> List[dict]:
+        return self._market_books(market_ids)
+
+    def _market_books(self, market_ids: Iterable[str]) -> List[dict]:
+        entries = [entry for entry in map(self.market_books.next, market_ids) if entry is not None]
+        if entries:
+            self.clock.wait(max(entry['t'] for entry in entries))
+        return [entry['market_book'] for entry in entries]
+
+
+class ReplayBetfair(Betfair):
+    """Betfair answering its catalogue and market book requests from a capture, it never logs in. See ReplayBetting."""
+
+    def __init__(self, bookmaker_table: BookmakerStoredDict, records: Iterable[dict], default_start_time_range: Optional[Tuple[datetime, datetime]] = None,
+                 speed: Optional[float] = None, clock: Optional[ReplayClock] = None) -> None:
+        """
+        Args:
+            records (Iterable[dict]): Capture records, see read_capture. Records of other APIs are skipped.
+            speed (float): Replay speed of a clock of its own, see ReplayClock. None replays as fast as possible.
+            clock (ReplayClock): Clock shared with other replay APIs, overrides speed.
+        """
+        BaseAPI.__init__(self, "betfair", bookmaker_table)
+
+        self.bookmaker_name = "betfair_ex_uk"
+        if self.bookmaker_name not in bookmaker_table:
+            bookmaker_table[self.bookmaker_name] = UserBookmaker(self.bookmaker_name)
+
+        own_records = [record for record in records if record['source'] == self.name]
+        if clock is None:
+            clock = replay_clock(own_records, speed)
+        if default_start_time_range is None:
+            capture_start = datetime.fromtimestamp(clock.start)
+            default_start_time_range = (capture_start, capture_start + timedelta(days= 1))
+        self.default_start_time_range = default_start_time_range
+
+        self._competitions_table = {market['competition']['name']: market['competition']['id']
+                                    for record in own_records if record['endpoint'] == 'listMarketCatalogue'
+                                    for market in record['response'] if 'competition' in market}
+
+        self.betting = ReplayBetting(own_records, clock, self.name)     # type: ignore
+        self.streams = []
+        self._market_streams = {}
+        self._stream_events = {}
+        self.capture = None
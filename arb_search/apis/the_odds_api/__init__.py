@@ -1 +1,2 @@
-from .the_odds_api import TheOddsAPI_V4
\ No newline at end of file
+from .planner import ScanPlan, ScanPlanner
+from .the_odds_api import QuotaReserveReached, RefreshBudgetExhausted, TheOddsAPI_V4, TheOddsAPIError
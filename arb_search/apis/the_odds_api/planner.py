@@ -0,0 +1,157 @@
+import threading
+from typing import Container, Dict, Iterable, List, NamedTuple, Optional
+
+from arb_search.utils import StoredDict
+
+
+class PlannedSport(NamedTuple):
+    sport_key: str
+    odds_cost: int                  # quota for the sport's _get_odds call
+    alternate_events: int           # events to fetch alternate markets for, 0 skips them
+    alternates_cost: int            # quota for those _get_event_odds calls
+    expected_opportunities: float
+
+
+class ScanPlan:
+    """The sports a scan covers, and the budget its requests are charged to as they are made.
+
+    TheOddsAPI_V4 charges each request that goes over the network with try_acquire, cached responses are free, so
+    self.spent is the quota the scan actually used and never exceeds self.budget.
+    """
+
+    def __init__(self, budget: int, sports: List[PlannedSport]) -> None:
+        self.budget = budget
+        self.sports = sports
+        self.spent: int = 0
+        self._by_key = {sport.sport_key: sport for sport in sports}
+        self._lock = threading.Lock()
+
+    def try_acquire(self, cost: int) -> bool:
+        """Charge a request's cost to the budget, False if there isn't enough left."""
+        with self._lock:
+            if self.spent + cost > self.budget:
+                return False
+            self.spent += cost
+            return True
+
+    @property
+    def estimated_cost(self) -> int:
+        return sum(sport.odds_cost + sport.alternates_cost for sport in self.sports)
+
+    @property
+    def expected_opportunities(self) -> float:
+        return sum(sport.expected_opportunities for sport in self.sports)
+
+    def __contains__(self, sport_key: str) -> bool:
+        return sport_key in self._by_key
+
+    def __getitem__(self, sport_key: str) -> PlannedSport:
+        return self._by_key[sport_key]
+
+    def __str__(self) -> str:
+        lines = [f"Scan plan: {len(self.sports)} sports, estimated cost {self.estimated_cost}/{self.budget} requests, "
+                 f"{self.expected_opportunities:.2f} expected opportunities"]
+        for sport in self.sports:
+            alternates = f"alternates for {sport.alternate_events} events ({sport.alternates_cost})" if sport.alternate_events else "no alternates"
+            lines.append(f"  {sport.sport_key}: odds ({sport.odds_cost}), {alternates}, {sport.expected_opportunities:.2f} expected")
+        return "\n".join(lines)
+
+
+class ScanPlanner:
+    """Chooses which the-odds-api calls to make within a quota budget.
+
+    Each sport's history ({scans, events, opportunities}) gives its expected events per scan and the rate at which
+    those events turned out profitable, smoothed with a prior so unseen sports are still tried. Sports are picked in
+    order of expected opportunities per request for their _get_odds call, those whose odds are cached cost nothing,
+    then the remaining budget goes to the _get_event_odds (alternate markets) calls with the best expected
+    opportunities per request.
+    """
+
+    def __init__(self, history: Optional[StoredDict] = None, prior_events: float = 10.0, prior_opportunities: float = 1.0,
+                 prior_trials: float = 20.0, alternates_share: float = 0.5, path: str = 'storage/the-odds-API_v4/scan_history.json') -> None:
+        """
+        Args:
+            history (StoredDict): Per sport scan history, opened from path when it is first used if None.
+            prior_events (float): Expected events per scan for a sport that has never been scanned.
+            prior_opportunities (float): Pseudo-count of profitable events added to every sport's history.
+            prior_trials (float): Pseudo-count of events those prior opportunities came from.
+            alternates_share (float): Share of a sport's opportunities that need the alternate markets.
+            path (str): File of the default history.
+        """
+        self._history = history
+        self.path = path
+        self.prior_events = prior_events
+        self.prior_opportunities = prior_opportunities
+        self.prior_trials = prior_trials
+        self.alternates_share = alternates_share
+
+    @property
+    def history(self) -> StoredDict:
+        if self._history is None:
+            self._history = StoredDict(self.path, method= 'json', write_behind= True)
+        return self._history
+
+    def expected_events(self, sport_key: str) -> float:
+        record = self.history.get(sport_key)
+        if not record or not record["scans"]:
+            return self.prior_events
+        return record["events"] / record["scans"]
+
+    def opportunity_rate(self, sport_key: str) -> float:
+        record = self.history.get(sport_key, {"events": 0, "opportunities": 0})
+        return (record["opportunities"] + self.prior_opportunities) / (record["events"] + self.prior_trials)
+
+    def plan(self, sport_keys: Iterable[str], budget: int, odds_cost: int, alternates_cost_per_event: int,
+             cached: Container[str] = ()) -> ScanPlan:
+        """
+        Args:
+            sport_keys (Iterable[str]): Sports that may be scanned.
+            budget (int): Maximum quota to spend.
+            odds_cost (int): Quota cost of one _get_odds call.
+            alternates_cost_per_event (int): Quota cost of one _get_event_odds call.
+            cached (Container[str]): Sports whose odds are cached, their _get_odds call is free.
+        """
+        candidates = []
+        for sport_key in sport_keys:
+            events = self.expected_events(sport_key)
+            opportunities = events * self.opportunity_rate(sport_key)
+            candidates.append((sport_key, events, opportunities))
+
+        remaining = budget
+        chosen: Dict[str, PlannedSport] = {}
+
+        def cost(sport_key: str) -> int:
+            return 0 if sport_key in cached else odds_cost
+
+        for sport_key, events, opportunities in sorted(candidates, key= lambda c: c[2] * (1 - self.alternates_share) / max(cost(c[0]), 1), reverse= True):
+            if cost(sport_key) > remaining:
+                continue
+            remaining -= cost(sport_key)
+            chosen[sport_key] = PlannedSport(sport_key, cost(sport_key), 0, 0, opportunities * (1 - self.alternates_share))
+
+        alternate_candidates = [(sport_key, events, opportunities) for sport_key, events, opportunities in candidates if sport_key in chosen]
+        for sport_key, events, opportunities in sorted(alternate_candidates, key= lambda c: c[2] * self.alternates_share / max(c[1] * alternates_cost_per_event, 1), reverse= True):
+            if alternates_cost_per_event <= 0:
+                alternate_events = int(round(events))
+            else:
+                alternate_events = min(int(round(events)), remaining // alternates_cost_per_event)
+            if alternate_events <= 0:
+                continue
+            alternates_cost = alternate_events * alternates_cost_per_event
+            remaining -= alternates_cost
+            planned = chosen[sport_key]
+            extra = opportunities * self.alternates_share * alternate_events / max(events, 1)
+            chosen[sport_key] = planned._replace(alternate_events= alternate_events, alternates_cost= alternates_cost,
+                                                 expected_opportunities= planned.expected_opportunities + extra)
+
+        return ScanPlan(budget, sorted(chosen.values(), key= lambda sport: sport.expected_opportunities, reverse= True))
+
+    def record_scan(self, events_per_sport: Dict[str, int], opportunities_per_sport: Dict[str, int]) -> None:
+        """Add one scan's event and profitable event counts per sport to the history."""
+        for sport_key, events in events_per_sport.items():
+            record = dict(self.history.get(sport_key, {"scans": 0, "events": 0, "opportunities": 0}))
+            record["scans"] += 1
+            record["events"] += events
+            record["opportunities"] += opportunities_per_sport.get(sport_key, 0)
+            self.history[sport_key] = record
+        self.history.flush()
@@ -1,89 +1,349 @@
 
+import hashlib
 import json
 import os
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple, Union
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
 
 import requests
 from betting_event import BetType
 
+from arb_search.capture import CaptureWriter
+from arb_search.config import config
+from arb_search.dispatch import TokenBucket
+from arb_search.metrics import metrics
+from arb_search.serialization import Codec, dump_file, get_codec
 from arb_search.sport_types import SportType
-from arb_search.user_event import UserBet, UserBookmaker, UserEvent
+from arb_search.user_event import BetDelta, OddsBook, UserBet, UserBookmaker, UserEvent
 
 from ..base_api import BaseAPI
+from ..utils import build_session
+from .planner import ScanPlan, ScanPlanner
 
 from arb_search.utils import BookmakerStoredDict
 
+
+class TheOddsAPIError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class QuotaReserveReached(TheOddsAPIError):
+    """Raised instead of making a request that would take requests_remaining below quota_reserve."""
+
+
+class RefreshBudgetExhausted(QuotaReserveReached):
+    """Raised instead of making a request the budget it is charged to can't pay for: update_events'
+    refresh_quota_per_hour, or the ScanPlan of gather_events' quota_budget."""
+
+
 class TheOddsAPI_V4(BaseAPI):
+    BASE_URL = 'https://api.the-odds-api.com/v4'
 
-    def __init__(self, bookmaker_table: BookmakerStoredDict, default_start_time_range: Optional[Tuple[Optional[datetime], Optional[datetime]]] = None) -> None:
+    def __init__(self, bookmaker_table: BookmakerStoredDict, default_start_time_range: Optional[Tuple[Optional[datetime], Optional[datetime]]] = None,
+                 session: Optional[requests.Session] = None, timeout: float = 10.0, pool_size: int = 10, max_retries: int = 3, backoff_factor: float = 0.5,
+                 max_parallel_requests: int = 8, quota_reserve: int = 0, planner: Optional[ScanPlanner] = None,
+                 scan_quota_budget: Optional[int] = None, api_key: Optional[str] = None, capture: Optional[CaptureWriter] = None,
+                 cache_codec: Union[str, Codec] = 'msgpack+zstd', refresh_quota_per_hour: Optional[float] = None) -> None:
+        """
+        Args:
+            bookmaker_table (BookmakerStoredDict): Shared bookmaker table.
+            default_start_time_range (Tuple[datetime, datetime]): Default commence time range for odds requests.
+            session (requests.Session): Session to send requests through, by default one is built with build_session
+                from pool_size, max_retries and backoff_factor (429 and 5xx responses are retried).
+            timeout (float): Connect and read timeout in seconds for each request.
+            max_parallel_requests (int): Maximum number of per-event odds requests gather_events makes at once.
+            quota_reserve (int): Requests that would take requests_remaining below this raise QuotaReserveReached.
+            planner (ScanPlanner): Chooses the calls made by gather_events when it is given a quota_budget.
+            scan_quota_budget (int): Default quota_budget for gather_events.
+            api_key (str): the-odds-api key, read from settings/api_keys.json by default.
+            capture (CaptureWriter): Records every response fetched, see ReplayTheOddsAPI.
+            cache_codec (Union[str, Codec]): Format of the cached responses, 'json' keeps them readable.
+            refresh_quota_per_hour (float): Quota update_events may spend per hour, averaged over the hour. Leagues it
+                has no quota left for are not refreshed. None leaves refreshes limited only by the odds cache TTL.
+        """
         super().__init__(name= 'the-odds-api', bookmaker_table= bookmaker_table)
 
+        if session is None:
+            session = build_session(pool_size= pool_size, max_retries= max_retries, backoff_factor= backoff_factor)
+        self.session: requests.Session = session
+        self.timeout = timeout
+
+        # timing of the most recent requests, see request_stats
+        self.request_log: Deque[Dict[str, Any]] = deque(maxlen= 1000)
+        self._request_log_lock = threading.Lock()
+
         self.default_start_time_range = default_start_time_range
 
-        self.default_params: dict = {'api_key': json.load(open("settings/api_keys.json", "r"))["the-odds-api"]}
+        if api_key is None:
+            api_key = config.api_key('the-odds-api')
+        self.default_params: dict = {'api_key': api_key}
         self.default_params.update(json.load(open(os.path.join(os.path.dirname(__file__), 'defaults.json')))["the-odds-api"])
 
         self.alternate_markets = ['alternate_spreads', 'alternate_totals', 'btts', 'draw_no_bet', 'h2h_3_way']
         self.requests_used: int = 0
-        self.requests_remaining: int = 0
-
-    def __call_api(self, endpoint: str, force_update: bool = False, params: Optional[dict] = None) -> dict:
-        file_path = f'storage/the-odds-API_v4/{endpoint}.json'
+        self.requests_remaining: Optional[int] = None    # unknown until the first response
+        self.capture = capture
+
+        self.max_parallel_requests = max_parallel_requests
+        self.quota_reserve = quota_reserve
+        self._pending_cost = 0                          # estimated cost of requests in flight
+        self._quota_lock = threading.Lock()
+
+        # cached responses are keyed on endpoint and params, and reused for the TTL (seconds) of the first
+        # matching endpoint suffix, None keeps them forever
+        self.cache_dir = 'storage/the-odds-API_v4'
+        self.cache_codec = get_codec(cache_codec)
+        self.cache_ttls: Dict[str, Optional[float]] = {
+            'sports': 6 * 60 * 60,
+            'odds-history': None,
+            'scores': 60.0,
+            'odds': 30.0,
+        }
+
+        if planner is None:
+            # the history file is only opened when the planner is first used
+            planner = ScanPlanner(path= f'{self.cache_dir}/scan_history.json')
+        self.planner = planner
+        self.scan_quota_budget = scan_quota_budget
+        self.refresh_budget: Optional[TokenBucket] = None
+        if refresh_quota_per_hour is not None:
+            self.refresh_budget = TokenBucket(refresh_quota_per_hour / 3600, capacity= refresh_quota_per_hour)
+
+    def __call_api(self, endpoint: str, force_update: bool = False, params: Optional[dict] = None, max_age: Optional[float] = None,
+                   budget: Optional[Union[TokenBucket, ScanPlan]] = None) -> dict:
+        """Return the response for endpoint and params, from the cache when it is fresh enough.
 
-        if params is None:
-            params = self.default_params.copy()
+        Args:
+            endpoint (str): Endpoint path below /v4.
+            force_update (bool): Always call the API.
+            params (dict): Request parameters, defaults to self.default_params.
+            max_age (float): Accept cached responses up to this many seconds old, defaults to the endpoint's TTL.
+            budget (Union[TokenBucket, ScanPlan]): Quota a request to the API has to be paid from, cached responses are
+                free. RefreshBudgetExhausted is raised when it can't be.
+        """
+        # a copy, the caller's params are left as they were given
+        params = self.default_params.copy() if params is None else dict(params)
 
         for key, value in params.items():
             if isinstance(value, list):
                 params[key] = ','.join(value)
 
-        if os.path.exists(file_path) and not force_update:
-            with open(file_path, 'r') as f:
-                result = json.load(f)
+        file_path = self._cache_path(endpoint, params)
+        if max_age is None:
+            max_age = self._cache_ttl(endpoint)
+
+        cached = None if force_update else self._read_cache(file_path)
+        if cached is not None and (max_age is None or time.time() - cached['timestamp'] <= max_age):
+            metrics.inc('cache_hits_total', api= self.name, endpoint= self._endpoint_label(endpoint))
+            result = cached['data']
+            if self.capture is not None:
+                # recorded as well so a replay, which has no response cache, finds every response the scan used
+                self.capture.record(self.name, endpoint, self._normalize_params(params), {'status': 200, 'headers': {}, 'body': json.dumps(result), 'cached': True})
         else:
-            response: requests.Response = requests.get(f'https://api.the-odds-api.com/v4/{endpoint}', params=params)
-            if response.status_code != 200:
-                raise Exception(f'Failed to get odds: status_code {response.status_code}, response body {response.text}')
-            else:
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            metrics.inc('cache_misses_total', api= self.name, endpoint= self._endpoint_label(endpoint))
+            cost = self.request_cost(endpoint, params)
+            if budget is not None and not budget.try_acquire(cost):
+                raise RefreshBudgetExhausted(f'{endpoint} would cost {cost}, more than is left of its budget')
+            self._reserve_quota(endpoint, cost)
+            try:
+                response = self._fetch(endpoint, params)
+            finally:
+                with self._quota_lock:
+                    self._pending_cost -= cost
+            with metrics.timer('parse_seconds', api= self.name, endpoint= self._endpoint_label(endpoint)):
                 result = response.json()
-                with open(file_path, 'w') as f:
-                    json.dump(result, f, indent=2)
-
-                if 'x-requests-used' in response.headers:
-                    self.requests_used = int(round(float(response.headers['x-requests-used'])))
-                if 'x-requests-remaining' in response.headers:
-                    remaining_requests = int(round(float(response.headers['x-requests-remaining'])))
-                    if self.requests_remaining != remaining_requests:
+            cache_entry = {
+                'timestamp': time.time(),
+                'endpoint': endpoint,
+                'params': self._normalize_params(params),
+                'data': result,
+            }
+            dump_file(file_path, cache_entry, self.cache_codec, atomic= True)
+
+            if 'x-requests-used' in response.headers:
+                self.requests_used = int(round(float(response.headers['x-requests-used'])))
+            if 'x-requests-remaining' in response.headers:
+                remaining_requests = int(round(float(response.headers['x-requests-remaining'])))
+                with self._quota_lock:
+                    # responses to parallel requests can arrive out of order, the lowest count is the latest
+                    if self.requests_remaining is None or remaining_requests < self.requests_remaining:
                         self.requests_remaining = remaining_requests
                         print(f'{self.requests_remaining} requests remaining')
 
         return result
 
-    def _get_sports(self, force_update: bool = False, params: Optional[dict] = None) -> dict:
-        return self.__call_api('sports', force_update=force_update, params=params)
+    @staticmethod
+    def request_cost(endpoint: str, params: dict) -> int:
+        """Estimated quota cost of a request: one per market per region for odds endpoints, sports are free."""
+        if endpoint == 'sports':
+            return 0
+        if endpoint.endswith('/odds'):
+            markets = TheOddsAPI_V4._param_values(params, 'markets', 'h2h')
+            regions = TheOddsAPI_V4._param_values(params, 'regions', '')
+            return max(len(markets), 1) * max(len(regions), 1)
+        return 1
+
+    @staticmethod
+    def _param_values(params: dict, key: str, default: str) -> List[str]:
+        """The values of a comma separated param, which may also be given as a list or tuple."""
+        value = params.get(key, default)
+        if isinstance(value, (list, tuple)):
+            value = ','.join(value)
+        return [item for item in str(value).split(',') if item]
+
+    def _reserve_quota(self, endpoint: str, cost: int) -> None:
+        with self._quota_lock:
+            if self.requests_remaining is not None and self.requests_remaining - self._pending_cost - cost < self.quota_reserve:
+                raise QuotaReserveReached(f'{endpoint} would cost {cost}, leaving fewer than the {self.quota_reserve} reserved requests '
+                                          f'({self.requests_remaining} remaining, {self._pending_cost} in flight)')
+            self._pending_cost += cost
+
+    def _cache_ttl(self, endpoint: str) -> Optional[float]:
+        for suffix, ttl in self.cache_ttls.items():
+            if endpoint == suffix or endpoint.endswith('/' + suffix):
+                return ttl
+        return 0.0
+
+    @staticmethod
+    def _normalize_params(params: dict) -> Dict[str, str]:
+        """Params that change the response, as strings, with comma separated lists sorted. The api key is dropped."""
+        result = {}
+        for key, value in params.items():
+            if key == 'api_key':
+                continue
+            if isinstance(value, (list, tuple)):
+                value = ','.join(value)
+            value = str(value)
+            if ',' in value:
+                value = ','.join(sorted(value.split(',')))
+            result[key] = value
+        return result
 
-    def _get_odds(self, sport_id: str, force_update: bool = False, params: Optional[dict] = None, start_time_range: Optional[Tuple[Optional[datetime], Optional[datetime]]] = None) -> dict:
+    def _cache_path(self, endpoint: str, params: dict) -> str:
+        params_key = json.dumps(self._normalize_params(params), sort_keys= True)
+        return f'{self.cache_dir}/{endpoint}/{hashlib.sha1(params_key.encode()).hexdigest()[:16]}{self.cache_codec.extension}'
+
+    def _read_cache(self, file_path: str) -> Optional[dict]:
+        try:
+            with open(file_path, 'rb') as f:
+                cached = self.cache_codec.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not isinstance(cached, dict) or 'timestamp' not in cached:
+            return None
+        return cached
+
+    def is_cached(self, endpoint: str, params: Optional[dict] = None) -> bool:
+        """Whether a request for endpoint and params would be answered from the cache."""
+        age = self.cache_age(endpoint, params)
+        ttl = self._cache_ttl(endpoint)
+        return age is not None and (ttl is None or age <= ttl)
+
+    def cache_age(self, endpoint: str, params: Optional[dict] = None) -> Optional[float]:
+        """Seconds since the cached response for endpoint and params was fetched, None if nothing is cached."""
+        if params is None:
+            params = self.default_params.copy()
+        cached = self._read_cache(self._cache_path(endpoint, params))
+        if cached is None:
+            return None
+        return time.time() - cached['timestamp']
+
+    def _fetch(self, endpoint: str, params: dict) -> requests.Response:
+        """GET an endpoint through the pooled session, recording its timing in self.request_log."""
+        start = time.perf_counter()
+        response: requests.Response = self.session.get(f'{self.BASE_URL}/{endpoint}', params=params, timeout=self.timeout)
+        content = response.content
+        total_time = time.perf_counter() - start
+
+        retries = getattr(getattr(response.raw, 'retries', None), 'history', ())
+        with self._request_log_lock:
+            self.request_log.append({
+                'endpoint': endpoint,
+                'status_code': response.status_code,
+                'total_time': total_time,                               # request sent -> body read, including retries
+                'time_to_headers': response.elapsed.total_seconds(),    # last attempt only
+                'content_bytes': len(content),
+                'wire_bytes': int(response.headers.get('Content-Length', len(content))),
+                'content_encoding': response.headers.get('Content-Encoding'),
+                'retries': len(retries),
+            })
+
+        if self.capture is not None:
+            self.capture.record(self.name, endpoint, self._normalize_params(params),
+                                {'status': response.status_code, 'headers': dict(response.headers), 'body': response.text})
+
+        if metrics.enabled:
+            endpoint_label = self._endpoint_label(endpoint)
+            metrics.inc('http_requests_total', api= self.name, endpoint= endpoint_label, status= str(response.status_code))
+            metrics.observe('http_request_seconds', total_time, api= self.name, endpoint= endpoint_label)
+            metrics.inc('http_response_bytes_total', len(content), api= self.name, endpoint= endpoint_label)
+            metrics.inc('http_retries_total', len(retries), api= self.name, endpoint= endpoint_label)
+
+        if response.status_code != 200:
+            raise TheOddsAPIError(f'Failed to get odds: status_code {response.status_code}, response body {response.text}', response.status_code)
+        return response
+
+    @staticmethod
+    def _endpoint_label(endpoint: str) -> str:
+        """The endpoint without its sport key and event id, e.g. 'odds' or 'event_odds', so metrics aren't split per league."""
+        parts = endpoint.split('/')
+        return ('event_' if 'events' in parts[:-1] else '') + parts[-1]
+
+    def request_stats(self) -> Dict[str, float]:
+        """Summary of self.request_log: request count, mean total time and time to headers, bytes and retries."""
+        with self._request_log_lock:
+            log = list(self.request_log)
+        if not log:
+            return {'requests': 0}
+
+        return {
+            'requests': len(log),
+            'mean_total_time': sum(entry['total_time'] for entry in log) / len(log),
+            'mean_time_to_headers': sum(entry['time_to_headers'] for entry in log) / len(log),
+            'content_bytes': sum(entry['content_bytes'] for entry in log),
+            'wire_bytes': sum(entry['wire_bytes'] for entry in log),
+            'retries': sum(entry['retries'] for entry in log),
+        }
+
+    def _get_sports(self, force_update: bool = False, params: Optional[dict] = None, max_age: Optional[float] = None) -> dict:
+        return self.__call_api('sports', force_update=force_update, params=params, max_age=max_age)
+
+    def _get_odds(self, sport_id: str, force_update: bool = False, params: Optional[dict] = None, start_time_range: Optional[Tuple[Optional[datetime], Optional[datetime]]] = None,
+                  max_age: Optional[float] = None, budget: Optional[Union[TokenBucket, ScanPlan]] = None) -> dict:
+        return self.__call_api(f'sports/{sport_id}/odds', force_update=force_update, params=self._odds_params(params, start_time_range),
+                               max_age=max_age, budget=budget)
+
+    def _odds_params(self, params: Optional[dict] = None, start_time_range: Optional[Tuple[Optional[datetime], Optional[datetime]]] = None) -> Optional[dict]:
+        """The params _get_odds requests with, limited to start_time_range (default_start_time_range by default)."""
         if start_time_range is None and self.default_start_time_range is not None:
             start_time_range = self.default_start_time_range
         if start_time_range is not None:
-            force_update = True
-            if params is None:
-                params = self.default_params.copy()
+            params = self.default_params.copy() if params is None else dict(params)
+            # whole minutes (widening the range) so repeated scans share cache entries
             if start_time_range[0] is not None:
-                params['commenceTimeFrom'] = start_time_range[0].isoformat(timespec='seconds') + 'Z'
+                commence_from = start_time_range[0].replace(second=0, microsecond=0)
+                params['commenceTimeFrom'] = commence_from.isoformat(timespec='seconds') + 'Z'
             if start_time_range[1] is not None:
-                params['commenceTimeTo'] = start_time_range[1].isoformat(timespec='seconds') + 'Z'
-        return self.__call_api(f'sports/{sport_id}/odds', force_update=force_update, params=params)
+                commence_to = start_time_range[1].replace(second=0, microsecond=0)
+                if commence_to != start_time_range[1]:
+                    commence_to += timedelta(minutes=1)
+                params['commenceTimeTo'] = commence_to.isoformat(timespec='seconds') + 'Z'
+        return params
 
-    def _get_scores(self, sport_id: str, force_update: bool = False, params: Optional[dict] = None) -> dict:
-        return self.__call_api(f'sports/{sport_id}/scores', force_update=force_update, params=params)
+    def _get_scores(self, sport_id: str, force_update: bool = False, params: Optional[dict] = None, max_age: Optional[float] = None) -> dict:
+        return self.__call_api(f'sports/{sport_id}/scores', force_update=force_update, params=params, max_age=max_age)
 
     def _get_historical_odds(self, sport_id: str, force_update: bool = False, params: Optional[dict] = None) -> dict:
         return self.__call_api(f'sports/{sport_id}/odds-history', force_update=force_update, params=params)
 
-    def _get_event_odds(self, sport_key: str, event_id: str, force_update: bool = False, params: Optional[dict] = None) -> dict:
+    def _get_event_odds(self, sport_key: str, event_id: str, force_update: bool = False, params: Optional[dict] = None, max_age: Optional[float] = None,
+                        budget: Optional[ScanPlan] = None) -> dict:
         """Get odds data for a specific event.
         [Additional markets](https://the-odds-api.com/sports-odds-data/betting-markets.html#additional-markets)
         can only be gathered through this endpoint.
@@ -94,11 +354,13 @@ class TheOddsAPI_V4(BaseAPI):
             force_update (bool): Whether to force API call or use saved data.
             params (dict): Additional parameters to pass to the API call. NOTE: Defaults to Additional Markets: ['alternate_spreads',
             'alternate_totals', 'btts', 'draw_no_bet', 'h2h_3_way'].
+            max_age (float): Accept a cached response up to this many seconds old, defaults to the 'odds' TTL.
+            budget (ScanPlan): Quota the request has to be paid from if it isn't cached.
         """
         if params is None:
             params = self.default_params.copy()
             params["markets"] = self.alternate_markets
-        return self.__call_api(f'sports/{sport_key}/events/{event_id}/odds', force_update=force_update, params=params)
+        return self.__call_api(f'sports/{sport_key}/events/{event_id}/odds', force_update=force_update, params=params, max_age=max_age, budget=budget)
 
     ###
 
@@ -171,25 +433,83 @@ class TheOddsAPI_V4(BaseAPI):
 
     #     return events
 
+    @property
+    def min_refresh_interval(self) -> float:
+        """Seconds a league's odds are cached for, refreshing its events more often than this fetches nothing new."""
+        return self._cache_ttl('sports/{sport}/odds') or 0.0
+
     def update_events(self, events: List[UserEvent]) -> List[UserEvent]:
-       raise NotImplementedError
+        """Refetch the main markets of events, one odds request per league. Alternate markets are left as they are.
+
+        Odds cached within their TTL are reused, and requests are paid from refresh_quota_per_hour: the leagues with the
+        most events are refreshed first, the rest are left until there is quota again. Events missing from a league's
+        odds (started or withdrawn) are not changed. See UserEvent.refresh_bets.
+        """
+        market_keys = set(self.default_params["markets"])
+        if 'h2h' in market_keys:
+            market_keys.add('h2h_lay')
+
+        sport_events: Dict[str, List[UserEvent]] = {}
+        for event in events:
+            sport_events.setdefault(event.api_specific_data[self]["sport_key"], []).append(event)
+
+        skipped = 0
+        for sport_key, league_events in sorted(sport_events.items(), key= lambda item: len(item[1]), reverse= True):
+            try:
+                responses = {response["id"]: response for response in self._get_odds(sport_key, budget= self.refresh_budget)}
+            except RefreshBudgetExhausted:
+                # leagues whose odds are still cached cost nothing, so carry on
+                skipped += 1
+                continue
+            except QuotaReserveReached as e:
+                print(f'Stopping update: {e}')
+                break
+
+            for event in league_events:
+                response = responses.get(event.api_specific_data[self]["id"])
+                if response is None:
+                    continue
+                event.refresh_bets(
+                    self._build_bets(response),
+                    refreshed= lambda bet: bet.api_specific_data.get(self, {}).get('market_key') in market_keys,
+                    watched= [bet for bet in event.bets if bet.wager > 0]
+                )
+
+        if skipped:
+            print(f'Refresh budget spent, {skipped} leagues not refreshed')
+        return events
     
-    def update_bet_data(self, event: UserEvent, bet_indexes: List[int]) -> bool:
+    def update_bet_data(self, event: UserEvent, bet_indexes: List[int]) -> BetDelta:
+        """Refetch the markets of the bets at bet_indexes for the event. See UserEvent.refresh_bets."""
         bets = [event.bets[i] for i in bet_indexes if hasattr(event.bets[i], 'api_specific_data') and self in event.bets[i].api_specific_data]
         if not bets:
-            return False
+            return BetDelta()
 
+        market_keys = set(bet.api_specific_data[self]['market_key'] for bet in bets)
         params = self.default_params.copy()
-        params["markets"] = list(set(bet.api_specific_data[self]['market_key'] for bet in bets))
+        params["markets"] = sorted(market_keys)
         odds = self._get_event_odds(event.api_specific_data[self]['sport_key'], event.api_specific_data[self]['id'], params=params, force_update=True)
 
-        new_bets = self._build_bets(odds)
+        return event.refresh_bets(
+            self._build_bets(odds),
+            refreshed= lambda bet: bet.api_specific_data.get(self, {}).get('market_key') in market_keys,
+            watched= bets
+        )
 
-        print()
+    def gather_events(self, sport_types: List[SportType], leagues: Optional[List[str]] = None, force_update: int = 0, quota_budget: Optional[int] = None) -> List[UserEvent]:   #TODO: change force_update to 1
+        """Gather the events of every league of the sport types.
 
-        return False
+        Args:
+            sport_types (List[SportType]): Sport types to scan.
+            leagues (List[str]): Only scan these sport keys.
+            force_update (int): 0: use cached data within its TTL, 1: refetch odds, 2: also refetch the sports list.
+            quota_budget (int): Let self.planner choose the odds and alternate market calls worth the most expected
+                opportunities within this many requests, only requests the cache can't answer are charged to it.
+                Defaults to self.scan_quota_budget, None scans every league.
+        """
+        if quota_budget is None:
+            quota_budget = self.scan_quota_budget
 
-    def gather_events(self, sport_types: List[SportType], leagues: Optional[List[str]] = None, force_update: int = 0) -> List[UserEvent]:   #TODO: change force_update to 1
         available_sports = self._get_sports(force_update= (force_update >= 2))
         valid_sport_types = set(sport["group"] for sport in available_sports)
         sport_names = list(sport_type.name for sport_type in filter(lambda sport_type: sport_type.name in valid_sport_types, sport_types))
@@ -197,43 +517,96 @@ class TheOddsAPI_V4(BaseAPI):
         if len(sport_names) == 0:
             raise Exception(f'No valid sport types found. Valid sport types are: {valid_sport_types}')
 
+        available_sports = [available_sport for available_sport in available_sports
+                            if available_sport["group"] in sport_names and (leagues is None or available_sport["key"] in leagues)]
+
+        plan: Optional[ScanPlan] = None
+        if quota_budget is not None:
+            odds_params = self.default_params.copy()
+            alternate_params = self.default_params.copy()
+            alternate_params["markets"] = ','.join(self.alternate_markets)
+            cached = set() if force_update >= 1 else set(sport["key"] for sport in available_sports
+                                                         if self.is_cached(f'sports/{sport["key"]}/odds', self._odds_params()))
+            plan = self.planner.plan([sport["key"] for sport in available_sports], quota_budget,
+                                     odds_cost= self.request_cost('sports/{sport}/odds', odds_params),
+                                     alternates_cost_per_event= self.request_cost('sports/{sport}/events/{event}/odds', alternate_params),
+                                     cached= cached)
+            print(plan)
+            available_sports = sorted((sport for sport in available_sports if sport["key"] in plan),
+                                      key= lambda sport: plan[sport["key"]].expected_opportunities, reverse= True) # type: ignore
+
         events = []
 
-        for available_sport in available_sports:
-            if available_sport["key"] == 'soccer_netherlands_eredivisie':
-                break
+        with ThreadPoolExecutor(max_workers= self.max_parallel_requests, thread_name_prefix= "the-odds-api") as executor:
+            for available_sport in available_sports:
+                try:
+                    new_results = self._get_odds(available_sport["key"], force_update= (force_update >= 1), budget= plan)
+                except RefreshBudgetExhausted:
+                    # the plan's budget is spent, leagues whose odds are cached cost nothing
+                    continue
+                except QuotaReserveReached as e:
+                    print(f'Stopping scan: {e}')
+                    break
+
+                alternate_events = len(new_results) if plan is None else plan[available_sport["key"]].alternate_events
+                alternate_odds_futures = [executor.submit(self._get_alternate_odds, available_sport["key"], new_result["id"], force_update >= 1, plan)
+                                          for new_result in new_results[:alternate_events]]
+
+                for i, new_result in enumerate(new_results):
+                    new_result["sport_group"] = available_sport["group"]
+                    if i < len(alternate_odds_futures):
+                        new_result["bookmakers"] += alternate_odds_futures[i].result()
+
+                    events.append(self._build_event(new_result))
+
+        if plan is not None:
+            print(f'Scan spent {plan.spent}/{plan.budget} requests')
+        return events
 
-            if available_sport["group"] not in sport_names or leagues is not None and available_sport["key"] not in leagues:
+    def record_scan_results(self, events: List[UserEvent]) -> None:
+        """Teach the planner which leagues produced profitable events, call once the calculator results are in."""
+        events_per_sport: Dict[str, int] = {}
+        opportunities_per_sport: Dict[str, int] = {}
+        for event in events:
+            if self not in event.api_specific_data:
                 continue
-
-            new_results = self._get_odds(available_sport["key"], force_update= (force_update >= 1))
-
-            for new_result in new_results:
-                alternate_odds = self._get_event_odds(available_sport["key"], new_result["id"], force_update= (force_update >= 1))
-                new_result["sport_group"] = available_sport["group"]
-                new_result["bookmakers"] += alternate_odds["bookmakers"]
-
-                events.append(self._build_event(new_result))
-
-        return events
+            sport_key = event.api_specific_data[self]["sport_key"]
+            events_per_sport[sport_key] = events_per_sport.get(sport_key, 0) + 1
+            if any(profit > 0 for profit in event.profit):
+                opportunities_per_sport[sport_key] = opportunities_per_sport.get(sport_key, 0) + 1
+        self.planner.record_scan(events_per_sport, opportunities_per_sport)
+
+    def _get_alternate_odds(self, sport_key: str, event_id: str, force_update: bool, budget: Optional[ScanPlan] = None) -> List[dict]:
+        """The bookmakers of an event's alternate markets, none once the quota reserve is reached or budget is spent."""
+        try:
+            return self._get_event_odds(sport_key, event_id, force_update= force_update, budget= budget)["bookmakers"]
+        except QuotaReserveReached:
+            return []
 
     def _build_event(self, response: dict) -> UserEvent:
-        compatible_event: UserEvent = UserEvent(start_time= datetime.fromisoformat(response['commence_time'].replace('Z', '')))
-        compatible_event.add_bets(self._build_bets(response))
-        compatible_event.api_specific_data[self] = self.extract_specific_data(response)
+        with metrics.timer('build_seconds', api= self.name):
+            compatible_event: UserEvent = UserEvent(start_time= datetime.fromisoformat(response['commence_time'].replace('Z', '')))
+            compatible_event.odds_book = self._build_odds_book(response)
+            compatible_event.api_specific_data[self] = self.extract_specific_data(response)
+        metrics.inc('bets_built_total', compatible_event.bet_count, api= self.name)
         return compatible_event
 
     def _build_bets(self, response: dict) -> List[UserBet]:
-        bets = []
+        with metrics.timer('build_seconds', api= self.name):
+            bets = self._build_odds_book(response).to_bets()
+        metrics.inc('bets_built_total', len(bets), api= self.name)
+        return bets
+
+    def _build_odds_book(self, response: dict) -> OddsBook:
+        odds_book = OddsBook()
 
         for bookmaker in response["bookmakers"]:
             if bookmaker["key"] not in self.bookmaker_table:
-                self.bookmaker_table[bookmaker["key"]] = UserBookmaker(name=bookmaker["key"])
-                self.bookmaker_table.save()
+                self.bookmaker_table.add(bookmaker["key"])
 
             for market in bookmaker['markets']:
-                update_time = datetime.fromisoformat(market['last_update'].replace('Z', ''))
-                if market['key'] in ['h2h', 'h2h_lay']:
+                update_time = datetime.fromisoformat(market['last_update'].replace('Z', '')).timestamp()
+                if market['key'] in ['h2h', 'h2h_lay', 'h2h_3_way']:
                     bet_type = BetType.MatchWinner
                     for outcome in market['outcomes']:
                         if outcome['name'] == response['home_team']:
@@ -245,27 +618,27 @@ class TheOddsAPI_V4(BaseAPI):
                         else:
                             raise Exception(f'Unknown outcome: {outcome}')
 
-                        bets.append(UserBet(bet_type= bet_type, value= value, odds= outcome['price'],
-                                            bookmaker= self.bookmaker_table[bookmaker['key']], lay= (market['key'] == 'h2h_lay'),
-                                            update_time= update_time, api_specific_data= {self: {**outcome, **{'market_key': market['key']}}}))
+                        odds_book.add(bet_type, value, outcome['price'],
+                                      bookmaker= self.bookmaker_table[bookmaker['key']], lay= (market['key'] == 'h2h_lay'),
+                                      update_time= update_time, api_specific_data= {self: self._outcome_data(outcome, market['key'])})
 
                 elif market['key'] == 'totals' or market['key'] == 'alternate_totals':
                     bet_type = BetType.Goals_OverUnder
                     for outcome in market['outcomes']:
                         value = outcome['name'].lower() + ' ' + str(outcome['point'])
-                        bets.append(UserBet(bet_type= bet_type, value= value, odds= outcome['price'],
-                                            bookmaker= self.bookmaker_table[bookmaker['key']], update_time= update_time,
-                                            api_specific_data= {self: {**outcome, **{'market_key': market['key']}}}))
+                        odds_book.add(bet_type, value, outcome['price'],
+                                      bookmaker= self.bookmaker_table[bookmaker['key']], update_time= update_time,
+                                      api_specific_data= {self: self._outcome_data(outcome, market['key'])})
 
                 elif market['key'] == 'btts':
                     bet_type = BetType.BothTeamsToScore
                     for outcome in market['outcomes']:
                         value = outcome['name'].lower()
-                        bets.append(UserBet(bet_type= bet_type, value= value, odds= outcome['price'],
-                                            bookmaker= self.bookmaker_table[bookmaker['key']], update_time= update_time,
-                                            api_specific_data= {self: {**outcome, **{'market_key': market['key']}}}))
+                        odds_book.add(bet_type, value, outcome['price'],
+                                      bookmaker= self.bookmaker_table[bookmaker['key']], update_time= update_time,
+                                      api_specific_data= {self: self._outcome_data(outcome, market['key'])})
 
-                elif market['key'] in ['draw_no_bet', 'spreads']:
+                elif market['key'] in ['draw_no_bet', 'spreads', 'alternate_spreads']:
                     bet_type = BetType.AsianHandicap
                     for outcome in market['outcomes']:
                         if outcome['name'] == response['home_team']:
@@ -277,17 +650,28 @@ class TheOddsAPI_V4(BaseAPI):
 
                         if market['key'] == 'draw_no_bet':
                             value += ' 0.0'
-                        elif market['key'] == 'spreads':
+                        else:
                             value += ' ' + str(outcome['point'])
 
-                        bets.append(UserBet(bet_type= bet_type, value= value, odds= outcome['price'],
-                                            bookmaker= self.bookmaker_table[bookmaker['key']], update_time= update_time,
-                                            api_specific_data= {self: {**outcome, **{'market_key': market['key']}}}))
+                        odds_book.add(bet_type, value, outcome['price'],
+                                      bookmaker= self.bookmaker_table[bookmaker['key']], update_time= update_time,
+                                      api_specific_data= {self: self._outcome_data(outcome, market['key'])})
 
                 else:
                     raise Exception(f'Unknown market: {market}')
 
-        return bets
+        return odds_book
+
+    @staticmethod
+    def _outcome_data(outcome: dict, market_key: str) -> dict:
+        """A bet's api_specific_data: the outcome's fields and its market_key, but not its price.
+
+        The price is the bet's odds, read it from bet.odds. Leaving it out lets every price of an outcome share one
+        record in the OddsBook.
+        """
+        data = {key: value for key, value in outcome.items() if key != 'price'}
+        data['market_key'] = market_key
+        return data
 
     def read_event_comparison_data(self, event: UserEvent) -> Tuple[str, str, str, str]: 
         return (self.name,
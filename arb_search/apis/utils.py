@@ -1,36 +1,135 @@
-from typing import Dict, Iterator
+import math
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Hashable, Iterable, List
 
-def fixed_count_bin_packer(data_table: Dict[int, list], max_weight: int = 250, items_per_bin: int = 40) -> Iterator[list]:
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+def weighted_bin_packer(weight_table: Dict[Hashable, int], max_weight: int, max_items: int) -> List[list]:
     """
-    A bin packing algorithm that attempts to pack a fixed number of items with given weights into bins with a given weight limit to optimally reduce total bins used.
+    Bin packing of weighted items into bins limited by both total weight and item count, O(n log n).
+
+    When the item count limit needs at least as many bins as the weight limit, each bin is filled towards an even weight
+    per item so heavy and light items share bins and neither limit is reached long before the other. Otherwise best fit
+    decreasing is used. Both keep the bin count close to the minimum. An item heavier than max_weight gets a bin of its own.
 
     Args:
-        data_table Dict[key, List[val]]: Where key is an int representing the weight of each of the values in the list
-        max_weight int: The maximum weight of each bin.
-        items_per_bin int: The maximum number of items to pack into each bin.
+        weight_table Dict[key, int]: The weight of each item.
+        max_weight int: The maximum total weight of each bin.
+        max_items int: The maximum number of items in each bin.
 
     Returns:
-        Iterator[List[val]]: An iterator of lists of values (bin) that are packed as optimally as possible.
+        List[List[key]]: The bins.
     """
+    if math.ceil(len(weight_table) / max_items) >= math.ceil(sum(weight_table.values()) / max_weight):
+        return _even_weight_bin_packer(weight_table, max_weight, max_items)
+    return _best_fit_decreasing_bin_packer(weight_table, max_weight, max_items)
+
+
+def _even_weight_bin_packer(weight_table: Dict[Hashable, int], max_weight: int, max_items: int) -> List[list]:
+    """Fill bins one at a time, each next item is the one closest to the bin's remaining weight per remaining slot."""
+    buckets: Dict[int, list] = {}           # weight -> items
+    for key, weight in weight_table.items():
+        buckets.setdefault(weight, []).append(key)
+    weights = sorted(buckets)
+    item_count = len(weight_table)
+    total_weight = sum(weight_table.values())
+
+    def take(position: int) -> int:
+        weight = weights[position]
+        bin_items.append(buckets[weight].pop())
+        if not buckets[weight]:
+            del buckets[weight]
+            weights.pop(position)
+        return weight
 
-    ideal_gradient = max_weight / items_per_bin       #ideal item weight
+    bins: List[list] = []
+    while weights:
+        bins_left = max(math.ceil(item_count / max_items), math.ceil(total_weight / max_weight), 1)
+        target_items = min(max_items, math.ceil(item_count / bins_left))
+        bin_items: list = []
+        bin_weight = 0
 
-    while data_table:
-        current_bin = []
-        current_bin_weight = 0
+        if weights[0] > max_weight:
+            bin_weight = take(0)
 
-        for i in range(items_per_bin):
-            weight_options = list(filter(lambda x: current_bin_weight+x <= max_weight, data_table.keys()))
-            if not weight_options:
+        while weights and bin_weight <= max_weight and len(bin_items) < max_items:
+            room = max_weight - bin_weight
+            last_fitting = bisect_right(weights, room) - 1
+            if last_fitting < 0:
                 break
+            ideal_weight = room / max(target_items - len(bin_items), 1)
+            position = bisect_left(weights, ideal_weight, 0, last_fitting + 1)
+            if position > last_fitting or (position > 0 and ideal_weight - weights[position - 1] < weights[position] - ideal_weight):
+                position -= 1
+            bin_weight += take(position)
+
+        item_count -= len(bin_items)
+        total_weight -= bin_weight
+        bins.append(bin_items)
+
+    return bins
+
+
+def _best_fit_decreasing_bin_packer(weight_table: Dict[Hashable, int], max_weight: int, max_items: int) -> List[list]:
+    """Place items heaviest first into the open bin with the least room left that still fits them."""
+    bins: List[list] = []
+    open_bins: Dict[int, List[int]] = {}    # remaining capacity -> indexes of bins with that much room and space for more items
+    capacities: List[int] = []              # sorted keys of open_bins
 
-            ideal_next_weight = (ideal_gradient * (i+1)) - current_bin_weight
-            best_weight = min(weight_options, key = lambda x: abs(x-ideal_next_weight))
+    for key, weight in sorted(weight_table.items(), key= lambda item: item[1], reverse= True):
+        position = bisect_left(capacities, weight)
+        if position == len(capacities):
+            bin_index = len(bins)
+            bins.append([])
+            remaining = max_weight
+        else:
+            remaining = capacities[position]
+            bin_indexes = open_bins[remaining]
+            bin_index = bin_indexes.pop()
+            if not bin_indexes:
+                del open_bins[remaining]
+                capacities.pop(position)
 
-            current_bin.append(data_table[best_weight].pop())
-            current_bin_weight += best_weight
+        bins[bin_index].append(key)
+        remaining -= weight
 
-            if data_table[best_weight] == []:
-                data_table.pop(best_weight)
+        if remaining >= 0 and len(bins[bin_index]) < max_items:
+            if remaining not in open_bins:
+                open_bins[remaining] = []
+                insort(capacities, remaining)
+            open_bins[remaining].append(bin_index)
+
+    return bins
+
+
+def build_session(pool_size: int = 10, max_retries: int = 3, backoff_factor: float = 0.5,
+                  status_forcelist: Iterable[int] = (429, 500, 502, 503, 504)) -> requests.Session:
+    """
+    A requests session with a shared keep-alive connection pool, gzip responses and retries.
+
+    Args:
+        pool_size int: Connections kept open per host, should be at least the number of threads using the session.
+        max_retries int: Retries for connection errors and for responses with a status in status_forcelist.
+        backoff_factor float: Retries wait backoff_factor * 2 ** (retry - 1) seconds, or the Retry-After header.
+        status_forcelist Iterable[int]: Response statuses that are retried.
+
+    Returns:
+        requests.Session: The configured session.
+    """
+    retry = Retry(
+        total= max_retries,
+        backoff_factor= backoff_factor,
+        status_forcelist= tuple(status_forcelist),
+        allowed_methods= frozenset(['GET']),
+        respect_retry_after_header= True,
+        raise_on_status= False,
+    )
+    adapter = HTTPAdapter(pool_connections= pool_size, pool_maxsize= pool_size, max_retries= retry)
 
-        yield current_bin
\ No newline at end of file
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+    return session
@@ -0,0 +1,132 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .user_event import UserBet, UserEvent
+from .utils import StoredDict
+
+
+class CachedResult(NamedTuple):
+    stored_at: float            # time.time(), so persisted entries expire across restarts
+    profit: Sequence[float]     # as the calculator left event.profit
+    wagers: List[float]         # in the canonical bet order of the fingerprint
+
+
+class CalculatorCache:
+    """Bounded LRU cache of calculator results keyed by a fingerprint of the calculator's inputs.
+
+    The fingerprint covers everything send_to_RapidAPI sends the solver: the event's wager limit, wager precision
+    and no_draw flag, and for every bet its type, value, odds, lay flag, volume (after volume_percentage), previous
+    wager and its bookmaker's constraints. Bets are sorted first so the order they were gathered in doesn't matter.
+    An event whose inputs haven't changed is given the cached profit and wagers instead of being sent again.
+    Entries older than ttl seconds are ignored. With a path the cache is kept in a write-behind StoredDict.
+
+    Example:
+        cache = CalculatorCache(ttl= 600, path= 'storage/calculator_cache.pkl')
+        dispatcher = CalculatorDispatcher(cache= cache)
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: Optional[float] = 600.0, path: Optional[str] = None) -> None:
+        """
+        Args:
+            max_entries (int): Least recently used entries are evicted beyond this many.
+            ttl (float): Seconds a result stays valid, None keeps results until they are evicted.
+            path (str): Pickle file the entries are persisted to.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, CachedResult] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._store: Optional[StoredDict] = None
+        if path is not None:
+            self._store = StoredDict(path, write_behind= True)
+            now = time.time()
+            for fingerprint, entry in sorted(self._store.items(), key= lambda item: item[1].stored_at):
+                if self._fresh(entry, now):
+                    self._entries[fingerprint] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last= False)
+            if len(self._entries) != len(self._store):
+                self._store.clear()
+                self._store.update(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate}
+
+    @staticmethod
+    def key(event: UserEvent, volume_percentage: float = 1.0) -> Tuple[str, List[UserBet]]:
+        """The fingerprint of event's solver inputs and its bets in the canonical order cached wagers follow."""
+        bookmaker_keys: Dict[int, str] = {}
+        rows = []
+        for i, bet in enumerate(event.bets):
+            bookmaker = bet.bookmaker
+            if id(bookmaker) not in bookmaker_keys:
+                bookmaker_keys[id(bookmaker)] = json.dumps(bookmaker.as_dict(), sort_keys= True, default= str) if bookmaker is not None else ''
+            volume = bet.volume
+            if not isinstance(volume, str) and volume > 0:
+                volume *= volume_percentage
+            rows.append(((bet.bet_type.name, bet.value, bet.odds, bet.lay, volume, bet.previous_wager, bookmaker_keys[id(bookmaker)]), i))
+        rows.sort()
+
+        digest = hashlib.blake2b(digest_size= 16)
+        digest.update(repr((event.wager_limit, event.wager_precision, event.no_draw)).encode())
+        for row, _ in rows:
+            digest.update(repr(row).encode())
+
+        bets = event.bets
+        return digest.hexdigest(), [bets[i] for _, i in rows]
+
+    def restore(self, fingerprint: str, bets: List[UserBet], event: UserEvent) -> bool:
+        """Give event and bets the cached result for fingerprint, returns False on a miss."""
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None or not self._fresh(entry, time.time()) or len(entry.wagers) != len(bets):
+                self.misses += 1
+                return False
+            self._entries.move_to_end(fingerprint)
+            self.hits += 1
+
+        event.profit = copy.copy(entry.profit)
+        for bet, wager in zip(bets, entry.wagers):
+            bet.wager = wager
+        return True
+
+    def store(self, fingerprint: str, bets: List[UserBet], event: UserEvent) -> None:
+        """Cache the calculator's result now held by event and bets."""
+        self.add(fingerprint, CachedResult(time.time(), copy.copy(event.profit), [bet.wager for bet in bets]))
+
+    def add(self, fingerprint: str, entry: CachedResult) -> None:
+        with self._lock:
+            self._entries[fingerprint] = entry
+            self._entries.move_to_end(fingerprint)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last= False)[0])
+
+        if self._store is not None:
+            for old_fingerprint in evicted:
+                if old_fingerprint in self._store:
+                    del self._store[old_fingerprint]
+            self._store[fingerprint] = entry
+
+    def flush(self) -> None:
+        if self._store is not None:
+            self._store.flush()
+
+    def _fresh(self, entry: CachedResult, now: float) -> bool:
+        return self.ttl is None or now - entry.stored_at <= self.ttl
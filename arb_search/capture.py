@@ -0,0 +1,163 @@
+import atexit
+import glob
+import gzip
+import heapq
+import json
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Hashable, Iterable, Iterator, List, Optional, Sequence, Union
+
+from .calculator_cache import CachedResult, CalculatorCache
+from .user_event import UserEvent
+
+
+class CaptureWriter:
+    """Appends raw API responses to a gzip compressed JSON lines capture file, one timestamped record per response.
+
+    Each writer opens a new file named after the time it was created, so captures are never rewritten. A record is
+    {"t": time.time(), "source": api name, "endpoint": ..., "request": params, "response": ...}. The file is flushed
+    every flush_interval seconds and closed at exit, a capture cut short by a crash loses at most its unflushed tail.
+    Records are read back with read_capture and replayed with ReplayTheOddsAPI, ReplayBetfair and
+    replay_calculator_cache.
+
+    Example:
+        capture = CaptureWriter('storage/captures')
+        the_odds_api = TheOddsAPI_V4(bookmaker_table, capture= capture)
+        dispatcher = CalculatorDispatcher(capture= capture)
+    """
+
+    def __init__(self, directory: str = 'storage/captures', prefix: str = 'capture', compresslevel: int = 6, flush_interval: float = 5.0) -> None:
+        """
+        Args:
+            directory (str): Folder the capture file is created in.
+            prefix (str): Start of the file name, followed by the creation time and process id.
+            compresslevel (int): gzip compression level, 1 is fastest.
+            flush_interval (float): Seconds between flushes to disk.
+        """
+        os.makedirs(directory, exist_ok= True)
+        self.path = os.path.join(directory, f'{prefix}-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}.jsonl.gz')
+        self.flush_interval = flush_interval
+        self.records = 0
+        self._file: Optional[Any] = gzip.open(self.path, 'at', compresslevel= compresslevel, encoding= 'utf-8')
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def record(self, source: str, endpoint: str, request: Any, response: Any) -> None:
+        line = json.dumps({'t': time.time(), 'source': source, 'endpoint': endpoint, 'request': request, 'response': response},
+                          separators= (',', ':'), default= str)
+        with self._lock:
+            if self._file is None:
+                raise ValueError(f'capture {self.path} is closed')
+            self._file.write(line + '\n')
+            self.records += 1
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = time.monotonic()
+
+    def record_calculation(self, event: UserEvent, volume_percentage: float = 1.0) -> None:
+        """Record the calculator's result for event, keyed by the fingerprint of its inputs, see CalculatorCache.key."""
+        fingerprint, bets = CalculatorCache.key(event, volume_percentage)
+        self.record('calculator', 'calculation', {'fingerprint': fingerprint}, {'profit': event.profit, 'wagers': [bet.wager for bet in bets]})
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def capture_files(paths: Union[str, Sequence[str]]) -> List[str]:
+    """The capture files at paths, a directory stands for every capture file in it."""
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '*.jsonl.gz')))
+        else:
+            files.append(path)
+    return files
+
+
+def _read_file(path: str) -> Iterator[dict]:
+    try:
+        with gzip.open(path, 'rt', encoding= 'utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    return      # the last line of a capture whose writer was killed
+    except (EOFError, gzip.BadGzipFile, zlib.error):
+        return
+
+
+def read_capture(paths: Union[str, Sequence[str]]) -> Iterator[dict]:
+    """Every record of the capture files at paths in time order, files written at the same time are interleaved."""
+    return heapq.merge(*(_read_file(path) for path in capture_files(paths)), key= lambda record: record['t'])
+
+
+class ReplayClock:
+    """Holds replayed responses back until as long after the replay started as they were recorded after the capture started."""
+
+    def __init__(self, start: float, speed: Optional[float] = None) -> None:
+        """
+        Args:
+            start (float): Time of the first record of the capture.
+            speed (float): 1.0 replays at the recorded speed, 2.0 twice as fast. None replays as fast as possible.
+        """
+        if speed is not None and speed <= 0:
+            raise ValueError(f'speed must be positive, got {speed}')
+        self.start = start
+        self.speed = speed
+        self._replay_start: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def wait(self, recorded_time: float) -> None:
+        if self.speed is None:
+            return
+        with self._lock:
+            if self._replay_start is None:
+                self._replay_start = time.monotonic()
+        delay = self._replay_start + (recorded_time - self.start) / self.speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ResponseQueues:
+    """Recorded responses by key, each request takes the next one and the last is repeated once they run out."""
+
+    def __init__(self) -> None:
+        self._queues: Dict[Hashable, Deque[dict]] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._queues
+
+    def add(self, key: Hashable, record: dict) -> None:
+        self._queues.setdefault(key, deque()).append(record)
+
+    def next(self, key: Hashable) -> Optional[dict]:
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                return None
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+
+def replay_calculator_cache(records: Iterable[dict]) -> CalculatorCache:
+    """A CalculatorCache holding the captured calculator results, a dispatcher given it answers the events it has
+    seen without a request. Results never expire, the last result recorded for a fingerprint wins."""
+    cache = CalculatorCache(max_entries= 10**9, ttl= None)
+    for record in records:
+        if record['source'] != 'calculator':
+            continue
+        profit = record['response']['profit']
+        # the calculator gives a tuple, JSON turned it into a list
+        entry = CachedResult(record['t'], tuple(profit) if isinstance(profit, list) else profit, record['response']['wagers'])
+        cache.add(record['request']['fingerprint'], entry)
+    return cache
@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+
+class Config:
+    """The JSON files of the settings folder, each read the first time one of its values is needed.
+
+    The folder is the one given to set_directory, else the ARB_SEARCH_SETTINGS environment variable, else settings/
+    in the working directory. Nothing is read on import, so arb_search can be imported from anywhere and worker
+    processes only read the files they use.
+
+    Example:
+        from arb_search import config
+        config.set_directory('/etc/arb_search')
+        api_key = config.api_key('the-odds-api')
+    """
+    ENV_VAR = 'ARB_SEARCH_SETTINGS'
+
+    def __init__(self, directory: Optional[str] = None) -> None:
+        """
+        Args:
+            directory (str): Settings folder, see Config.
+        """
+        self._directory = directory
+        self._files: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self) -> str:
+        if self._directory is not None:
+            return self._directory
+        return os.environ.get(self.ENV_VAR, 'settings')
+
+    def set_directory(self, directory: Optional[str]) -> None:
+        """Read the settings from directory from now on, None goes back to the default folder."""
+        with self._lock:
+            self._directory = directory
+            self._files.clear()
+
+    def reload(self) -> None:
+        """Forget the files read so far, they are read again when next needed."""
+        with self._lock:
+            self._files.clear()
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def load(self, name: str) -> Any:
+        """The contents of the settings file name.json."""
+        try:
+            return self._files[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._files:
+                path = self.path(f'{name}.json')
+                try:
+                    with open(path, 'r') as f:
+                        self._files[name] = json.load(f)
+                except FileNotFoundError as e:
+                    raise FileNotFoundError(f"Settings file {path} not found, run from the repository root or set {self.ENV_VAR} "
+                                            f"to the settings folder") from e
+            return self._files[name]
+
+    def api_key(self, name: str) -> Any:
+        """The key called name in api_keys.json."""
+        return self.load('api_keys')[name]
+
+    def defaults(self, section: str) -> Dict[str, Any]:
+        """The defaults of section ('event', 'bet' or 'bookmaker') in event_defaults.json."""
+        return self.load('event_defaults')[section]
+
+
+config = Config()
@@ -0,0 +1,197 @@
+import copy
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import requests
+
+from .calculator_cache import CalculatorCache
+from .capture import CaptureWriter
+from .user_event import UserBet, UserEvent
+
+
+class TokenBucket:
+    """Thread safe token bucket, acquire blocks until a token is available and try_acquire doesn't wait."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        """
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float): Largest burst allowed, defaults to one second's worth of tokens.
+        """
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_time = (tokens - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take tokens if they are available now, without waiting."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+
+class DispatchResult(NamedTuple):
+    event: UserEvent
+    error: Optional[BaseException]
+    attempts: int
+    elapsed: float
+
+
+class CalculatorDispatcher:
+    """Sends UserEvents to the calculator through a bounded worker pool.
+
+    Every request waits on a token bucket, requests that fail with a transient error (a timeout, a connection error,
+    a 429 or a 5xx response) are retried with exponential backoff and each event has a deadline. Results are yielded
+    as they complete, not in submission order. The calculator works on a copy of each event, its profit and wagers
+    are copied back when the result is yielded. An event that misses its deadline is yielded with a TimeoutError;
+    its request cannot be cancelled and keeps a worker busy until it returns, but its late result is discarded.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, max_workers: int = 8, rate: float = 5.0, burst: Optional[float] = None,
+                 max_retries: int = 2, backoff: float = 0.5, timeout: Optional[float] = 60.0, volume_percentage: float = 1.0,
+                 cache: Optional[CalculatorCache] = None, capture: Optional[CaptureWriter] = None) -> None:
+        """
+        Args:
+            api_key (str): RapidAPI key, defaults to the key in settings/api_keys.json.
+            max_workers (int): Maximum number of requests in flight.
+            rate (float): Maximum requests started per second.
+            burst (float): Maximum burst of requests, defaults to one second's worth.
+            max_retries (int): Retries after the first attempt fails with a transient error.
+            backoff (float): Delay before the first retry, doubled on each further retry.
+            timeout (float): Seconds an event may take once a worker picks it up, including retries. None waits forever.
+            volume_percentage (float): Passed through to UserEvent.send_to_RapidAPI.
+            cache (CalculatorCache): Events whose inputs are cached are given the cached result without a request,
+                or waiting on the rate limit, and are yielded with 0 attempts.
+            capture (CaptureWriter): Records every result the calculator returns, see replay_calculator_cache.
+        """
+        self.api_key = api_key
+        self.max_workers = max_workers
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.volume_percentage = volume_percentage
+        self.cache = cache
+        self.capture = capture
+
+    def dispatch(self, events: Iterable[UserEvent]) -> Iterator[DispatchResult]:
+        events_iter = iter(events)
+        # future -> (event, the bets the calculator's copy was made from, future of the monotonic time a worker picked it up)
+        in_flight: Dict[Future, Tuple[UserEvent, List[UserBet], Future]] = {}
+
+        executor = ThreadPoolExecutor(max_workers= self.max_workers, thread_name_prefix= "calculator")
+        try:
+            while True:
+                while len(in_flight) < self.max_workers:
+                    event = next(events_iter, None)
+                    if event is None:
+                        break
+                    detached, bets = _detached_copy(event)
+                    started: Future = Future()
+                    in_flight[executor.submit(self._send, detached, started)] = (event, bets, started)
+
+                if not in_flight:
+                    return
+
+                waiting = set(in_flight)
+                wait_time = None
+                if self.timeout is not None:
+                    # an event's deadline runs from when a worker picks it up, so queued events are woken on that too
+                    waiting.update(started for _, _, started in in_flight.values() if not started.done())
+                    deadlines = [started.result() + self.timeout for _, _, started in in_flight.values() if started.done()]
+                    if deadlines:
+                        wait_time = max(0.0, min(deadlines) - time.monotonic())
+                wait(waiting, timeout= wait_time, return_when= FIRST_COMPLETED)
+
+                for future in [future for future in in_flight if future.done()]:
+                    event, bets, _ = in_flight.pop(future)
+                    yield _copy_back(future.result(), event, bets)
+
+                if self.timeout is None:
+                    continue
+                now = time.monotonic()
+                for future, (event, _, started) in list(in_flight.items()):
+                    if started.done() and started.result() + self.timeout <= now:
+                        # the request runs on, its result is dropped with the future
+                        del in_flight[future]
+                        yield DispatchResult(event, TimeoutError(f"no calculator result within {self.timeout}s"), 0, now - started.result())
+        finally:
+            executor.shutdown(wait= False, cancel_futures= True)
+
+    def _send(self, event: UserEvent, started: Future) -> DispatchResult:
+        start = time.monotonic()
+        started.set_result(start)
+        error: Optional[BaseException] = None
+
+        if self.cache is not None:
+            fingerprint, bets = self.cache.key(event, self.volume_percentage)
+            if self.cache.restore(fingerprint, bets, event):
+                return DispatchResult(event, None, 0, time.monotonic() - start)
+
+        for attempt in range(1, self.max_retries + 2):
+            self.rate_limiter.acquire()
+            try:
+                event.send_to_RapidAPI(self.api_key, self.volume_percentage)
+                if self.cache is not None:
+                    self.cache.store(fingerprint, bets, event)
+                if self.capture is not None:
+                    self.capture.record_calculation(event, self.volume_percentage)
+                return DispatchResult(event, None, attempt, time.monotonic() - start)
+            except Exception as e:
+                error = e
+                if not _transient(e):
+                    break
+                if attempt <= self.max_retries:
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+
+        return DispatchResult(event, error, attempt, time.monotonic() - start)
+
+
+def _transient(error: BaseException) -> bool:
+    """Whether a request that failed with error may succeed if it is sent again."""
+    if isinstance(error, (TimeoutError, ConnectionError, requests.Timeout, requests.ConnectionError)):
+        return True
+    status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return isinstance(status_code, int) and (status_code == 429 or status_code >= 500)
+
+
+def _detached_copy(event: UserEvent) -> Tuple[UserEvent, List[UserBet]]:
+    """A copy of event with copies of its bets for the calculator to fill in, and the bets they were copied from."""
+    with event.lock:
+        bets = list(event.bets)
+        detached = copy.copy(event)
+    detached.bets = [copy.copy(bet) for bet in bets]
+    detached.profit = copy.copy(event.profit)
+    return detached, bets
+
+
+def _copy_back(result: DispatchResult, event: UserEvent, bets: List[UserBet]) -> DispatchResult:
+    """Give event and bets the profit and wagers the calculator left on their copies."""
+    if result.error is None:
+        with event.lock:
+            event.profit = result.event.profit
+            for bet, calculated in zip(bets, result.event.bets):
+                bet.wager = calculated.wager
+    return result._replace(event= event)
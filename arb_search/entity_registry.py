@@ -0,0 +1,75 @@
+import threading
+from typing import Dict, List, Mapping, Optional, Tuple
+
+
+class EntityRegistry:
+    """Maps the names used by each API to compact integer ids for teams and leagues.
+
+    Every canonical name gets an id the first time it is seen, ids are never reused. Aliases are stored per API
+    (alias -> id) and the reverse lookups (id -> canonical name, id -> aliases) are kept alongside. The kinds
+    "team_names" and "league_names" mirror the sections of the API_Handler name comparison table, so the canonical
+    name of an entity is the name the table maps its aliases to.
+
+    The registry lives in memory only: API_Handler builds it from the name comparison table, which stays the one
+    persisted store, and adds to both as names are matched. Ids are only meaningful within a process.
+    """
+
+    KINDS = ("team_names", "league_names")
+
+    def __init__(self) -> None:
+        self._names: Dict[str, List[str]] = {kind: [] for kind in self.KINDS}
+        self._ids: Dict[str, Dict[str, int]] = {kind: {} for kind in self.KINDS}
+        self._aliases: Dict[str, Dict[str, Dict[str, int]]] = {kind: {} for kind in self.KINDS}
+        self._lock = threading.RLock()
+
+    def canonical_id(self, kind: str, canonical_name: str) -> int:
+        """Return the id for canonical_name, creating a new one if it has not been seen before."""
+        ids = self._ids[kind]
+        entity_id = ids.get(canonical_name)
+        if entity_id is None:
+            with self._lock:
+                entity_id = ids.get(canonical_name)
+                if entity_id is None:
+                    entity_id = len(self._names[kind])
+                    self._names[kind].append(canonical_name)
+                    ids[canonical_name] = entity_id
+        return entity_id
+
+    def add_alias(self, kind: str, api_name: str, alias: str, canonical_name: str) -> int:
+        """Point api_name's alias at canonical_name and return the canonical id."""
+        entity_id = self.canonical_id(kind, canonical_name)
+        api_aliases = self._aliases[kind].setdefault(api_name, {})
+        if api_aliases.get(alias) != entity_id:
+            with self._lock:
+                api_aliases[alias] = entity_id
+        return entity_id
+
+    def lookup(self, kind: str, api_name: str, alias: str) -> Optional[int]:
+        """Return the id api_name's alias points at, or None if the alias is unknown."""
+        api_aliases = self._aliases[kind].get(api_name)
+        if api_aliases is None:
+            return None
+        return api_aliases.get(alias)
+
+    def name(self, kind: str, entity_id: int) -> str:
+        """Return the canonical name of entity_id."""
+        return self._names[kind][entity_id]
+
+    def aliases(self, kind: str, entity_id: int) -> List[Tuple[str, str]]:
+        """Return every (api_name, alias) pair that points at entity_id."""
+        return [(api_name, alias)
+                for api_name, api_aliases in self._aliases[kind].items()
+                for alias, alias_id in api_aliases.items() if alias_id == entity_id]
+
+    def import_name_table(self, name_comparison_table: Mapping[str, Dict[str, Dict[str, str]]]) -> None:
+        """Add every alias of an API_Handler name comparison table ({api: {kind: {alias: canonical_name}}})."""
+        for api_name, sections in name_comparison_table.items():
+            for kind, names in sections.items():
+                if kind not in self._aliases:
+                    continue
+                for alias, canonical_name in names.items():
+                    self.add_alias(kind, api_name, alias, canonical_name)
+
+    def __len__(self) -> int:
+        return sum(len(names) for names in self._names.values())
+
@@ -0,0 +1,192 @@
+import bisect
+import json
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# seconds, from a cached read up to a slow calculator round-trip
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)     # the last count is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> List[int]:
+        result = []
+        total = 0
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+
+class _Timer:
+    """Observes the seconds spent in its with block, also when the block raises."""
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, labels: Labels) -> None:
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> '_Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.registry._observe(self.name, self.labels, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> '_NullTimer':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry:
+    """Counters and latency histograms of the scan pipeline, exported as Prometheus text or a JSON snapshot.
+
+    Every metric is identified by its name and keyword labels. While the registry is disabled, which it is until
+    enable() is called, inc and observe return straight away and timer returns a shared no-op context manager.
+
+    Example:
+        metrics.enable()
+        with metrics.timer("match_seconds"):
+            events = handler.match_events(apis_events)
+        metrics.inc("http_response_bytes_total", len(content), api= "the-odds-api")
+        metrics.write_prometheus("storage/metrics.prom")
+    """
+
+    def __init__(self, enabled: bool = False, prefix: str = "arb_search_", buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        """
+        Args:
+            enabled (bool): Record metrics from the start.
+            prefix (str): Prepended to every metric name on export.
+            buckets (Sequence[float]): Upper bounds of the histogram buckets, in seconds.
+        """
+        self.enabled = enabled
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        if not self.enabled:
+            return
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        if not self.enabled:
+            return
+        self._observe(name, _labels(labels), value)
+
+    def timer(self, name: str, **labels: str):
+        """Context manager observing the seconds its block takes in the name histogram."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, _labels(labels))
+
+    def _observe(self, name: str, labels: Labels, value: float) -> None:
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def snapshot(self) -> dict:
+        """Every metric as plain data: counters by label set, histograms with their non-cumulative bucket counts."""
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "counters": {name: [{"labels": dict(labels), "value": value} for labels, value in series.items()]
+                             for name, series in self._counters.items()},
+                "histograms": {name: [{"labels": dict(labels), "count": histogram.count, "sum": histogram.sum,
+                                       "buckets": dict(zip([*map(str, histogram.buckets), "+Inf"], histogram.counts))}
+                                      for labels, histogram in series.items()]
+                               for name, series in self._histograms.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {self.prefix}{name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{self.prefix}{name}{_format_labels(labels)} {_format_value(value)}")
+
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {self.prefix}{name} histogram")
+                for labels, histogram in series.items():
+                    for bound, count in zip([*map(_format_value, histogram.buckets), "+Inf"], histogram.cumulative_counts()):
+                        lines.append(f"{self.prefix}{name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+                    lines.append(f"{self.prefix}{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+                    lines.append(f"{self.prefix}{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, filename: str) -> None:
+        """Write to_prometheus() to filename, atomically so a node exporter's textfile collector never reads half a file."""
+        from .utils import atomic_write
+        text = self.to_prometheus()
+        atomic_write(filename, lambda f: f.write(text), binary= False)
+
+    def write_json(self, filename: Optional[str] = None) -> str:
+        """The snapshot as JSON, also written to filename when one is given."""
+        from .utils import atomic_write
+        text = json.dumps(self.snapshot(), indent= 4)
+        if filename is not None:
+            atomic_write(filename, lambda f: f.write(text), binary= False)
+        return text
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# shared by the APIs, API_Handler and UserEvent, disabled until enable() is called
+metrics = MetricsRegistry()
@@ -0,0 +1,421 @@
+from functools import lru_cache
+from typing import Dict, Hashable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from betting_event import BetType
+
+from .user_event import UserEvent
+
+OutcomeKey = Tuple[BetType, str]
+
+# bet types whose values can be split into two complementary outcomes by swapping the last word
+_TWO_WAY_WORDS: Dict[BetType, Dict[str, str]] = {
+    BetType.Goals_OverUnder: {"over": "under", "under": "over"},
+    BetType.Team_OverUnder: {"over": "under", "under": "over"},
+    BetType.BothTeamsToScore: {"yes": "no", "no": "yes"},
+    BetType.OddEven: {"odd": "even", "even": "odd"},
+    BetType.Team_WinToNil: {"yes": "no", "no": "yes"},
+}
+_RESULTS = ("home", "draw", "away")
+# outcomes in the largest market, the result/over-under grid
+_MAX_MARKET = 6
+# the no-arbitrage check spreads probability over the final scores with up to _GOALS - 1 goals a side
+_GOALS = 8
+_HOME_GOALS, _AWAY_GOALS = (goals.astype(np.float64) for goals in np.divmod(np.arange(_GOALS * _GOALS), _GOALS))
+# events solved together, padded to the most prices among them
+_SOLVE_CHUNK = 64
+_SOLVE_ITERATIONS = 40
+
+# the share of the stake won and the share pushed (returned) in each final score
+Settlement = Tuple[np.ndarray, np.ndarray]
+
+
+def _is_split_line(words: Sequence[str]) -> bool:
+    """Whether a value holds a quarter line (2.25, -0.75), which splits the stake over two lines."""
+    for word in words:
+        try:
+            line = float(word)
+        except ValueError:
+            continue
+        if not (line * 2).is_integer():
+            return True
+    return False
+
+
+@lru_cache(maxsize= 65536)
+def _complement(key: OutcomeKey) -> Optional[OutcomeKey]:
+    """The single outcome that wins exactly when key loses (pushes aside), or None."""
+    bet_type, value = key
+    words = value.split(' ')
+    if _is_split_line(words):
+        return None
+
+    if bet_type in _TWO_WAY_WORDS:
+        swaps = _TWO_WAY_WORDS[bet_type]
+        for i, word in enumerate(words):
+            if word in swaps:
+                return (bet_type, ' '.join(words[:i] + [swaps[word]] + words[i+1:]))
+        return None
+
+    if bet_type == BetType.AsianHandicap and len(words) == 2 and words[0] in ("home", "away"):
+        try:
+            handicap = float(words[1])
+        except ValueError:
+            return None
+        return (bet_type, ("away" if words[0] == "home" else "home") + ' ' + repr(-handicap + 0.0))
+
+    return None
+
+
+def _normalize(key: OutcomeKey) -> OutcomeKey:
+    """Write handicaps the same way whichever API they came from ('-0.5', '0.0')."""
+    bet_type, value = key
+    if bet_type == BetType.AsianHandicap:
+        words = value.split(' ')
+        if len(words) == 2:
+            try:
+                return (bet_type, words[0] + ' ' + repr(float(words[1]) + 0.0))
+            except ValueError:
+                pass
+    return key
+
+
+@lru_cache(maxsize= 65536)
+def _market(key: OutcomeKey) -> Optional[Tuple[OutcomeKey, ...]]:
+    """The outcomes of the market key belongs to, exactly one of which wins (pushes aside), or None if the screen
+    doesn't know one: double chance, draw no bet, correct score, quarter lines and anything unrecognised."""
+    bet_type, value = key
+
+    if bet_type == BetType.MatchWinner:
+        market = tuple((BetType.MatchWinner, outcome) for outcome in _RESULTS)
+    elif bet_type == BetType.Result_BothTeamsScore:
+        market = tuple((bet_type, f'{outcome}/{btts}') for outcome in _RESULTS for btts in ("yes", "no"))
+    elif bet_type == BetType.Result_OverUnder and '/' in value and not _is_split_line(value.split(' ')):
+        line = value[value.index('/') + 1:].split(' ')[-1]
+        market = tuple((bet_type, f'{outcome}/{side} {line}') for outcome in _RESULTS for side in ("over", "under"))
+    else:
+        complement = _complement(key)
+        if complement is None:
+            return None
+        market = tuple(sorted((key, complement)))     # type: ignore
+
+    return market if key in market else None
+
+
+def _line_settlement(margin: np.ndarray, line: float) -> Optional[Settlement]:
+    """A bet that wins when margin + line > 0 and pushes at 0, a quarter line splits the stake over the lines either side."""
+    if (line * 2).is_integer():
+        total = margin + line
+        return (total > 0).astype(np.float64), (total == 0).astype(np.float64)
+    if (line * 4).is_integer():
+        low, high = _line_settlement(margin, line - 0.25), _line_settlement(margin, line + 0.25)
+        return (low[0] + high[0]) / 2, (low[1] + high[1]) / 2      # type: ignore
+    return None
+
+
+def _over_under(goals: np.ndarray, side: str, line: float) -> Optional[Settlement]:
+    if side == "over":
+        return _line_settlement(goals, -line)
+    if side == "under":
+        return _line_settlement(-goals, line)
+    return None
+
+
+@lru_cache(maxsize= 65536)
+def _settlement(key: OutcomeKey) -> Optional[Settlement]:
+    """How a bet on key settles in each final score, or None if the screen doesn't know.
+
+    Scores past the grid are never given any probability, so a bet that can only win there is treated as always
+    losing, which can only make an arbitrage look possible, never hide one."""
+    bet_type, value = key
+    home, away = _HOME_GOALS, _AWAY_GOALS
+    results = {"home": home > away, "draw": home == away, "away": home < away}
+    words = value.split(' ')
+    won = None
+    try:
+        if bet_type == BetType.MatchWinner and value in results:
+            won = results[value]
+        elif bet_type == BetType.DoubleChance:
+            parts = value.split('/')
+            if len(parts) == 2 and all(part in results for part in parts):
+                won = results[parts[0]] | results[parts[1]]
+        elif bet_type == BetType.ExactScore:
+            goals = value.split(':')
+            if len(goals) == 2:
+                won = (home == int(goals[0])) & (away == int(goals[1]))
+        elif bet_type == BetType.BothTeamsToScore and value in ("yes", "no"):
+            won = ((home > 0) & (away > 0)) == (value == "yes")
+        elif bet_type == BetType.OddEven and value in ("odd", "even"):
+            won = ((home + away) % 2 == 1) == (value == "odd")
+        elif bet_type == BetType.Team_WinToNil and len(words) == 2 and words[0] in ("home", "away") and words[1] in ("yes", "no"):
+            scored, conceded = (home, away) if words[0] == "home" else (away, home)
+            won = ((scored > conceded) & (conceded == 0)) == (words[1] == "yes")
+        elif bet_type == BetType.Goals_OverUnder and len(words) == 2:
+            return _over_under(home + away, words[0], float(words[1]))
+        elif bet_type == BetType.Team_OverUnder and len(words) == 3 and words[0] in ("home", "away"):
+            return _over_under(home if words[0] == "home" else away, words[1], float(words[2]))
+        elif bet_type == BetType.AsianHandicap and len(words) == 2 and words[0] in ("home", "away"):
+            return _line_settlement(home - away if words[0] == "home" else away - home, float(words[1]))
+        elif bet_type in (BetType.Result_BothTeamsScore, BetType.Result_OverUnder) and '/' in value:
+            result, rest = value.split('/', 1)
+            part = _settlement((BetType.BothTeamsToScore if bet_type == BetType.Result_BothTeamsScore else BetType.Goals_OverUnder, rest))
+            # a combined bet only settles as won or lost, not on a line that can push or split
+            if result in results and part is not None and not part[1].any() and np.isin(part[0], (0, 1)).all():
+                won = results[result] & (part[0] == 1)
+    except ValueError:
+        return None
+
+    if won is None:
+        return None
+    return won.astype(np.float64), np.zeros(_GOALS * _GOALS)
+
+
+def _score_distributions(returns: np.ndarray) -> np.ndarray:
+    """For each event's returns (event, price, final score), a probability distribution over the final scores that
+    keeps the largest expected return of any price as low as possible.
+
+    This is the dual of finding the stakes with the best guaranteed return, a small LP solved for all the events at
+    once by a primal-dual interior point method (Mehrotra's predictor-corrector) in standard form:
+    minimise -u subject to returns^T x - u - w = 0, sum(x) = 1 and x, u, w >= 0. The distribution is the equality
+    constraints' multipliers. It is only as accurate as the solve, callers check what it proves exactly.
+    """
+    events, prices, scores = returns.shape
+    rows, columns = scores + 1, prices + 1 + scores
+    constraints = np.zeros((events, rows, columns))
+    constraints[:, :scores, :prices] = returns.transpose(0, 2, 1)
+    constraints[:, :scores, prices] = -1
+    constraints[:, :scores, prices + 1:] = -np.eye(scores)
+    constraints[:, scores, :prices] = 1
+    transposed = constraints.transpose(0, 2, 1)
+    rhs = np.zeros(rows)
+    rhs[scores] = 1
+    cost = np.zeros(columns)
+    cost[prices] = -1
+
+    x, slack, y = np.ones((events, columns)), np.ones((events, columns)), np.zeros((events, rows))
+    identity = np.eye(rows)
+
+    def step_length(values: np.ndarray, direction: np.ndarray) -> np.ndarray:
+        with np.errstate(divide= 'ignore', invalid= 'ignore'):
+            return np.minimum(1.0, np.where(direction < 0, -values / direction, np.inf).min(axis= 1))
+
+    for _ in range(_SOLVE_ITERATIONS):
+        mu = (x * slack).sum(axis= 1) / columns
+        done = mu < 1e-10
+        if done.all():
+            break
+        primal_residual = rhs - (constraints @ x[..., None])[..., 0]
+        dual_residual = cost - (transposed @ y[..., None])[..., 0] - slack
+        scale = x / slack
+        normal = (constraints * scale[:, None, :]) @ transposed
+        # the normal equations get close to singular as the solve converges
+        normal += (1e-12 * np.trace(normal, axis1= 1, axis2= 2) / rows + 1e-300)[:, None, None] * identity
+
+        def direction(complementarity: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+            right = primal_residual - (constraints @ (complementarity / slack - scale * dual_residual)[..., None])[..., 0]
+            dy = np.linalg.solve(normal, right[..., None])[..., 0]
+            dslack = dual_residual - (transposed @ dy[..., None])[..., 0]
+            return (complementarity - x * dslack) / slack, dy, dslack
+
+        dx, dy, dslack = direction(-x * slack)
+        primal_step, dual_step = step_length(x, dx), step_length(slack, dslack)
+        mu_affine = ((x + primal_step[:, None] * dx) * (slack + dual_step[:, None] * dslack)).sum(axis= 1) / columns
+        centering = (mu_affine / mu) ** 3
+        dx, dy, dslack = direction(-x * slack - dx * dslack + (centering * mu)[:, None])
+        primal_step, dual_step = 0.99 * step_length(x, dx), 0.99 * step_length(slack, dslack)
+        primal_step[done] = dual_step[done] = 0
+        x += primal_step[:, None] * dx
+        y += dual_step[:, None] * dy
+        slack += dual_step[:, None] * dslack
+
+    distributions = np.maximum(y[:, :scores], 0)
+    return distributions / np.maximum(distributions.sum(axis= 1, keepdims= True), 1e-300)
+
+
+class ArbitragePreScreen:
+    """Drops events that cannot hold an arbitrage before they are sent to the calculator.
+
+    For every outcome the best back price and the best lay price (as the equivalent back price on the outcome
+    losing) are found after bookmaker commission. The outcomes are grouped into markets of which exactly one outcome
+    wins: home/draw/away, complementary pairs (over/under, yes/no, odd/even, opposing whole and half Asian handicap
+    lines) and the result/BTTS and result/over-under grids. Within a market the cheapest way of covering every
+    result with backs and lays, fractional stakes included, is found exactly, as an implied probability sum. The sums
+    for all events are computed in one pass of NumPy array operations and set as each event's best_implied_sum.
+
+    An event is dropped when no combination of its prices can return more than 1 / (1 + margin) of the stakes in
+    every result. If all its prices lie in one known market that is when the market's sum is at least 1 + margin.
+    Otherwise, when every price settles on the final score, a probability distribution over final scores under
+    which every price returns at most 1 / (1 + margin) on average proves it, since any combination of stakes then
+    returns at most that on average and so in some result. The distribution is found by a small LP per event and
+    checked exactly, a failed solve only keeps the event. Events with a price the screen can't settle on a score
+    (an unrecognised value) are kept.
+    """
+
+    def __init__(self, margin: float = 0.0) -> None:
+        self.margin = margin
+        self.last_pruned: int = 0
+        self.total_pruned: int = 0
+        self.total_screened: int = 0
+
+    def screen(self, events: List[UserEvent]) -> List[UserEvent]:
+        """Return the events that may be profitable, each event's best_implied_sum is updated."""
+        outcome_ids, prices = self._best_prices(events)
+        implied_sums, exact = self._implied_sums(len(events), outcome_ids, prices)
+        unprofitable = implied_sums >= 1 + self.margin
+        unprofitable &= exact | self._no_arbitrage(len(events), outcome_ids, prices, unprofitable & ~exact)
+
+        kept = []
+        for event, implied_sum, pruned in zip(events, implied_sums, unprofitable):
+            event.best_implied_sum = float(implied_sum)
+            if not pruned:
+                kept.append(event)
+
+        self.last_pruned = len(events) - len(kept)
+        self.total_pruned += self.last_pruned
+        self.total_screened += len(events)
+        return kept
+
+    def implied_sums(self, events: List[UserEvent]) -> np.ndarray:
+        """The lowest implied probability sum over the known markets of each event, inf if there is none."""
+        return self._implied_sums(len(events), *self._best_prices(events))[0]
+
+    @staticmethod
+    def _best_prices(events: List[UserEvent]) -> Tuple[Dict[Tuple[int, Hashable], int], np.ndarray]:
+        """An id for each (event index, outcome) and the best prices after commission: the back price of each outcome,
+        then the lay price as a back price on it losing, 0 where there is none."""
+        outcome_ids: Dict[Tuple[int, Hashable], int] = {}
+        bet_outcomes: List[int] = []
+        bet_odds: List[float] = []
+        bet_commissions: List[float] = []
+        bet_lays: List[bool] = []
+
+        for event_index, event in enumerate(events):
+            book = event.odds_snapshot()
+            commissions = [bookmaker.commission if bookmaker is not None else 0.0 for bookmaker in book.bookmakers]
+            for row in range(len(book)):
+                if book.volume[row] == 0 or book.odds[row] <= 1:
+                    continue
+                outcome_key = (event_index, _normalize(book.outcome_key(row)))
+                bet_outcomes.append(outcome_ids.setdefault(outcome_key, len(outcome_ids)))
+                bet_odds.append(book.odds[row])
+                bet_commissions.append(commissions[book.bookmaker[row]])
+                bet_lays.append(bool(book.lay[row]))
+
+        outcome_count = len(outcome_ids)
+        prices = np.zeros(2 * outcome_count)
+        if outcome_count == 0:
+            return outcome_ids, prices
+
+        outcomes = np.array(bet_outcomes, dtype= np.int64)
+        odds = np.array(bet_odds, dtype= np.float64)
+        commission = np.array(bet_commissions, dtype= np.float64)
+        lay = np.array(bet_lays, dtype= bool)
+
+        # backing at odds o pays 1 + (o - 1)(1 - c)
+        # laying at odds o is backing the outcome losing at 1 + (1 - c) / (o - 1)
+        effective = np.where(lay, 1 + (1 - commission) / (odds - 1), 1 + (odds - 1) * (1 - commission))
+        np.maximum.at(prices, outcomes[~lay], effective[~lay])
+        np.maximum.at(prices, outcome_count + outcomes[lay], effective[lay])
+        return outcome_ids, prices
+
+    def _implied_sums(self, event_count: int, outcome_ids: Dict[Tuple[int, Hashable], int],
+                      prices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """implied_sums, and whether each event's prices all lie in one known market, so that its sum is exact."""
+        outcome_count = len(outcome_ids)
+        best = np.full(event_count, np.inf)
+        if outcome_count == 0:
+            return best, np.ones(event_count, dtype= bool)
+
+        # [prices, missing (0 -> inf implied), padding (inf -> 0 implied)]
+        missing, padding = 2 * outcome_count, 2 * outcome_count + 1
+        with np.errstate(divide= 'ignore'):
+            implied = 1.0 / np.concatenate((prices, [0.0, np.inf]))
+
+        # backing and laying the same outcome covers every result, whatever market it is in
+        outcome_events = np.empty(outcome_count, dtype= np.int64)
+        for (event_index, _), outcome_id in outcome_ids.items():
+            outcome_events[outcome_id] = event_index
+        np.minimum.at(best, outcome_events, implied[:outcome_count] + implied[outcome_count:2 * outcome_count])
+
+        back_rows, lay_rows, row_events, screenable = self._markets(event_count, outcome_ids, outcome_count, missing, padding)
+        if back_rows:
+            np.minimum.at(best, np.array(row_events, dtype= np.int64), self._market_sums(implied[np.array(back_rows)], implied[np.array(lay_rows)]))
+        return best, screenable
+
+    @staticmethod
+    def _markets(event_count: int, outcome_ids: Dict[Tuple[int, Hashable], int], outcome_count: int, missing: int,
+                 padding: int) -> Tuple[List[List[int]], List[List[int]], List[int], np.ndarray]:
+        """Back and lay price indexes of every market of every event, padded to the widest market, the event of each
+        market and whether each event's prices all lie in one known market."""
+        event_markets: Dict[int, Set[Tuple[OutcomeKey, ...]]] = {}
+        screenable = np.ones(event_count, dtype= bool)
+        for event_index, key in outcome_ids:
+            market = _market(key)   # type: ignore
+            if market is None:
+                screenable[event_index] = False
+            else:
+                event_markets.setdefault(event_index, set()).add(market)
+
+        back_rows: List[List[int]] = []
+        lay_rows: List[List[int]] = []
+        row_events: List[int] = []
+        for event_index, markets in event_markets.items():
+            if len(markets) > 1:
+                screenable[event_index] = False
+            for market in markets:
+                ids = [outcome_ids.get((event_index, key)) for key in market]
+                back_rows.append([missing if outcome_id is None else outcome_id for outcome_id in ids] + [padding] * (_MAX_MARKET - len(ids)))
+                lay_rows.append([missing if outcome_id is None else outcome_count + outcome_id for outcome_id in ids] + [missing] * (_MAX_MARKET - len(ids)))
+                row_events.append(event_index)
+
+        return back_rows, lay_rows, row_events, screenable
+
+    @staticmethod
+    def _market_sums(back: np.ndarray, lay: np.ndarray) -> np.ndarray:
+        """The cheapest cover of each market (row) by its backs and lays, as an implied probability sum.
+
+        A back covers one outcome and a lay every other outcome, padding is 0 in back and inf in lay. By LP duality
+        the cheapest cover is the largest total of q with q_i <= back_i and sum(q) - q_i <= lay_i, which is the
+        least of: every back, the back and lay of one outcome, and for the j cheapest lays (j >= 2) their sum / (j - 1).
+        """
+        all_backs = back.sum(axis= 1)
+        back_and_lay = (back + lay).min(axis= 1)
+        lays = np.cumsum(np.sort(lay, axis= 1), axis= 1)[:, 1:] / np.arange(1, lay.shape[1])
+        return np.minimum(np.minimum(all_backs, back_and_lay), lays.min(axis= 1))
+
+    def _no_arbitrage(self, event_count: int, outcome_ids: Dict[Tuple[int, Hashable], int], prices: np.ndarray,
+                      candidates: np.ndarray) -> np.ndarray:
+        """Whether each candidate event is proven unable to return more than 1 / (1 + margin) in every result, by a
+        distribution over final scores under which no price returns more than that on average."""
+        outcome_count = len(outcome_ids)
+        event_returns: Dict[int, List[np.ndarray]] = {}
+        unknown: Set[int] = set()
+        for (event_index, key), outcome_id in outcome_ids.items():
+            if not candidates[event_index] or event_index in unknown:
+                continue
+            settlement = _settlement(key)   # type: ignore
+            if settlement is None:
+                unknown.add(event_index)
+                continue
+            won, pushed = settlement
+            returns = event_returns.setdefault(event_index, [])
+            if prices[outcome_id] > 0:
+                returns.append(won * prices[outcome_id] + pushed)
+            if prices[outcome_count + outcome_id] > 0:
+                returns.append((1 - won - pushed) * prices[outcome_count + outcome_id] + pushed)
+
+        proven = np.zeros(event_count, dtype= bool)
+        solvable = sorted((index for index in event_returns if index not in unknown), key= lambda index: len(event_returns[index]))
+        for start in range(0, len(solvable), _SOLVE_CHUNK):
+            chunk = solvable[start:start + _SOLVE_CHUNK]
+            # padding prices return nothing, which no distribution can make larger
+            returns = np.zeros((len(chunk), len(event_returns[chunk[-1]]), _GOALS * _GOALS))
+            for i, event_index in enumerate(chunk):
+                returns[i, :len(event_returns[event_index])] = event_returns[event_index]
+            try:
+                distributions = _score_distributions(returns)
+            except np.linalg.LinAlgError:
+                continue
+            largest = (returns @ distributions[..., None])[..., 0].max(axis= 1)
+            proven[chunk] = largest * (1 + self.margin) <= 1 - 1e-9
+        return proven
@@ -0,0 +1,336 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+from arb_search.apis.base_api import API_Instance
+from arb_search.user_event.event import UserEvent
+
+from .api_handler import API_Handler
+from .dispatch import CalculatorDispatcher
+from .metrics import metrics
+from .prescreen import ArbitragePreScreen
+from .sport_types import SportType
+
+
+class RefreshScheduler:
+    """Priority queue of events ordered by when each is next due for a refresh.
+
+    An event's refresh interval is kickoff_fraction of the time left until it starts, so an event kicking off in an
+    hour is refreshed every minute and one kicking off tomorrow every 15. The interval is shortened further the
+    closer the event's last best_implied_sum was to 1.0, reaching min_interval at or below 1.0, and is clamped to
+    [min_interval, max_interval]. Times are time.monotonic() values.
+    """
+
+    def __init__(self, min_interval: float = 5.0, max_interval: float = 900.0, kickoff_fraction: float = 1 / 60,
+                 near_arb_margin: float = 0.05) -> None:
+        """
+        Args:
+            min_interval (float): Shortest refresh interval in seconds.
+            max_interval (float): Longest refresh interval in seconds.
+            kickoff_fraction (float): Share of the time left to kickoff between refreshes.
+            near_arb_margin (float): Implied sums within this of 1.0 shorten the interval proportionally.
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.kickoff_fraction = kickoff_fraction
+        self.near_arb_margin = near_arb_margin
+
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._due: Dict[Hashable, float] = {}       # key -> due time of its live heap entry, older entries are skipped
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._due
+
+    def interval(self, event: UserEvent, now: Optional[datetime] = None) -> float:
+        if now is None:
+            now = datetime.now()
+        if event.start_time is None:
+            interval = self.max_interval
+        else:
+            interval = max((event.start_time - now).total_seconds(), 0.0) * self.kickoff_fraction
+
+        if event.best_implied_sum is not None and self.near_arb_margin > 0:
+            interval *= min(max(event.best_implied_sum - 1.0, 0.0) / self.near_arb_margin, 1.0)
+
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def schedule(self, key: Hashable, due: float) -> None:
+        """Set key's next refresh to due, replacing any earlier schedule."""
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, next(self._counter), key))
+
+    def schedule_event(self, key: Hashable, event: UserEvent, now: Optional[float] = None, min_interval: float = 0.0) -> float:
+        """Schedule key one interval, at least min_interval, from now, returns the due time."""
+        due = (time.monotonic() if now is None else now) + max(self.interval(event), min_interval)
+        self.schedule(key, due)
+        return due
+
+    def remove(self, key: Hashable) -> None:
+        self._due.pop(key, None)
+
+    def next_due(self) -> Optional[float]:
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[Hashable]:
+        """Remove and return the keys due by now, most overdue first. They are not scheduled again until schedule is called."""
+        if now is None:
+            now = time.monotonic()
+        keys: List[Hashable] = []
+        while self._heap and (limit is None or len(keys) < limit):
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            _, _, key = heapq.heappop(self._heap)
+            del self._due[key]
+            keys.append(key)
+        return keys
+
+    def _discard_stale(self) -> None:
+        while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+
+class CycleStats(NamedTuple):
+    started: float              # time.time() the cycle started
+    gathered: int               # events found by a full gather, 0 in refresh-only cycles
+    refreshed: int
+    candidates: int             # events the prescreen sent to the calculator
+    opportunities: int          # events the calculator found profitable
+    gather_time: float
+    refresh_time: float
+    screen_time: float
+    calculate_time: float
+    total_time: float
+    failed_updates: Dict[str, BaseException]        # API name -> error of its update_events call
+    failed_calculations: Dict[str, BaseException]   # event name -> error the calculator gave it
+
+
+class Scanner:
+    """Long running scan loop around an API_Handler, keeping its events between cycles.
+
+    Every gather_interval seconds every API gathers its events again, picking up new events and markets. In between,
+    each cycle only refreshes the events the scheduler says are due, through their APIs' update_events, so events
+    about to start or close to an arbitrage are refreshed every few seconds and far-future events rarely, though never
+    more often than an API's min_refresh_interval (the-odds-api's odds cache TTL). Quota spent on refreshes can be
+    capped with TheOddsAPI_V4's refresh_quota_per_hour. Gathered and refreshed events are screened and the ones that
+    may hold an arbitrage sent to the calculator. Events are dropped once they have started. Nothing is printed, each
+    cycle's CycleStats, including its failures, goes to on_cycle and self.cycle_stats.
+
+    Example:
+        scanner = Scanner(handler, [SportType.Soccer], CalculatorDispatcher(), on_opportunity= save_to_file, on_cycle= print)
+        scanner.run()
+    """
+
+    def __init__(self, handler: API_Handler, sport_types: List[SportType], dispatcher: Optional[CalculatorDispatcher] = None,
+                 prescreen: Optional[ArbitragePreScreen] = None, scheduler: Optional[RefreshScheduler] = None,
+                 gather_interval: float = 1800.0, max_refresh_per_cycle: int = 50, idle_sleep: float = 1.0,
+                 gather_new_leagues: bool = True, on_opportunity: Optional[Callable[[UserEvent], None]] = None,
+                 on_cycle: Optional[Callable[[CycleStats], None]] = None, history: int = 1000, metrics_path: Optional[str] = None) -> None:
+        """
+        Args:
+            handler (API_Handler): Gathers and matches the events of its APIs.
+            sport_types (List[SportType]): Sport types to scan.
+            dispatcher (CalculatorDispatcher): Sends candidate events to the calculator, None only screens them.
+            prescreen (ArbitragePreScreen): Picks the candidate events, also sets the implied sums the scheduler uses.
+            scheduler (RefreshScheduler): Decides when each event is refreshed.
+            gather_interval (float): Seconds between full gathers.
+            max_refresh_per_cycle (int): Most overdue events refreshed per cycle, the rest wait for the next one.
+            idle_sleep (float): Longest wait between cycles when nothing is due.
+            gather_new_leagues (bool): Passed to API_Handler.gather_all_sport_type.
+            on_opportunity (Callable[[UserEvent], None]): Called with each event the calculator found profitable.
+            on_cycle (Callable[[CycleStats], None]): Called by run with the stats of each cycle.
+            history (int): Number of CycleStats kept in self.cycle_stats.
+            metrics_path (str): File the enabled metrics are written to in the Prometheus text format after each cycle.
+        """
+        self.handler = handler
+        self.sport_types = sport_types
+        self.dispatcher = dispatcher
+        self.prescreen = prescreen if prescreen is not None else ArbitragePreScreen()
+        self.scheduler = scheduler if scheduler is not None else RefreshScheduler()
+        self.gather_interval = gather_interval
+        self.max_refresh_per_cycle = max_refresh_per_cycle
+        self.idle_sleep = idle_sleep
+        self.gather_new_leagues = gather_new_leagues
+        self.on_opportunity = on_opportunity
+        self.on_cycle = on_cycle
+        self.metrics_path = metrics_path
+
+        self.events: Dict[Hashable, UserEvent] = {}
+        self.cycle_stats: Deque[CycleStats] = deque(maxlen= history)
+        # failures of the last refresh and calculate, like API_Handler.failed_apis
+        self.failed_updates: Dict[str, BaseException] = {}
+        self.failed_calculations: Dict[str, BaseException] = {}
+        self._next_gather: Optional[float] = None
+        self._stop = threading.Event()
+
+    def run(self, cycles: Optional[int] = None) -> None:
+        """Scan until stop() is called, or for cycles cycles."""
+        self._stop.clear()
+        count = 0
+        while not self._stop.is_set() and (cycles is None or count < cycles):
+            stats = self.run_cycle()
+            count += 1
+            if self.on_cycle is not None:
+                self.on_cycle(stats)
+
+            wake = min((due for due in (self.scheduler.next_due(), self._next_gather) if due is not None), default= time.monotonic())
+            self._stop.wait(min(max(wake - time.monotonic(), 0.0), self.idle_sleep))
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run_cycle(self) -> CycleStats:
+        """Gather if it is time to, otherwise refresh the due events, then screen and calculate them."""
+        started = time.time()
+        start = time.monotonic()
+        gathered = refreshed = 0
+        gather_time = refresh_time = 0.0
+        self.failed_updates = {}
+
+        if self._next_gather is None or start >= self._next_gather:
+            events = self.gather()
+            gathered = len(events)
+            gather_time = time.monotonic() - start
+        else:
+            events = self.refresh()
+            refreshed = len(events)
+            refresh_time = time.monotonic() - start
+
+        screen_start = time.monotonic()
+        candidates = self.prescreen.screen(list(events.values()))
+        calculate_start = time.monotonic()
+        opportunities = self.calculate(candidates)
+        end = time.monotonic()
+
+        if gathered:
+            for api in self.handler.apis:
+                if hasattr(api, "record_scan_results"):
+                    api.record_scan_results(list(events.values()))    # type: ignore
+        for key, event in events.items():
+            self.scheduler.schedule_event(key, event, end, self._min_refresh_interval(event))
+
+        stats = CycleStats(started, gathered, refreshed, len(candidates), opportunities, gather_time, refresh_time,
+                           calculate_start - screen_start, end - calculate_start, end - start, self.failed_updates, self.failed_calculations)
+        self.cycle_stats.append(stats)
+
+        if metrics.enabled:
+            for stage, seconds in (("gather", gather_time), ("refresh", refresh_time), ("screen", stats.screen_time), ("calculate", stats.calculate_time)):
+                if seconds:
+                    metrics.observe("cycle_stage_seconds", seconds, stage= stage)
+            metrics.inc("cycles_total", kind= "gather" if gathered else "refresh")
+            metrics.inc("candidates_total", stats.candidates)
+            metrics.inc("opportunities_total", opportunities)
+            if self.metrics_path is not None:
+                metrics.write_prometheus(self.metrics_path)
+        return stats
+
+    def gather(self) -> Dict[Hashable, UserEvent]:
+        """Gather every event again, events seen before are replaced by the new ones but keep their implied sum."""
+        events = self.handler.gather_all_sport_type(sport_types= self.sport_types, gather_new_leagues= self.gather_new_leagues)
+        self._next_gather = time.monotonic() + self.gather_interval
+
+        now = datetime.now()
+        events = [event for event in events if event.start_time is None or event.start_time > now]
+        gathered: Dict[Hashable, UserEvent] = {}
+        for event in events:
+            key = self._key(event)
+            previous = self.events.get(key)
+            if previous is not None and event.best_implied_sum is None:
+                event.best_implied_sum = previous.best_implied_sum
+            gathered[key] = event
+
+        for key in self.events.keys() - gathered.keys():
+            self.scheduler.remove(key)
+        self.events = gathered
+        return gathered
+
+    def refresh(self) -> Dict[Hashable, UserEvent]:
+        """Refresh the due events through each of their APIs, events that have started are dropped. APIs whose
+        update_events fails are recorded in self.failed_updates."""
+        self.failed_updates = {}
+        now = datetime.now()
+        events: Dict[Hashable, UserEvent] = {}
+        for key in self.scheduler.pop_due(limit= self.max_refresh_per_cycle):
+            event = self.events.get(key)
+            if event is None:
+                continue
+            if event.start_time is not None and event.start_time <= now:
+                del self.events[key]
+                continue
+            events[key] = event
+
+        apis_events: Dict[API_Instance, List[UserEvent]] = {}   # type: ignore
+        for event in events.values():
+            for api in event.api_specific_data.keys():
+                apis_events.setdefault(api, []).append(event)
+
+        for api, api_events in apis_events.items():
+            try:
+                api.update_events(api_events)
+            except Exception as e:
+                self.failed_updates[api.name] = e
+                metrics.inc("update_failures_total", api= api.name)
+
+        return events
+
+    def calculate(self, events: List[UserEvent]) -> int:
+        """Send events to the calculator, returns how many were profitable. Events the calculator failed on are
+        recorded in self.failed_calculations."""
+        self.failed_calculations = {}
+        if self.dispatcher is None or not events:
+            return 0
+
+        opportunities = 0
+        for result in self.dispatcher.dispatch(events):
+            if result.error is not None:
+                self.failed_calculations[result.event.get_name(self.handler.registry)] = result.error
+                metrics.inc("calculation_failures_total")
+            elif any(profit > 0 for profit in result.event.profit):
+                opportunities += 1
+                if self.on_opportunity is not None:
+                    self.on_opportunity(result.event)
+        return opportunities
+
+    def timing_summary(self) -> Dict[str, float]:
+        """Mean and worst cycle times over self.cycle_stats, split into gather and refresh-only cycles."""
+        stats = list(self.cycle_stats)
+        if not stats:
+            return {'cycles': 0}
+
+        gathers = [cycle for cycle in stats if cycle.gathered]
+        refreshes = [cycle for cycle in stats if not cycle.gathered]
+        summary: Dict[str, float] = {
+            'cycles': len(stats),
+            'events': len(self.events),
+            'refreshed': sum(cycle.refreshed for cycle in stats),
+            'candidates': sum(cycle.candidates for cycle in stats),
+            'opportunities': sum(cycle.opportunities for cycle in stats),
+            'mean_screen_time': sum(cycle.screen_time for cycle in stats) / len(stats),
+            'mean_calculate_time': sum(cycle.calculate_time for cycle in stats) / len(stats),
+        }
+        if gathers:
+            summary['mean_gather_cycle_time'] = sum(cycle.total_time for cycle in gathers) / len(gathers)
+            summary['max_gather_cycle_time'] = max(cycle.total_time for cycle in gathers)
+        if refreshes:
+            summary['mean_refresh_cycle_time'] = sum(cycle.total_time for cycle in refreshes) / len(refreshes)
+            summary['max_refresh_cycle_time'] = max(cycle.total_time for cycle in refreshes)
+        return summary
+
+    @staticmethod
+    def _min_refresh_interval(event: UserEvent) -> float:
+        """The longest min_refresh_interval of the event's APIs, refreshing sooner than an API's odds cache TTL costs
+        quota for unchanged prices."""
+        return max((getattr(api, "min_refresh_interval", 0.0) for api in event.api_specific_data), default= 0.0)
+
+    def _key(self, event: UserEvent) -> Hashable:
+        """An event's start time and name, which stay the same across gathers."""
+        return (event.start_time, event.get_name(self.handler.registry))
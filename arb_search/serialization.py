@@ -0,0 +1,123 @@
+import json
+import threading
+from typing import IO, Any, Dict, Optional, Type, Union
+
+from .utils import atomic_write
+
+
+class Codec:
+    """Turns plain data (dicts, lists, strings, numbers, bools and None) into bytes and back.
+
+    Tuples come back as lists, datetimes and other objects are written as their str().
+    """
+    name: str = ''
+    extension: str = ''
+
+    def dumps(self, data: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, payload: bytes) -> Any:
+        """Raises ValueError when payload can't be decoded."""
+        raise NotImplementedError
+
+    def dump(self, data: Any, f: IO[bytes]) -> None:
+        f.write(self.dumps(data))
+
+    def load(self, f: IO[bytes]) -> Any:
+        return self.loads(f.read())
+
+
+class JSONCodec(Codec):
+    """UTF-8 JSON, compact unless an indent is given."""
+    name = 'json'
+    extension = '.json'
+
+    def __init__(self, indent: Optional[int] = None) -> None:
+        self.indent = indent
+
+    def dumps(self, data: Any) -> bytes:
+        separators = (',', ':') if self.indent is None else None
+        return json.dumps(data, indent= self.indent, separators= separators, default= str).encode('utf-8')
+
+    def loads(self, payload: bytes) -> Any:
+        return json.loads(payload)
+
+
+class MsgpackZstdCodec(Codec):
+    """MessagePack compressed with Zstandard, several times smaller and faster than JSON.
+
+    Needs the msgpack and zstandard packages, which are only imported when the codec is created.
+    """
+    name = 'msgpack+zstd'
+    extension = '.msgpack.zst'
+
+    def __init__(self, level: int = 3) -> None:
+        """
+        Args:
+            level (int): Zstandard compression level, 1 to 22. Levels above 3 mostly cost speed for little size.
+        """
+        try:
+            import msgpack
+            import zstandard
+        except ImportError as e:
+            raise ImportError(f"The {self.name} codec needs the msgpack and zstandard packages: pip install msgpack zstandard") from e
+        self._msgpack = msgpack
+        self._zstandard = zstandard
+        self.level = level
+        # zstandard's compressors and decompressors can't be shared between threads
+        self._local = threading.local()
+
+    def dumps(self, data: Any) -> bytes:
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            compressor = self._local.compressor = self._zstandard.ZstdCompressor(level= self.level)
+        return compressor.compress(self._msgpack.packb(data, use_bin_type= True, default= str))
+
+    def loads(self, payload: bytes) -> Any:
+        decompressor = getattr(self._local, 'decompressor', None)
+        if decompressor is None:
+            decompressor = self._local.decompressor = self._zstandard.ZstdDecompressor()
+        try:
+            return self._msgpack.unpackb(decompressor.decompress(payload), raw= False, strict_map_key= False)
+        except self._zstandard.ZstdError as e:
+            raise ValueError(f"Invalid {self.name} payload: {e}") from e
+
+
+CODECS: Dict[str, Type[Codec]] = {
+    JSONCodec.name: JSONCodec,
+    MsgpackZstdCodec.name: MsgpackZstdCodec,
+}
+
+
+def get_codec(codec: Union[str, Codec], **kwargs) -> Codec:
+    """The codec called codec, created with kwargs. A Codec instance is returned as it is."""
+    if isinstance(codec, Codec):
+        return codec
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec '{codec}', choose from {list(CODECS)}")
+    return CODECS[codec](**kwargs)
+
+
+def codec_for_path(filename: str) -> Codec:
+    """The codec of a file, from its extension."""
+    for codec_type in CODECS.values():
+        if filename.endswith(codec_type.extension):
+            return codec_type()
+    raise ValueError(f"No codec for the extension of {filename}")
+
+
+def dump_file(filename: str, data: Any, codec: Union[str, Codec], atomic: bool = False) -> None:
+    """Write data to filename with codec, through a temporary file renamed over filename when atomic."""
+    payload = get_codec(codec).dumps(data)
+    if atomic:
+        atomic_write(filename, lambda f: f.write(payload), binary= True)
+    else:
+        with open(filename, 'wb') as f:
+            f.write(payload)
+
+
+def load_file(filename: str, codec: Optional[Union[str, Codec]] = None) -> Any:
+    """Read a file written by dump_file, the codec defaults to the one of filename's extension."""
+    codec = codec_for_path(filename) if codec is None else get_codec(codec)
+    with open(filename, 'rb') as f:
+        return codec.load(f)
@@ -1,3 +1,5 @@
 from .bet import UserBet
 from .bookmaker import UserBookmaker
 from .event import UserEvent
+from .odds_book import OddsBook
+from .bet_delta import BetDelta
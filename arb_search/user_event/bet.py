@@ -1,22 +1,32 @@
-import json
 from datetime import datetime
 from typing import Any, Dict, Optional, Type, Union
 
 # from arb_search.apis.base_api import API_Instance
 from betting_event import Bet, BetType
 
+from ..config import config
 from .bookmaker import UserBookmaker
 
 
+class _DefaultBookmaker:
+    """Creates UserBet.DefaultBookmaker on first access, as its defaults are read from the config."""
+
+    def __get__(self, instance: Optional['UserBet'], owner: Type['UserBet']) -> UserBookmaker:
+        bookmaker = UserBookmaker("Default Bookmaker")
+        setattr(owner, 'DefaultBookmaker', bookmaker)
+        return bookmaker
+
+
 class UserBet(Bet):
-    DefaultBookmaker = UserBookmaker("Default Bookmaker")
-    Defaults = json.load(open("settings/event_defaults.json", "r"))["bet"]
+    DefaultBookmaker = _DefaultBookmaker()
 
     def __init__(self, bet_type: Union[BetType, str, int], value: str, odds: float,
                  bookmaker: Optional[UserBookmaker] = None, lay: bool = False, volume: float = -1.0,
-                 previous_wager: float = Defaults["previous_wager"], wager: float = 0.0,
+                 previous_wager: Optional[float] = None, wager: float = 0.0,
                  update_time: Optional[datetime] = None, api_specific_data: Optional[dict] = None
                 ) -> None:
+        if previous_wager is None:
+            previous_wager = config.defaults('bet')["previous_wager"]
         super().__init__(bet_type, value, odds, bookmaker, lay, volume, previous_wager, wager)
 
         if update_time is None:
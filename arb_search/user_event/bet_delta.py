@@ -0,0 +1,44 @@
+from typing import List, Optional, Tuple
+
+from .bet import UserBet
+
+
+class BetDelta:
+    """What update_bet_data found had changed about an event's wagered bets.
+
+    moved holds (bet, odds) for bets no longer offered at their odds while their outcome still is, odds being the best
+    now on offer. shrunk holds bets still offered with less volume than their wager and vanished the bets whose outcome
+    is no longer offered at all. A delta is truthy when the wagers need recalculating, which is only when a wagered
+    bet got worse: it vanished, shrank or moved to worse odds.
+    """
+
+    def __init__(self, moved: Optional[List[Tuple[UserBet, float]]] = None, shrunk: Optional[List[UserBet]] = None,
+                 vanished: Optional[List[UserBet]] = None) -> None:
+        self.moved: List[Tuple[UserBet, float]] = moved if moved is not None else []
+        self.shrunk: List[UserBet] = shrunk if shrunk is not None else []
+        self.vanished: List[UserBet] = vanished if vanished is not None else []
+
+    @staticmethod
+    def is_worse(bet: UserBet, odds: float) -> bool:
+        """Whether taking bet at odds instead of bet.odds pays less, lay bets pay less at higher odds."""
+        return odds > bet.odds if bet.lay else odds < bet.odds
+
+    @property
+    def worsened(self) -> List[UserBet]:
+        return [bet for bet, odds in self.moved if self.is_worse(bet, odds)] + self.shrunk + self.vanished
+
+    @property
+    def needs_recalculation(self) -> bool:
+        return bool(self.shrunk or self.vanished or any(self.is_worse(bet, odds) for bet, odds in self.moved))
+
+    def __bool__(self) -> bool:
+        return self.needs_recalculation
+
+    def __ior__(self, other: 'BetDelta') -> 'BetDelta':
+        self.moved.extend(other.moved)
+        self.shrunk.extend(other.shrunk)
+        self.vanished.extend(other.vanished)
+        return self
+
+    def __repr__(self) -> str:
+        return f"BetDelta(moved= {len(self.moved)}, shrunk= {len(self.shrunk)}, vanished= {len(self.vanished)})"
@@ -1,21 +1,35 @@
-import json
+from typing import Optional
 
 from betting_event import Bookmaker
 
-DEFAULTS = json.load(open("settings/event_defaults.json", "r"))["bookmaker"]
+from ..config import config
 
 
 class UserBookmaker(Bookmaker):
 
     def __init__(self,
                  name: str,
-                 commission: float = DEFAULTS['commission'],
-                 balance: float = DEFAULTS['balance'], 
-                 percent_of_balance: float = DEFAULTS['percent_of_balance'],
-                 ignore_wager_precision: bool = DEFAULTS['ignore_wager_precision'],
-                 max_wager_count: int = DEFAULTS['max_wager_count'],
-                 lowest_valid_wager: float = DEFAULTS['lowest_valid_wager']
+                 commission: Optional[float] = None,
+                 balance: Optional[float] = None,
+                 percent_of_balance: Optional[float] = None,
+                 ignore_wager_precision: Optional[bool] = None,
+                 max_wager_count: Optional[int] = None,
+                 lowest_valid_wager: Optional[float] = None
                 ) -> None:
+        """Arguments left as None take their value from the bookmaker section of settings/event_defaults.json."""
+        defaults = config.defaults('bookmaker')
+        if commission is None:
+            commission = defaults['commission']
+        if balance is None:
+            balance = defaults['balance']
+        if percent_of_balance is None:
+            percent_of_balance = defaults['percent_of_balance']
+        if ignore_wager_precision is None:
+            ignore_wager_precision = defaults['ignore_wager_precision']
+        if max_wager_count is None:
+            max_wager_count = defaults['max_wager_count']
+        if lowest_valid_wager is None:
+            lowest_valid_wager = defaults['lowest_valid_wager']
 
         super().__init__(commission, wager_limit=balance*percent_of_balance, ignore_wager_precision= ignore_wager_precision, max_wager_count= max_wager_count, lowest_valid_wager= lowest_valid_wager)
 
@@ -1,21 +1,29 @@
-import json
+import threading
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Type
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Type
 
 from betting_event import Event
 
+from ..config import config
+from ..metrics import metrics
 from . import UserBet, UserBookmaker
+from .bet_delta import BetDelta
+from .odds_book import OddsBook
 
-_rapid_api_key = json.load(open("settings/api_keys.json", "r"))["rapid-api"]
+def _outcome_side(bet: UserBet) -> Hashable:
+    return (id(bet.bookmaker), bet.bet_type, bet.value, bet.lay)
 
 class UserEvent(Event):
     _BOOKMAKER_CLASS = UserBookmaker
     _BET_CLASS = UserBet
-    DEFAULTS = json.load(open("settings/event_defaults.json", "r"))["event"]
+
+    # the bets are held either as UserBet objects or compacted into an OddsBook, never both
+    _bets: Optional[List[UserBet]] = None
+    _odds_book: Optional[OddsBook] = None
 
     def __init__(self,
-                 wager_limit: float = DEFAULTS["wager_limit"],
-                 wager_precision: float = DEFAULTS["wager_precision"],
+                 wager_limit: Optional[float] = None,
+                 wager_precision: Optional[float] = None,
                  profit: list[float] = [0.0, 0.0],
                  no_draw: bool = False,
                  bookmakers: Optional[List[UserBookmaker]] = None,
@@ -23,7 +31,13 @@ class UserEvent(Event):
                  start_time: Optional[datetime] = None,
                  api_specific_data: Optional[Dict['API_Instance', Dict[str, Any]]] = None
                 ) -> None:
+        if wager_limit is None:
+            wager_limit = config.defaults('event')["wager_limit"]
+        if wager_precision is None:
+            wager_precision = config.defaults('event')["wager_precision"]
 
+        # held while the bets are changed in place or moved between bets and odds_book, e.g. by a Betfair stream
+        self.lock = threading.RLock()
         super().__init__(wager_limit, wager_precision, profit, no_draw, bookmakers, bets)
 
         self.start_time: Optional[datetime] = start_time
@@ -31,30 +45,136 @@ class UserEvent(Event):
             api_specific_data = {}
         self.api_specific_data: Dict['API_Instance', Dict[str, Any]] = api_specific_data
 
-        self.bets: List[UserBet]
         self.bookmakers: List[UserBookmaker]
         self.score: float = 0
+        # canonical (home, away, league) ids from API_Handler.registry, set when the event is matched
+        self.entity_ids: Optional[Tuple[int, int, int]] = None
+        # lowest implied probability sum found by ArbitragePreScreen, below 1.0 means an arbitrage may exist
+        self.best_implied_sum: Optional[float] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    @property
+    def bets(self) -> List[UserBet]:
+        """The event's bets. After compact() the UserBet objects are created again from the odds book on first access."""
+        with self.lock:
+            if self._bets is None:
+                self._bets = self._odds_book.to_bets() if self._odds_book is not None else []
+                self._odds_book = None
+            return self._bets
+
+    @bets.setter
+    def bets(self, bets: List[UserBet]) -> None:
+        with self.lock:
+            self._bets = bets
+            self._odds_book = None
+
+    @property
+    def odds_book(self) -> OddsBook:
+        """The event's bets as an OddsBook, compacting them if needed. A list read from bets before this is detached."""
+        with self.lock:
+            if self._odds_book is None:
+                self._odds_book = OddsBook.from_bets(self._bets or [])
+                self._bets = None
+            return self._odds_book
+
+    @odds_book.setter
+    def odds_book(self, odds_book: OddsBook) -> None:
+        with self.lock:
+            self._odds_book = odds_book
+            self._bets = None
+        for bookmaker in odds_book.bookmakers:
+            if bookmaker is not None and bookmaker not in self.bookmakers:
+                self.bookmakers.append(bookmaker)
+
+    @property
+    def compacted(self) -> bool:
+        """Whether the bets are held in an OddsBook rather than as UserBet objects."""
+        return self._odds_book is not None
+
+    def odds_snapshot(self) -> OddsBook:
+        """A copy of the event's prices, taken under its lock and leaving the bets as they are held."""
+        with self.lock:
+            if self._odds_book is not None:
+                return self._odds_book.copy()
+            return OddsBook.from_bets(self._bets or [])
+
+    @property
+    def bet_count(self) -> int:
+        return len(self._bets) if self._bets is not None else len(self._odds_book) if self._odds_book is not None else 0
+
+    def compact(self) -> OddsBook:
+        """Move the bets into an OddsBook and drop the UserBet objects, wagers are kept."""
+        return self.odds_book
 
     def update_from_event(self, __new_event: 'UserEvent', api: 'API_Instance') -> 'UserEvent':
-        current_bet_indexes = list(range(len(self.bets)))
+        """Merge the bets __new_event got from api into this event, see OddsBook.merge. Both events are compacted."""
         self.bookmakers = __new_event.bookmakers
+        with self.lock:
+            self.odds_book.merge(__new_event.odds_book, api)
+        return self
 
-        for new_bet in __new_event.bets:
-            for i in current_bet_indexes:
-                if self.bets[i] == new_bet:
-                    self.bets[i] = self.bets[i].update_from_bet(new_bet)
-                    break
-            else:
-                self.bets.append(new_bet)
+    def refresh_bets(self, new_bets: List[UserBet], refreshed: Callable[[UserBet], bool], watched: List[UserBet],
+                     outcome_side: Callable[[UserBet], Hashable] = _outcome_side) -> BetDelta:
+        """Replace the bets selected by refreshed with new_bets, the current prices of the same markets.
+
+        Bets still offered at their odds are updated in place, keeping their wager and position, the other new prices
+        are appended. Each watched bet that is no longer offered at its odds is reported as moved to the best odds now
+        offered on its outcome side, or as vanished, and removed unless it moved to better odds. The rest are dropped.
+
+        Args:
+            new_bets (List[UserBet]): Fresh prices of the refreshed markets.
+            refreshed (Callable[[UserBet], bool]): Selects the bets of the refreshed markets.
+            watched (List[UserBet]): Bets, usually the wagered ones, whose changes are reported.
+            outcome_side (Callable[[UserBet], Hashable]): Identifies the bets offered on the same outcome and side.
+        """
+        with self.lock:
+            return self._refresh_bets(new_bets, refreshed, watched, outcome_side)
+
+    def _refresh_bets(self, new_bets: List[UserBet], refreshed: Callable[[UserBet], bool], watched: List[UserBet],
+                      outcome_side: Callable[[UserBet], Hashable]) -> BetDelta:
+        delta = BetDelta()
+        offers: Dict[Hashable, Dict[float, UserBet]] = {}
+        for new_bet in new_bets:
+            offers.setdefault(outcome_side(new_bet), {}).setdefault(new_bet.odds, new_bet)
+        watched_ids = set(id(bet) for bet in watched)
+        matched_ids = set()
+
+        bets: List[UserBet] = []
+        for bet in self.bets:
+            if not refreshed(bet):
+                bets.append(bet)
                 continue
 
-            current_bet_indexes.remove(i)
-
-        for i in current_bet_indexes[::-1]:
-            if api in self.bets[i].api_specific_data.keys():
-                del self.bets[i]
-
-        return self
+            side_offers = offers.get(outcome_side(bet), {})
+            new_bet = side_offers.get(bet.odds)
+            if new_bet is not None and id(new_bet) not in matched_ids:
+                matched_ids.add(id(new_bet))
+                bet.volume = new_bet.volume
+                bet.update_time = new_bet.update_time
+                if id(bet) in watched_ids and bet.wager > bet.volume >= 0:
+                    delta.shrunk.append(bet)
+                bets.append(bet)
+            elif id(bet) in watched_ids:
+                if not side_offers:
+                    delta.vanished.append(bet)
+                    continue
+                best = min(side_offers.values(), key= lambda offer: offer.odds) if bet.lay else max(side_offers.values(), key= lambda offer: offer.odds)
+                delta.moved.append((bet, best.odds))
+                if not delta.is_worse(bet, best.odds):
+                    bet.volume = best.volume
+                    bets.append(bet)
+
+        bets.extend(new_bet for side_offers in offers.values() for new_bet in side_offers.values() if id(new_bet) not in matched_ids)
+        self.bets = bets
+        return delta
 
     def calculate_score(self) -> float:
         """Calculate the score of the event. Score is determined by the profit and the time to the start of the event."""
@@ -81,22 +201,47 @@ class UserEvent(Event):
         self.score = min_score
         return self.score
 
-    def get_name(self) -> str:
-        """Get the name of the event."""
+    def get_name(self, registry: Optional['EntityRegistry'] = None) -> str:
+        """Get the name of the event. Uses the canonical team names when a registry is given and the event has been matched."""
+        if registry is not None and self.entity_ids is not None:
+            return " v ".join(registry.name("team_names", entity_id) for entity_id in self.entity_ids[:2]).replace('/', '-')
+
         api = list(self.api_specific_data.keys())[0]
         return " v ".join(api.read_event_comparison_data(self)[1:3]).replace('/', '-')
 
-    def send_to_RapidAPI(self, api_key: str= _rapid_api_key, volume_percentage: float = 1.0) -> Event:
-        for bet in self.bets:
-            if bet.volume <= 0 or isinstance(bet.volume, str):
-                continue
+    def send_to_RapidAPI(self, api_key: Optional[str] = None, volume_percentage: float = 1.0, cache: Optional['CalculatorCache'] = None,
+                         capture: Optional['CaptureWriter'] = None) -> Event:
+        """Send the event to the calculator, which sets its profit and wagers. With a cache unchanged events aren't sent again,
+        with a capture the calculator's result is recorded."""
+        if cache is not None:
+            fingerprint, cache_bets = cache.key(self, volume_percentage)
+            if cache.restore(fingerprint, cache_bets, self):
+                metrics.inc('calculator_requests_total', result= 'cached')
+                return self
+
+        if api_key is None:
+            api_key = config.api_key('rapid-api')
+
+        # only limited volumes are scaled, and only those are scaled back
+        scaled_bets = [bet for bet in self.bets if not isinstance(bet.volume, str) and bet.volume > 0]
+        for bet in scaled_bets:
             bet.volume *= volume_percentage
 
-        result = super().send_to_RapidAPI(api_key)
-
-        for bet in self.bets:
-            bet.volume /= volume_percentage
-        
+        try:
+            with metrics.timer('calculator_seconds'):
+                result = super().send_to_RapidAPI(api_key)
+        except Exception:
+            metrics.inc('calculator_requests_total', result= 'error')
+            raise
+        finally:
+            for bet in scaled_bets:
+                bet.volume /= volume_percentage
+        metrics.inc('calculator_requests_total', result= 'sent')
+
+        if cache is not None:
+            cache.store(fingerprint, cache_bets, self)
+        if capture is not None:
+            capture.record_calculation(self, volume_percentage)
         return result
 
     def process(self) -> None:
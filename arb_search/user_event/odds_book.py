@@ -0,0 +1,247 @@
+import threading
+from array import array
+from datetime import datetime
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+
+from betting_event import BetType
+
+from ..config import config
+from .bet import UserBet
+from .bookmaker import UserBookmaker
+
+OutcomeKey = Tuple[BetType, str]
+BetKey = Tuple[Optional[str], int, bool, float]    # (bookmaker name, outcome id, lay, odds), the fields UserBet.__eq__ compares
+
+_COLUMNS = ("outcome", "odds", "volume", "update_time", "wager", "previous_wager", "bookmaker", "lay", "source")
+
+# (bet_type, value) pairs are shared by every event, they are interned once per process
+_outcome_ids: Dict[OutcomeKey, int] = {}
+_outcome_keys: List[OutcomeKey] = []
+_intern_lock = threading.Lock()
+
+
+def intern_outcome(bet_type: BetType, value: str) -> int:
+    """Return the process wide id of the outcome (bet_type, value)."""
+    key = (bet_type, value)
+    outcome_id = _outcome_ids.get(key)
+    if outcome_id is None:
+        with _intern_lock:
+            outcome_id = _outcome_ids.get(key)
+            if outcome_id is None:
+                outcome_id = len(_outcome_keys)
+                _outcome_keys.append(key)
+                _outcome_ids[key] = outcome_id
+    return outcome_id
+
+
+def outcome_key(outcome_id: int) -> OutcomeKey:
+    return _outcome_keys[outcome_id]
+
+
+class OddsBook:
+    """Struct-of-arrays store of an event's prices, one row per price.
+
+    Odds, volumes, wagers and update times (POSIX timestamps) are float arrays. Outcomes are process wide interned ids,
+    bookmakers and api_specific_data records are small ints indexing per book lists, so the prices of one runner or
+    outcome share a single api_specific_data record. UserBet objects are only created by bet() and to_bets().
+    """
+
+    __slots__ = _COLUMNS + ("bookmakers", "_bookmaker_ids", "sources", "_source_ids", "_index")
+
+    def __init__(self) -> None:
+        self.outcome = array('I')
+        self.odds = array('d')
+        self.volume = array('d')
+        self.update_time = array('d')
+        self.wager = array('d')
+        self.previous_wager = array('d')
+        self.bookmaker = array('H')
+        self.lay = array('b')
+        self.source = array('I')
+
+        self.bookmakers: List[Optional[UserBookmaker]] = []
+        self._bookmaker_ids: Dict[int, int] = {}            # id(bookmaker) -> index in self.bookmakers
+        self.sources: List[Dict[Any, Dict[str, Any]]] = []
+        self._source_ids: Dict[Hashable, int] = {}
+        self._index: Optional[Dict[BetKey, List[int]]] = None
+
+    @classmethod
+    def from_bets(cls, bets: Iterable[UserBet]) -> 'OddsBook':
+        book = cls()
+        book.extend(bets)
+        return book
+
+    def copy(self) -> 'OddsBook':
+        """A copy whose columns can change without affecting this book, the api_specific_data records are shared."""
+        book = OddsBook()
+        for name in _COLUMNS:
+            setattr(book, name, getattr(self, name)[:])
+        book.bookmakers = list(self.bookmakers)
+        book._bookmaker_ids = dict(self._bookmaker_ids)
+        book.sources = list(self.sources)
+        book._source_ids = dict(self._source_ids)
+        return book
+
+    def __len__(self) -> int:
+        return len(self.odds)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the columns."""
+        return sum(getattr(self, name).itemsize * len(getattr(self, name)) for name in _COLUMNS)
+
+    @property
+    def index(self) -> Dict[BetKey, List[int]]:
+        """Rows by bet_key, built on first use and kept up to date by add()."""
+        if self._index is None:
+            index: Dict[BetKey, List[int]] = {}
+            for row in range(len(self.odds)):
+                index.setdefault(self.bet_key(row), []).append(row)
+            self._index = index
+        return self._index
+
+    def add(self, bet_type: BetType, value: str, odds: float, bookmaker: Optional[UserBookmaker] = None, lay: bool = False,
+            volume: float = -1.0, previous_wager: Optional[float] = None, wager: float = 0.0,
+            update_time: Union[datetime, float, None] = None, api_specific_data: Optional[Dict[Any, Dict[str, Any]]] = None) -> int:
+        """Append a price, the arguments match UserBet's. Returns the new row."""
+        if previous_wager is None:
+            previous_wager = config.defaults('bet')["previous_wager"]
+        if update_time is None:
+            update_time = datetime.now().timestamp()
+        elif isinstance(update_time, datetime):
+            update_time = update_time.timestamp()
+
+        return self._append(intern_outcome(bet_type, value), odds, volume, update_time, wager, previous_wager,
+                            self._bookmaker_index(bookmaker), lay, self._source_index(api_specific_data or {}))
+
+    def add_bet(self, bet: UserBet) -> int:
+        return self.add(bet.bet_type, bet.value, bet.odds, bet.bookmaker, bet.lay, bet.volume, bet.previous_wager,
+                        bet.wager, bet.update_time, getattr(bet, "api_specific_data", None))
+
+    def extend(self, bets: Iterable[UserBet]) -> None:
+        for bet in bets:
+            self.add_bet(bet)
+
+    def merge(self, other: 'OddsBook', api: Any) -> None:
+        """Merge the prices of other, found by api, into this book. Same as merging UserBets with UserBet.update_from_bet.
+
+        Prices with the same bet_key are paired once each, in row order. The row with the later update time is kept
+        and given the api_specific_data of both. The unpaired prices of other are appended, this book's unpaired prices
+        that came from api are removed.
+        """
+        index = self.index
+        paired = bytearray(len(self.odds))
+        merged_sources: Dict[Tuple[int, int, bool], int] = {}
+        for other_row in range(len(other.odds)):
+            rows = index.get(other.bet_key(other_row))
+            row = next((row for row in rows if not paired[row]), None) if rows else None
+            if row is None:
+                self._append(other.outcome[other_row], other.odds[other_row], other.volume[other_row],
+                             other.update_time[other_row], other.wager[other_row], other.previous_wager[other_row],
+                             self._bookmaker_index(other.bookmakers[other.bookmaker[other_row]]), other.lay[other_row],
+                             self._source_index(other.sources[other.source[other_row]]))
+                paired.append(1)      # appended rows are not paired with later prices of other
+                continue
+
+            paired[row] = 1
+            newer = self.update_time[row] < other.update_time[other_row]
+            if newer:
+                # the newer bet replaces the row, bookmaker included, which may be a different but equal object
+                self.bookmaker[row] = self._bookmaker_index(other.bookmakers[other.bookmaker[other_row]])
+                self.volume[row] = other.volume[other_row]
+                self.update_time[row] = other.update_time[other_row]
+                self.wager[row] = other.wager[other_row]
+                self.previous_wager[row] = other.previous_wager[other_row]
+
+            # rows share source records, so each pair of records is merged once
+            merge_key = (self.source[row], other.source[other_row], newer)
+            source = merged_sources.get(merge_key)
+            if source is None:
+                current, new = self.sources[merge_key[0]], other.sources[merge_key[1]]
+                source = self._source_index({**current, **new} if newer else {**new, **current})
+                merged_sources[merge_key] = source
+            self.source[row] = source
+
+        stale = [row for row in range(len(paired)) if not paired[row] and api in self.sources[self.source[row]]]
+        if stale:
+            self.remove_rows(stale)
+
+    def bet_key(self, row: int) -> BetKey:
+        # bookmakers compare by name, equal ones loaded or built separately by each API are the same bookmaker
+        bookmaker = self.bookmakers[self.bookmaker[row]]
+        return (bookmaker.name if bookmaker is not None else None, self.outcome[row], bool(self.lay[row]), self.odds[row])
+
+    def outcome_key(self, row: int) -> OutcomeKey:
+        return _outcome_keys[self.outcome[row]]
+
+    def bet(self, row: int) -> UserBet:
+        """Create the UserBet for row, changes to it are not written back."""
+        bet_type, value = _outcome_keys[self.outcome[row]]
+        return UserBet(
+            bet_type= bet_type,
+            value= value,
+            odds= self.odds[row],
+            bookmaker= self.bookmakers[self.bookmaker[row]],
+            lay= bool(self.lay[row]),
+            volume= self.volume[row],
+            previous_wager= self.previous_wager[row],
+            wager= self.wager[row],
+            update_time= datetime.fromtimestamp(self.update_time[row]),
+            api_specific_data= dict(self.sources[self.source[row]])     # bets may add apis to their own copy
+        )
+
+    def to_bets(self) -> List[UserBet]:
+        return [self.bet(row) for row in range(len(self.odds))]
+
+    def _append(self, outcome: int, odds: float, volume: float, update_time: float, wager: float, previous_wager: float,
+                bookmaker: int, lay: bool, source: int) -> int:
+        row = len(self.odds)
+        self.outcome.append(outcome)
+        self.odds.append(odds)
+        self.volume.append(volume)
+        self.update_time.append(update_time)
+        self.wager.append(wager)
+        self.previous_wager.append(previous_wager)
+        self.bookmaker.append(bookmaker)
+        self.lay.append(lay)
+        self.source.append(source)
+        if self._index is not None:
+            self._index.setdefault(self.bet_key(row), []).append(row)
+        return row
+
+    def remove_rows(self, rows: List[int]) -> None:
+        """Remove rows, the rest keep their order."""
+        if not rows:
+            return
+        removed = set(rows)
+        kept = [row for row in range(len(self.odds)) if row not in removed]
+        for name in _COLUMNS:
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, [column[row] for row in kept]))
+        self._index = None
+
+    def _bookmaker_index(self, bookmaker: Optional[UserBookmaker]) -> int:
+        index = self._bookmaker_ids.get(id(bookmaker))
+        if index is None:
+            index = len(self.bookmakers)
+            self.bookmakers.append(bookmaker)
+            self._bookmaker_ids[id(bookmaker)] = index
+        return index
+
+    def _source_index(self, api_specific_data: Dict[Any, Dict[str, Any]]) -> int:
+        try:
+            if len(api_specific_data) == 1:
+                (api, data), = api_specific_data.items()
+                key: Hashable = (id(api), tuple(data.items()))
+            else:
+                key = tuple((id(api), tuple(data.items())) for api, data in api_specific_data.items())
+            index = self._source_ids.get(key)
+        except TypeError:       # unhashable values, the record is stored without sharing
+            key, index = None, None
+
+        if index is None:
+            index = len(self.sources)
+            self.sources.append(api_specific_data)
+            if key is not None:
+                self._source_ids[key] = index
+        return index
@@ -1,90 +1,278 @@
+import atexit
 import os
 import json
+import tempfile
+import threading
+import time
+import weakref
 
 import pickle
-from typing import Dict, Literal, Optional, List
+from collections import OrderedDict
+from functools import lru_cache
+from typing import IO, Any, Callable, Dict, Literal, Optional, List, Sequence, Set, Tuple
 
+from arb_search.config import config
 from arb_search.user_event.bookmaker import UserBookmaker
 
 from difflib import SequenceMatcher
 
 class StoredDict(dict):
-    def __init__(self, filename, method: Literal["pickle", "json"] = "pickle", *args, **kwargs):
+    """A dict that is kept in sync with a pickle or json file.
+
+    By default every mutation rewrites the file. With write_behind=True mutations (and calls to save) only mark the
+    store dirty, the file is written once flush_every mutations have built up, at most flush_interval seconds after
+    the first unwritten change (by a timer if the store goes quiet), on flush() or when leaving a with block. Writes
+    go to a temporary file that is renamed over the original so a crash never leaves a truncated file behind.
+
+    Only changes made through the store itself are seen. Changes to nested values, e.g.
+    table[api]["team_names"][name] = name, have to be followed by mark_dirty() or they are not saved.
+    """
+
+    def __init__(self, filename, method: Literal["pickle", "json"] = "pickle", *args, write_behind: bool = False,
+                 flush_every: int = 1000, flush_interval: float = 30.0, **kwargs):
         super().__init__(*args, **kwargs)
         self.filename = filename
         if method not in ["pickle", "json"]:
-            raise ValueError(f"Invalid format {format}")
+            raise ValueError(f"Invalid format {method}")
         self.method = method
+
+        self.write_behind = write_behind
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._pending_changes = 0
+        self._last_flush = time.monotonic()
+        self._flush_timer: Optional[threading.Timer] = None
+        self._lock = threading.RLock()
+
         self.load()
 
+        if self.write_behind:
+            # a weak reference, so registering doesn't keep every store alive until the process exits
+            atexit.register(_flush_if_alive, weakref.ref(self))
+
     def __setitem__(self, key, value):
-        super().__setitem__(key, value)
-        self.save()
+        with self._lock:
+            super().__setitem__(key, value)
+            self.save()
 
     def __delitem__(self, key):
-        super().__delitem__(key)
-        self.save()
+        with self._lock:
+            super().__delitem__(key)
+            self.save()
+
+    def __enter__(self) -> 'StoredDict':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.flush()
 
     def clear(self):
-        super().clear()
-        self.save()
+        with self._lock:
+            super().clear()
+            self.save()
 
     def update(self, *args, **kwargs):
-        super().update(*args, **kwargs)
-        self.save()
+        with self._lock:
+            super().update(*args, **kwargs)
+            self.save()
 
     def load(self):
         try:
-            if self.method == "pickle":
-                with open(self.filename, 'rb') as f:
-                    self.update(pickle.load(f))
-            elif self.method == "json":
-                with open(self.filename, 'r') as f:
-                    self.update(json.load(f))
+            with self._lock:
+                if self.method == "pickle":
+                    with open(self.filename, 'rb') as f:
+                        super().update(pickle.load(f))
+                elif self.method == "json":
+                    with open(self.filename, 'r') as f:
+                        super().update(json.load(f))
         except EOFError:
-            self.update({})
+            pass
         except FileNotFoundError:
             if os.path.dirname(self.filename): # if self.filename has a path, create the directory 
                 os.makedirs(os.path.dirname(self.filename), exist_ok=True)
-            self.update({})
+
+    def mark_dirty(self, count: int = 1):
+        """Record count changes made to nested values, e.g. table[api]["team_names"][name] = name, and save them like
+        any other mutation: straight away, or in write-behind mode once a threshold is reached."""
+        if not self.write_behind:
+            self._write()
+            return
+
+        with self._lock:
+            self._pending_changes += count
+            if self._pending_changes >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._write()
+            elif self._flush_timer is None:
+                # weakly referenced like the atexit flush, the timer doesn't keep the store alive either
+                delay = self._last_flush + self.flush_interval - time.monotonic()
+                self._flush_timer = threading.Timer(delay, _flush_if_alive, args= (weakref.ref(self),))
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
 
     def save(self):
-        if self.method == "pickle":
-            with open(self.filename, 'wb') as f:
-                pickle.dump(dict(self), f)
-        elif self.method == "json":
-            with open(self.filename, 'w') as f:
-                json.dump(dict(self), f, indent=4)
+        """Write the file, or in write-behind mode mark the store dirty and write only once a threshold is reached."""
+        self.mark_dirty()
+
+    def flush(self):
+        """Write any pending changes to disk."""
+        with self._lock:
+            if self._pending_changes:
+                self._write()
+
+    def _write(self):
+        with self._lock:
+            if self.method == "pickle":
+                atomic_write(self.filename, lambda f: pickle.dump(dict(self), f, protocol= pickle.HIGHEST_PROTOCOL), binary= True)
+            elif self.method == "json":
+                atomic_write(self.filename, lambda f: json.dump(dict(self), f, indent=4), binary= False)
+
+            self._pending_changes = 0
+            self._last_flush = time.monotonic()
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+
+
+def _flush_if_alive(ref: 'weakref.ReferenceType[StoredDict]') -> None:
+    stored_dict = ref()
+    if stored_dict is not None:
+        stored_dict.flush()
+
+
+def atomic_write(filename: str, writer: Callable[[IO], Any], binary: bool = True) -> None:
+    """Call writer with a temporary file next to filename, then rename it over filename."""
+    directory = os.path.dirname(filename) or '.'
+    os.makedirs(directory, exist_ok= True)
+    fd, temp_filename = tempfile.mkstemp(dir= directory, prefix= '.' + os.path.basename(filename), suffix= '.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w') as f:
+            writer(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
 
 
 class BookmakerStoredDict(Dict[str, UserBookmaker]):
     def __init__(self, bookmaker_stored_dict: Optional[StoredDict] = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if bookmaker_stored_dict is None:
-            bookmaker_stored_dict = StoredDict('settings/bookmakers.json', method= 'json')
+            bookmaker_stored_dict = StoredDict(config.path('bookmakers.json'), method= 'json')
         self.__dict_representation = bookmaker_stored_dict
+        # APIs gathering in their own threads add bookmakers while others read or save the table
+        self._lock = threading.RLock()
         # bookmaker_stored_dict.load()
         self._update_from_stored_dict()
 
     def _update_from_stored_dict(self):
-        for key, value in self.__dict_representation.items():
-            if key in self:
-                value["id"] = self[key]._id
-            self[key] = UserBookmaker.from_dict(key, value)
+        with self._lock:
+            for key, value in self.__dict_representation.items():
+                if key in self:
+                    value["id"] = self[key]._id
+                self[key] = UserBookmaker.from_dict(key, value)
 
     def _update_stored_dict(self):
-        for key, value in self.items():
-            self.__dict_representation[key] = value.as_dict(verbose= True)
+        with self._lock:
+            for key, value in self.items():
+                self.__dict_representation[key] = value.as_dict(verbose= True)
+
+    def add(self, name: str) -> UserBookmaker:
+        """Return the bookmaker called name, adding it with default settings and saving the table if it is new."""
+        with self._lock:
+            bookmaker = self.get(name)
+            if bookmaker is None:
+                bookmaker = self[name] = UserBookmaker(name= name)
+                self.save()
+            return bookmaker
 
     def load(self):
-        self.__dict_representation.load()
-        self._update_from_stored_dict()
+        with self._lock:
+            self.__dict_representation.load()
+            self._update_from_stored_dict()
 
     def save(self):
-        self._update_stored_dict()
-        self.__dict_representation.save()
+        with self._lock:
+            self._update_stored_dict()
+            self.__dict_representation.save()
+
+
+class TeamNameMatcher:
+    """Finds the closest of a fixed set of candidate names to a query name.
+
+    Gives the same answer as max(candidates, key= SequenceMatcher(None, name.lower(), x.lower()).ratio()), including
+    ties going to the first candidate. Candidates are lowercased and split into trigrams once, candidates sharing
+    the most trigrams with the query are compared first, and the cheap upper bounds real_quick_ratio and quick_ratio
+    skip the full comparison for candidates that cannot beat the best so far. Answers are kept in a bounded LRU cache.
+    """
+
+    def __init__(self, candidates: Sequence[str], cache_size: int = 4096) -> None:
+        if not candidates:
+            raise ValueError("TeamNameMatcher needs at least one candidate")
+
+        self.candidates: Tuple[str, ...] = tuple(candidates)
+        self._lowered = [candidate.lower() for candidate in self.candidates]
+        self._trigram_index: Dict[str, List[int]] = {}
+        for i, candidate in enumerate(self._lowered):
+            for trigram in self._trigrams(candidate):
+                self._trigram_index.setdefault(trigram, []).append(i)
+
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _trigrams(name: str) -> Set[str]:
+        padded = f'  {name} '
+        return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+    def match(self, name: str) -> str:
+        with self._lock:
+            if name in self._cache:
+                self._cache.move_to_end(name)
+                return self._cache[name]
+
+        result = self.candidates[self._best_index(name.lower())]
+
+        with self._lock:
+            self._cache[name] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last= False)
+        return result
+
+    def _best_index(self, name: str) -> int:
+        shared_trigrams = [0] * len(self._lowered)
+        for trigram in self._trigrams(name):
+            for i in self._trigram_index.get(trigram, ()):
+                shared_trigrams[i] += 1
+
+        best_index = -1
+        best_ratio = -1.0
+        for i in sorted(range(len(self._lowered)), key= lambda i: -shared_trigrams[i]):
+            matcher = SequenceMatcher(None, name, self._lowered[i])
+            if not self._may_beat(matcher.real_quick_ratio(), i, best_ratio, best_index):
+                continue
+            if not self._may_beat(matcher.quick_ratio(), i, best_ratio, best_index):
+                continue
+            ratio = matcher.ratio()
+            if self._may_beat(ratio, i, best_ratio, best_index):
+                best_index, best_ratio = i, ratio
+
+        return best_index
+
+    @staticmethod
+    def _may_beat(ratio: float, index: int, best_ratio: float, best_index: int) -> bool:
+        return ratio > best_ratio or (ratio == best_ratio and index < best_index)
+
+
+@lru_cache(maxsize= 1024)
+def get_team_name_matcher(team_names: Tuple[str, ...]) -> TeamNameMatcher:
+    """Return a shared TeamNameMatcher for the candidate names."""
+    return TeamNameMatcher(team_names)
 
 
 def team_name_matcher(name:str, team_names: List[str]) -> str:
     """Finds the closest match to name in team_names."""
-    return max(team_names, key= lambda x: SequenceMatcher(None, name.lower(), x.lower()).ratio())
\ No newline at end of file
+    return get_team_name_matcher(tuple(team_names)).match(name)
@@ -0,0 +1,110 @@
+"""Benchmark weighted_bin_packer against the _market_and_runner_limiter it replaced for listMarketBook requests.
+
+Builds the markets of a day of soccer events as Betfair.gather_events finds them (Match Odds, Over/Unders, Correct
+Score, Asian Handicap, ...) and packs them into requests with the EX_BEST_OFFERS price projection. The old limiter was
+given each event's total runner count for every market, as Betfair.update_events used to pass, and is checked
+against the real per-market runner counts.
+
+Run from the repository root:
+    python -m benchmarks.market_book_packing --markets 5000
+"""
+import argparse
+import math
+import random
+import time
+from typing import Dict, Iterator, List, Tuple
+
+from betfairlightweight.filters import price_projection
+
+from arb_search.apis.betfair.utils import price_projection_weight
+from arb_search.apis.utils import weighted_bin_packer
+
+# (market type, runner count range) of the markets an event usually has
+MARKET_TYPES = [
+    ("Match Odds", (3, 3)), ("Double Chance", (3, 3)), ("Both teams to Score?", (2, 2)), ("Total Goals Odd/Even", (2, 2)),
+    ("Over/Under 0.5 Goals", (2, 2)), ("Over/Under 1.5 Goals", (2, 2)), ("Over/Under 2.5 Goals", (2, 2)),
+    ("Over/Under 3.5 Goals", (2, 2)), ("Over/Under 4.5 Goals", (2, 2)), ("Correct Score", (13, 19)),
+    ("Asian Handicap", (2, 60)), ("Match Odds and Both teams to Score", (6, 6)),
+    ("Match Odds and Over/Under 2.5 Goals", (6, 6)), ("Match Odds and Over/Under 3.5 Goals", (6, 6)),
+    ("Home Win to Nil", (2, 2)), ("Away Win to Nil", (2, 2)), ("Home Over/Under 1.5 Goals", (2, 2)),
+]
+MAX_RUNNERS = 250
+
+
+def legacy_market_and_runner_limiter(market_id_runners_table: Dict[str, int], max_market_count: int, max_runners: int = 250) -> Iterator[List[str]]:
+    market_count = 0
+    runner_count = 0
+
+    market_ids: List[str] = []
+
+    for market_id, market_runners_count in market_id_runners_table.items():
+        market_count += 1
+        runner_count += market_runners_count
+        if market_count >= max_market_count or market_runners_count >= max_runners:
+            yield market_ids
+            market_count = 1
+            runner_count = market_runners_count
+            market_ids = []
+
+        market_ids.append(market_id)
+
+    if market_ids:
+        yield market_ids
+
+
+def build_markets(count: int, seed: int) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Per-market runner counts and, for the legacy limiter, the event's total runner count for every market."""
+    rand = random.Random(seed)
+    runners: Dict[str, int] = {}
+    event_totals: Dict[str, int] = {}
+    event = 0
+    while len(runners) < count:
+        event_markets = [(name, rand.randint(*runner_range)) for name, runner_range in MARKET_TYPES if rand.random() < 0.8]
+        total = sum(runner_count for _, runner_count in event_markets)
+        for i, (_, runner_count) in enumerate(event_markets[:count - len(runners)]):
+            market_id = f"1.{event:05d}{i:02d}"
+            runners[market_id] = runner_count
+            event_totals[market_id] = total
+        event += 1
+    return runners, event_totals
+
+
+def describe(bins: List[List[str]], runners: Dict[str, int], max_markets: int) -> str:
+    bins = [market_ids for market_ids in bins if market_ids]
+    over_runners = sum(1 for market_ids in bins if sum(runners[market_id] for market_id in market_ids) > MAX_RUNNERS)
+    over_markets = sum(1 for market_ids in bins if len(market_ids) > max_markets)
+    return f"{len(bins):6d} requests, {over_runners} over the runner limit, {over_markets} over the market limit"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description= __doc__, formatter_class= argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--markets", type= int, default= 5000)
+    parser.add_argument("--repeats", type= int, default= 20)
+    parser.add_argument("--seed", type= int, default= 0)
+    args = parser.parse_args()
+
+    weight = price_projection_weight(price_projection(price_data= ['EX_BEST_OFFERS']))
+    max_markets = 200 // weight
+    runners, event_totals = build_markets(args.markets, args.seed)
+
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        legacy_bins = list(legacy_market_and_runner_limiter(event_totals, max_markets, MAX_RUNNERS))
+    legacy_s = (time.perf_counter() - start) / args.repeats
+
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        bins = weighted_bin_packer(runners, MAX_RUNNERS, max_markets)
+    packer_s = (time.perf_counter() - start) / args.repeats
+
+    assert sorted(market_id for market_ids in bins for market_id in market_ids) == sorted(runners), "markets lost while packing"
+
+    lower_bound = max(math.ceil(sum(runners.values()) / MAX_RUNNERS), math.ceil(len(runners) / max_markets))
+    print(f"{len(runners)} markets, {sum(runners.values())} runners, price projection weight {weight}, "
+          f"at most {max_markets} markets and {MAX_RUNNERS} runners per request, at least {lower_bound} requests")
+    print(f"  _market_and_runner_limiter: {describe(legacy_bins, runners, max_markets)}, {1e3 * legacy_s:7.2f}ms")
+    print(f"  weighted_bin_packer:        {describe(bins, runners, max_markets)}, {1e3 * packer_s:7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
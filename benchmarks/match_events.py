@@ -0,0 +1,130 @@
+"""Benchmark API_Handler.match_events against the previous nested-loop matcher.
+
+Run from the repository root:
+    python -m benchmarks.match_events --sizes 100 1000 5000 20000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from arb_search import API_Handler, BookmakerStoredDict, SportType, UserEvent
+from arb_search.apis.base_api import BaseAPI
+from arb_search.utils import StoredDict
+
+
+class FakeAPI(BaseAPI):
+    """Serves pre-built events, names are read back from api_specific_data."""
+
+    def gather_events(self, sport_types: List[SportType], leagues: Optional[List[str]] = None) -> List[UserEvent]:
+        return []
+
+    def update_events(self, events: List[UserEvent]) -> List[UserEvent]:
+        return events
+
+    def update_bet_data(self, event: UserEvent, bet_indexes: List[int]) -> bool:
+        return False
+
+    def read_event_comparison_data(self, event: UserEvent) -> Tuple[str, str, str, str]:
+        data = event.api_specific_data[self]
+        return (self.name, data["home_team"], data["away_team"], data["league"])
+
+
+def build_events(api: FakeAPI, count: int, seed: int, alias: str = "") -> List[UserEvent]:
+    """A day of fixtures: kick-offs on 15 minute slots, team i plays team i+1."""
+    rand = random.Random(seed)
+    day_start = datetime(2023, 10, 7)
+    events = []
+    for i in range(count):
+        start_time = day_start + timedelta(minutes= 15 * random.Random(i).randrange(96))
+        event = UserEvent(start_time= start_time)
+        event.api_specific_data[api] = {
+            "home_team": f"Team {2*i}{alias}",
+            "away_team": f"Team {2*i + 1}{alias}",
+            "league": f"League {i % 50}{alias}",
+        }
+        events.append(event)
+    rand.shuffle(events)
+    return events
+
+
+def populate_name_table(table: StoredDict, api_1: FakeAPI, api_2: FakeAPI, count: int, alias: str) -> None:
+    table[api_1.name] = {"team_names": {}, "league_names": {}}
+    table[api_2.name] = {
+        "team_names": {f"Team {i}{alias}": f"Team {i}" for i in range(2 * count)},
+        "league_names": {f"League {i}{alias}": f"League {i}" for i in range(50)},
+    }
+
+
+def legacy_match_events(handler: API_Handler, apis_events: Dict[FakeAPI, List[UserEvent]]) -> List[UserEvent]:
+    """The nested-loop matcher that match_events replaced."""
+    apis_list = list(apis_events.keys())
+    for api_1 in apis_list[:-1]:
+        for api_2 in apis_list[apis_list.index(api_1) + 1:]:
+            event_1_idx = 0
+            while event_1_idx < len(apis_events[api_1]):
+                event_2_idx = -1
+                while event_2_idx < len(apis_events[api_2]) - 1:
+                    event_2_idx += 1
+                    event_1 = apis_events[api_1][event_1_idx]
+                    event_2 = apis_events[api_2][event_2_idx]
+                    if handler.events_match((event_1, event_2), (api_1, api_2)):
+                        event_1.update_from_event(event_2, api_2)
+                        del apis_events[api_2][event_2_idx]
+                        break
+                event_1_idx += 1
+    return [event for events in apis_events.values() for event in events]
+
+
+def run(count: int, legacy: bool, storage_dir: str) -> Dict[str, float]:
+    bookmaker_table = BookmakerStoredDict(StoredDict(os.path.join(storage_dir, "bookmakers.json"), method= "json"))
+    api_1 = FakeAPI("source_a", bookmaker_table)
+    api_2 = FakeAPI("source_b", bookmaker_table)
+    alias = " FC"
+
+    table = StoredDict(os.path.join(storage_dir, f"names_{count}.pkl"))
+    populate_name_table(table, api_1, api_2, count, alias)
+    handler = API_Handler([api_1, api_2], name_comparison_table= table, bookmaker_table= bookmaker_table)
+
+    def events() -> Dict[FakeAPI, List[UserEvent]]:
+        return {api_1: build_events(api_1, count, seed= 1), api_2: build_events(api_2, count, seed= 2, alias= alias)}
+
+    result = {"events_per_source": count}
+
+    apis_events = events()
+    start = time.perf_counter()
+    merged = handler.match_events(apis_events)
+    result["indexed_s"] = time.perf_counter() - start
+    result["merged_events"] = len(merged)
+
+    if legacy:
+        apis_events = events()
+        start = time.perf_counter()
+        legacy_merged = legacy_match_events(handler, apis_events)
+        result["legacy_s"] = time.perf_counter() - start
+        assert len(legacy_merged) == len(merged)
+
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description= __doc__, formatter_class= argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type= int, nargs= "+", default= [100, 1000, 5000, 20000])
+    parser.add_argument("--legacy-max", type= int, default= 1000, help= "largest size to also time the nested-loop matcher on")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as storage_dir:
+        print(f"{'events/source':>14} {'indexed (s)':>12} {'legacy (s)':>12} {'speedup':>9}")
+        for count in args.sizes:
+            result = run(count, count <= args.legacy_max, storage_dir)
+            legacy_s = result.get("legacy_s")
+            legacy_str = f"{legacy_s:12.3f}" if legacy_s is not None else f"{'-':>12}"
+            speedup = f"{legacy_s / result['indexed_s']:8.1f}x" if legacy_s is not None else f"{'-':>9}"
+            print(f"{count:>14} {result['indexed_s']:12.3f} {legacy_str} {speedup}")
+
+
+if __name__ == "__main__":
+    main()
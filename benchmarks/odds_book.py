@@ -0,0 +1,103 @@
+"""Benchmark building the-odds-api events into an OddsBook against one UserBet per price.
+
+Generates a full day of the-odds-api responses (every event with h2h, totals, btts, spreads and alternate totals from
+each bookmaker, h2h_lay from the exchanges) and builds every event both ways, measuring build time and the memory
+the built events keep with tracemalloc. Materializing the bets of a few events, as happens for the events sent to
+the calculator, is timed as well.
+
+Run from the repository root:
+    python -m benchmarks.odds_book --events 300 --bookmakers 40
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from betting_event import BetType
+
+from arb_search import TheOddsAPI_V4, UserBet, UserBookmaker, UserEvent
+
+from . import synthetic
+
+
+def legacy_build_event(api: TheOddsAPI_V4, response: dict) -> UserEvent:
+    """TheOddsAPI_V4._build_event before the odds book, one UserBet with a copy of its outcome per price."""
+    event = UserEvent(start_time= datetime.fromisoformat(response['commence_time'].replace('Z', '')))
+    bets = []
+    for bookmaker in response["bookmakers"]:
+        for market in bookmaker['markets']:
+            update_time = datetime.fromisoformat(market['last_update'].replace('Z', ''))
+            for outcome in market['outcomes']:
+                if market['key'] in ['h2h', 'h2h_lay']:
+                    bet_type = BetType.MatchWinner
+                    value = 'home' if outcome['name'] == response['home_team'] else 'away' if outcome['name'] == response['away_team'] else 'draw'
+                elif market['key'] in ['totals', 'alternate_totals']:
+                    bet_type = BetType.Goals_OverUnder
+                    value = outcome['name'].lower() + ' ' + str(outcome['point'])
+                elif market['key'] == 'btts':
+                    bet_type = BetType.BothTeamsToScore
+                    value = outcome['name'].lower()
+                else:
+                    bet_type = BetType.AsianHandicap
+                    value = ('home' if outcome['name'] == response['home_team'] else 'away') + ' ' + str(outcome['point'])
+                bets.append(UserBet(bet_type= bet_type, value= value, odds= outcome['price'],
+                                    bookmaker= api.bookmaker_table[bookmaker['key']], lay= (market['key'] == 'h2h_lay'),
+                                    update_time= update_time, api_specific_data= {api: {**outcome, **{'market_key': market['key']}}}))
+    event.add_bets(bets)
+    event.api_specific_data[api] = api.extract_specific_data(response)
+    return event
+
+
+def measure(build: Callable[[dict], UserEvent], responses: List[dict]) -> Tuple[List[UserEvent], float, int]:
+    """Build every event twice, once timed and once under tracemalloc, which slows allocation down."""
+    gc.collect()
+    start = time.perf_counter()
+    events = [build(response) for response in responses]
+    seconds = time.perf_counter() - start
+    del events
+
+    gc.collect()
+    tracemalloc.start()
+    events = [build(response) for response in responses]
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return events, seconds, retained
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description= __doc__, formatter_class= argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type= int, default= 300)
+    parser.add_argument("--bookmakers", type= int, default= 40)
+    parser.add_argument("--materialize", type= float, default= 0.05, help= "share of events whose bets are materialized afterwards")
+    parser.add_argument("--seed", type= int, default= 0)
+    args = parser.parse_args()
+
+    bookmaker_table = synthetic.MemoryBookmakerTable({key: UserBookmaker(key) for key in synthetic.bookmaker_keys(args.bookmakers)})
+    api = synthetic.offline_the_odds_api(bookmaker_table)
+    responses = synthetic.odds_api_responses(synthetic.fixtures(args.events, args.seed), args.bookmakers, args.seed)
+
+    legacy_events, legacy_s, legacy_bytes = measure(lambda response: legacy_build_event(api, response), responses)
+    prices = sum(len(event.bets) for event in legacy_events)
+    del legacy_events
+
+    events, book_s, book_bytes = measure(api._build_event, responses)
+    assert sum(event.bet_count for event in events) == prices
+
+    materialized = events[:max(1, int(len(events) * args.materialize))]
+    start = time.perf_counter()
+    for event in materialized:
+        event.bets
+    materialize_s = time.perf_counter() - start
+
+    print(f"{len(responses)} events, {prices} prices ({prices / len(responses):.0f} per event)")
+    print(f"  UserBet per price: build {legacy_s:7.3f}s, {legacy_bytes / 2**20:8.1f} MiB ({legacy_bytes / prices:6.0f} B/price)")
+    print(f"  OddsBook:          build {book_s:7.3f}s, {book_bytes / 2**20:8.1f} MiB ({book_bytes / prices:6.0f} B/price), "
+          f"{legacy_s / book_s:.1f}x faster, {legacy_bytes / book_bytes:.1f}x smaller")
+    print(f"  materializing the bets of {len(materialized)} events: {materialize_s:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Load-test gathering, matching and screening offline by replaying captured API traffic.
+
+The capture's the-odds-api and Betfair responses are served by ReplayTheOddsAPI and ReplayBetfair, and the captured
+calculator results by a replay CalculatorCache, so no quota, credentials or network are needed. Each repeat gathers
+and matches every event through API_Handler, prescreens them and looks the candidates up in the calculator results.
+The name table and bookmaker settings are copied to a temporary folder first so the real ones are left untouched,
+and nobody is asked to confirm matches: events whose names aren't in the name table stay unmatched.
+
+Capture traffic by passing a CaptureWriter to the APIs and the CalculatorDispatcher, then run from the repository root:
+    python -m benchmarks.replay storage/captures --repeats 3
+    python -m benchmarks.replay storage/captures --speed 1.0    # at the speed it was captured
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from arb_search import (API_Handler, ArbitragePreScreen, BookmakerStoredDict, ReplayBetfair, ReplayTheOddsAPI, SportType,
+                        metrics, read_capture, replay_calculator_cache, replay_clock)
+from arb_search.utils import StoredDict
+
+
+class UnattendedHandler(API_Handler):
+    """Never asks whether events match, events with names missing from the name table stay unmatched."""
+
+    def user_verify(self, api_names: List[str], home_names: List[str], away_names: List[str], league_names: List[str]) -> bool:
+        return False
+
+
+def run(records: List[dict], args: argparse.Namespace, storage_dir: str) -> Dict[str, Any]:
+    bookmakers_path = os.path.join(storage_dir, 'bookmakers.json')
+    if os.path.exists(args.bookmakers):
+        shutil.copy(args.bookmakers, bookmakers_path)
+    bookmaker_table = BookmakerStoredDict(StoredDict(bookmakers_path, method= 'json'))
+    clock = replay_clock(records, args.speed)
+    sources = set(record['source'] for record in records)
+    apis: list = []
+    if 'the-odds-api' in sources:
+        apis.append(ReplayTheOddsAPI(bookmaker_table, records, clock= clock))
+    if 'betfair' in sources:
+        apis.append(ReplayBetfair(bookmaker_table, records, clock= clock))
+
+    name_table_path = os.path.join(storage_dir, 'API_terminology_db.pkl')
+    if os.path.exists(args.name_table):
+        shutil.copy(args.name_table, name_table_path)
+    handler = UnattendedHandler(apis, name_comparison_table= StoredDict(name_table_path, write_behind= True), bookmaker_table= bookmaker_table)
+
+    start = time.perf_counter()
+    events = handler.gather_all_sport_type([SportType[name] for name in args.sport_types], gather_new_leagues= True)
+    gather_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    candidates = ArbitragePreScreen().screen(events)
+    screen_s = time.perf_counter() - start
+
+    calculator_cache = replay_calculator_cache(records)
+    start = time.perf_counter()
+    for event in candidates:
+        calculator_cache.restore(*calculator_cache.key(event), event)
+    calculate_s = time.perf_counter() - start
+
+    return {'gather_s': gather_s, 'screen_s': screen_s, 'calculate_s': calculate_s, 'events': len(events), 'candidates': len(candidates),
+            'calculator_hits': calculator_cache.hits, 'calculator_misses': calculator_cache.misses,
+            'failed_apis': {name: repr(error) for name, error in handler.failed_apis.items()}}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description= __doc__, formatter_class= argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs= "+", help= "capture files or folders of them")
+    parser.add_argument("--speed", type= float, default= None, help= "replay speed, 1.0 is the captured speed, by default as fast as possible")
+    parser.add_argument("--repeats", type= int, default= 3)
+    parser.add_argument("--sport-types", nargs= "+", default= ["Soccer"])
+    parser.add_argument("--name-table", default= "storage/API_terminology_db.pkl", help= "copied, never written to")
+    parser.add_argument("--bookmakers", default= "settings/bookmakers.json", help= "copied, never written to")
+    parser.add_argument("--output", help= "write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    records = list(read_capture(args.captures))
+    load_s = time.perf_counter() - start
+
+    metrics.enable()
+    runs = []
+    for _ in range(args.repeats):
+        with tempfile.TemporaryDirectory() as storage_dir:
+            runs.append(run(records, args, storage_dir))
+
+    report = {
+        "meta": {"captures": args.captures, "records": len(records), "load_s": load_s, "speed": args.speed, "repeats": args.repeats},
+        "median": {key: statistics.median(result[key] for result in runs) for key in ("gather_s", "screen_s", "calculate_s")},
+        "runs": runs,
+        "metrics": metrics.snapshot(),
+    }
+
+    if args.output is None:
+        print(json.dumps(report, indent= 4))
+    else:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok= True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent= 4)
+
+
+if __name__ == "__main__":
+    main()
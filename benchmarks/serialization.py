@@ -0,0 +1,88 @@
+"""Benchmark the codecs of arb_search.serialization on cached API responses and result output.
+
+Two payloads are generated: the-odds-api response cache entries (one league's odds responses each, as
+TheOddsAPI_V4 caches them) and the as_dict() of every built event, as main.py writes to unprocessed/. Each codec
+writes every payload to its own file with dump_file and reads it back with load_file, the best of --repeats rounds is
+reported. Pretty-printed JSON is how both were written before.
+
+Run from the repository root:
+    python -m benchmarks.serialization --events 300 --bookmakers 40
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+from arb_search import UserBookmaker
+from arb_search.serialization import Codec, JSONCodec, MsgpackZstdCodec, dump_file, load_file
+
+from . import synthetic
+
+
+def payloads(events: int, bookmakers: int, seed: int) -> Dict[str, List[Any]]:
+    fixture_list = synthetic.fixtures(events, seed)
+    responses = synthetic.odds_api_responses(fixture_list, bookmakers, seed)
+
+    leagues: Dict[str, List[dict]] = {}
+    for response in responses:
+        leagues.setdefault(response["sport_key"], []).append(response)
+    cache_entries = [{"timestamp": time.time(), "endpoint": f"sports/{sport_key}/odds", "params": {"markets": "h2h,spreads,totals"}, "data": data}
+                     for sport_key, data in leagues.items()]
+
+    bookmaker_table = synthetic.MemoryBookmakerTable({key: UserBookmaker(key) for key in synthetic.bookmaker_keys(bookmakers)})
+    api = synthetic.offline_the_odds_api(bookmaker_table)
+    results = [api._build_event(response).as_dict(False) for response in responses]
+    return {"cache": cache_entries, "results": results}
+
+
+def measure(codec: Codec, data: List[Any], directory: str, repeats: int) -> Tuple[float, float, int]:
+    """Best write and read seconds of every payload and their total size on disk."""
+    filenames = [os.path.join(directory, f"{i}{codec.extension}") for i in range(len(data))]
+    write_s = read_s = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for filename, payload in zip(filenames, data):
+            dump_file(filename, payload, codec)
+        write_s = min(write_s, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for filename in filenames:
+            load_file(filename, codec)
+        read_s = min(read_s, time.perf_counter() - start)
+
+    size = sum(os.path.getsize(filename) for filename in filenames)
+    for filename in filenames:
+        os.remove(filename)
+    return write_s, read_s, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description= __doc__, formatter_class= argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type= int, default= 300)
+    parser.add_argument("--bookmakers", type= int, default= 40)
+    parser.add_argument("--repeats", type= int, default= 3)
+    parser.add_argument("--seed", type= int, default= 0)
+    args = parser.parse_args()
+
+    codecs: List[Tuple[str, Codec]] = [
+        ("json indent=4", JSONCodec(indent= 4)),
+        ("json indent=2", JSONCodec(indent= 2)),
+        ("json", JSONCodec()),
+        ("msgpack+zstd level=1", MsgpackZstdCodec(level= 1)),
+        ("msgpack+zstd level=3", MsgpackZstdCodec(level= 3)),
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, data in payloads(args.events, args.bookmakers, args.seed).items():
+            # throughput is given in MB of compact JSON, the same amount of data for every codec
+            reference_mb = sum(len(JSONCodec().dumps(payload)) for payload in data) / 1e6
+            print(f"{name}: {len(data)} files, {reference_mb:.1f} MB as compact JSON")
+            print(f"  {'codec':<22} {'write MB/s':>11} {'read MB/s':>10} {'size MB':>8} {'ratio':>6}")
+            for codec_name, codec in codecs:
+                write_s, read_s, size = measure(codec, data, directory, args.repeats)
+                print(f"  {codec_name:<22} {reference_mb / write_s:11.1f} {reference_mb / read_s:10.1f} {size / 1e6:8.2f} {reference_mb * 1e6 / size:6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Time the ingest, merge and match hot paths on seeded synthetic data, without any network access.
+
+Cases:
+    the_odds_api.build_event       TheOddsAPI_V4._build_event over every odds response
+    betfair.build_bets             Betfair._build_bets over every market book
+    betfair.update_events          Betfair.update_events refreshing every gathered event
+    user_event.update_from_event   merging each Betfair event into its the-odds-api event
+    api_handler.match_events       matching the-odds-api events with Betfair events through the name table
+    utils.weighted_bin_packer      packing the markets by runner count, as listMarketBook requests are packed
+
+Every case runs --repeats times on fresh inputs, the inputs are built outside the timings. Results are written as
+JSON so runs can be compared over time.
+
+Run from the repository root:
+    python -m benchmarks.suite --events 300 --bookmakers 40 --output results/bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from arb_search import API_Handler, SportType, UserBookmaker, UserEvent
+from arb_search.apis.utils import weighted_bin_packer
+from arb_search.utils import StoredDict
+
+from . import synthetic
+
+MAX_RUNNERS = 250
+
+
+def timed(setup: Callable[[], Any], run: Callable[[Any], Any], repeats: int) -> Dict[str, float]:
+    """Time run(setup()) repeats times, only run is timed."""
+    seconds = []
+    for _ in range(repeats):
+        data = setup()
+        start = time.perf_counter()
+        run(data)
+        seconds.append(time.perf_counter() - start)
+    return {"min_s": min(seconds), "median_s": statistics.median(seconds), "mean_s": statistics.fmean(seconds), "repeats": repeats}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output= True, text= True, check= True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args: argparse.Namespace, storage_dir: str) -> Dict[str, Dict[str, Any]]:
+    fixture_list = synthetic.fixtures(args.events, args.seed)
+    responses = synthetic.odds_api_responses(fixture_list, args.bookmakers, args.seed)
+    catalogue = synthetic.betfair_catalogue(fixture_list, args.markets, args.handicap_lines)
+    market_books = synthetic.betfair_market_books(catalogue, args.ladder_depth, args.seed)
+
+    bookmaker_table = synthetic.MemoryBookmakerTable({key: UserBookmaker(key) for key in synthetic.bookmaker_keys(args.bookmakers)})
+    odds_api = synthetic.offline_the_odds_api(bookmaker_table)
+    betfair = synthetic.offline_betfair(bookmaker_table, synthetic.SyntheticBetting(catalogue, market_books))
+
+    def odds_api_events() -> List[UserEvent]:
+        return [odds_api._build_event(response) for response in responses]
+
+    def betfair_events() -> List[UserEvent]:
+        return betfair.gather_events([SportType.Soccer])
+
+    results: Dict[str, Dict[str, Any]] = {}
+    prices = sum(event.bet_count for event in odds_api_events())
+    results["the_odds_api.build_event"] = {
+        **timed(lambda: None, lambda _: odds_api_events(), args.repeats),
+        "events": len(responses), "prices": prices,
+    }
+
+    events = betfair_events()
+    event_books = [(event, market_books[market_id]) for event in events for market_id in event.api_specific_data[betfair]["markets"]]
+    results["betfair.build_bets"] = {
+        **timed(lambda: None, lambda _: [betfair._build_bets(event, market_book) for event, market_book in event_books], args.repeats),
+        "market_books": len(event_books), "prices": sum(event.bet_count for event in events),
+    }
+    results["betfair.update_events"] = {
+        **timed(lambda: None, lambda _: betfair.update_events(events), args.repeats),
+        "events": len(events), "markets": len(event_books),
+    }
+
+    def merge_pairs(pairs: List[tuple]) -> None:
+        for event, betfair_event in pairs:
+            event.update_from_event(betfair_event, betfair)
+
+    # events are paired by fixture, the-odds-api and Betfair events are built in fixture order
+    results["user_event.update_from_event"] = {
+        **timed(lambda: list(zip(odds_api_events(), betfair_events())), merge_pairs, args.repeats),
+        "pairs": min(len(responses), len(events)),
+    }
+
+    name_table = StoredDict(os.path.join(storage_dir, "names.pkl"), write_behind= True)
+    name_table.update(synthetic.name_table(fixture_list, odds_api, betfair, args.known_names, args.seed))
+    handler = API_Handler([odds_api, betfair], name_comparison_table= name_table, bookmaker_table= bookmaker_table)    # type: ignore
+    merged: List[UserEvent] = []
+    results["api_handler.match_events"] = {
+        **timed(lambda: {odds_api: odds_api_events(), betfair: betfair_events()}, lambda apis_events: merged.__setitem__(slice(None), handler.match_events(apis_events)), args.repeats),
+        "events_per_api": len(responses), "merged_events": len(merged),
+    }
+
+    market_runners = {market["marketId"]: len(market["runners"]) for market in catalogue}
+
+    bins: List[list] = []
+    results["utils.weighted_bin_packer"] = {
+        **timed(lambda: None, lambda _: bins.__setitem__(slice(None), weighted_bin_packer(market_runners, MAX_RUNNERS, 40)), args.repeats),
+        "markets": len(market_runners), "bins": len(bins),
+    }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description= __doc__, formatter_class= argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type= int, default= 300)
+    parser.add_argument("--bookmakers", type= int, default= 40, help= "the-odds-api bookmakers per event, the first three are exchanges")
+    parser.add_argument("--markets", type= int, default= 13, help= "Betfair markets per event, at most 13")
+    parser.add_argument("--handicap-lines", type= int, default= 8, help= "Asian Handicap lines either side of 0")
+    parser.add_argument("--ladder-depth", type= int, default= 3, help= "prices per side of each Betfair runner")
+    parser.add_argument("--known-names", type= float, default= 1.0, help= "share of fixtures already in the name table")
+    parser.add_argument("--repeats", type= int, default= 5)
+    parser.add_argument("--seed", type= int, default= 0)
+    parser.add_argument("--output", help= "write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as storage_dir:
+        results = run_suite(args, storage_dir)
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec= 'seconds'),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items() if key != "output"},
+        },
+        "results": results,
+    }
+
+    if args.output is None:
+        print(json.dumps(report, indent= 4))
+    else:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok= True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent= 4)
+
+
+if __name__ == "__main__":
+    main()
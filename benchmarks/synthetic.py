@@ -0,0 +1,198 @@
+"""Seeded generator of the-odds-api and Betfair payloads, and offline API instances to feed them to.
+
+Both APIs' payloads describe the same fixtures, so their events can be matched and merged. Prices are random but
+the shapes follow the real responses: the-odds-api odds responses with h2h, totals, btts, spreads and alternate
+totals per bookmaker (h2h_lay for exchanges), Betfair listMarketCatalogue entries with runner descriptions and
+lightweight listMarketBook dicts with EX_BEST_OFFERS ladders.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Tuple
+
+from arb_search import Betfair, TheOddsAPI_V4, UserBookmaker
+from arb_search.apis.base_api import BaseAPI
+
+EXCHANGES = ["betfair_ex_uk", "matchbook", "smarkets"]
+DAY_START = datetime(2023, 10, 7)
+
+
+class Fixture(NamedTuple):
+    id: int
+    home: str
+    away: str
+    league: str
+    start_time: datetime
+
+
+class MemoryBookmakerTable(dict):
+    """BookmakerStoredDict stand-in that never touches the disk."""
+
+    def add(self, name: str) -> UserBookmaker:
+        if name not in self:
+            self[name] = UserBookmaker(name)
+        return self[name]
+
+    def save(self) -> None:
+        pass
+
+
+def fixtures(events: int, seed: int, leagues: int = 50) -> List[Fixture]:
+    """A day of fixtures kicking off on 15 minute slots, team 2i plays team 2i+1."""
+    rand = random.Random(seed)
+    return [Fixture(i, f"Team {2*i}", f"Team {2*i + 1}", f"League {i % leagues}", DAY_START + timedelta(minutes= 15 * rand.randrange(96)))
+            for i in range(events)]
+
+
+def bookmaker_keys(bookmakers: int) -> List[str]:
+    return EXCHANGES[:bookmakers] + [f"bookmaker_{i}" for i in range(max(bookmakers - len(EXCHANGES), 0))]
+
+
+def _price(rand: random.Random) -> float:
+    return round(rand.uniform(1.2, 6.0), 2)
+
+
+def odds_api_responses(fixture_list: List[Fixture], bookmakers: int, seed: int, alternate_points: int = 6) -> List[dict]:
+    """the-odds-api sports/{sport}/odds responses with each event's alternate totals already merged in."""
+    rand = random.Random(seed)
+    keys = bookmaker_keys(bookmakers)
+    points = [0.5 + i for i in range(alternate_points + 1) if i != 2]
+    responses = []
+    for fixture in fixture_list:
+        last_update = (fixture.start_time - timedelta(hours= 2, seconds= rand.randrange(3600))).isoformat() + 'Z'
+        home, away = fixture.home, fixture.away
+        response_bookmakers = []
+        for key in keys:
+            markets = [
+                {"key": "h2h", "last_update": last_update, "outcomes": [{"name": name, "price": _price(rand)} for name in (home, away, "Draw")]},
+                {"key": "totals", "last_update": last_update, "outcomes": [{"name": side, "price": _price(rand), "point": 2.5} for side in ("Over", "Under")]},
+                {"key": "btts", "last_update": last_update, "outcomes": [{"name": side, "price": _price(rand)} for side in ("Yes", "No")]},
+                {"key": "spreads", "last_update": last_update, "outcomes": [{"name": home, "price": _price(rand), "point": -0.5}, {"name": away, "price": _price(rand), "point": 0.5}]},
+                {"key": "alternate_totals", "last_update": last_update,
+                 "outcomes": [{"name": side, "price": _price(rand), "point": point} for point in points for side in ("Over", "Under")]},
+            ]
+            if key in EXCHANGES:
+                markets.append({"key": "h2h_lay", "last_update": last_update, "outcomes": [{"name": name, "price": _price(rand)} for name in (home, away, "Draw")]})
+            response_bookmakers.append({"key": key, "title": key, "last_update": last_update, "markets": markets})
+
+        responses.append({"id": f"event_{fixture.id}", "sport_key": f"soccer_league_{fixture.league.split()[-1]}",
+                          "sport_title": fixture.league, "sport_group": "Soccer", "commence_time": fixture.start_time.isoformat() + 'Z',
+                          "home_team": home, "away_team": away, "bookmakers": response_bookmakers})
+    return responses
+
+
+def _catalogue_markets(fixture: Fixture, markets_per_event: int, handicap_lines: int) -> List[Tuple[str, List[Tuple[str, float]]]]:
+    """(market name, [(runner name, handicap)]) for the event's markets, in the order Betfair usually lists them."""
+    home, away = fixture.home, fixture.away
+    markets: List[Tuple[str, List[Tuple[str, float]]]] = [
+        ("Match Odds", [(home, 0.0), (away, 0.0), ("The Draw", 0.0)]),
+        ("Both teams to Score?", [("Yes", 0.0), ("No", 0.0)]),
+        ("Total Goals Odd/Even", [("Odd", 0.0), ("Even", 0.0)]),
+    ]
+    markets += [(f"Over/Under {goals}.5 Goals", [(f"Under {goals}.5 Goals", 0.0), (f"Over {goals}.5 Goals", 0.0)]) for goals in range(7)]
+    markets.append(("Correct Score", [(f"{h} - {a}", 0.0) for h in range(4) for a in range(4)]
+                    + [("Any Other Home Win", 0.0), ("Any Other Away Win", 0.0), ("Any Other Draw", 0.0)]))
+    markets.append(("Asian Handicap", [(name, sign * (line / 4)) for line in range(-2 * handicap_lines, 2 * handicap_lines + 1, 2)
+                                       for name, sign in ((home, 1), (away, -1))]))
+    markets.append(("Match Odds and Both teams to Score", [(f"{team}/{btts}", 0.0) for team in (home, away, "Draw") for btts in ("Yes", "No")]))
+    return markets[:markets_per_event]
+
+
+def betfair_catalogue(fixture_list: List[Fixture], markets_per_event: int = 13, handicap_lines: int = 8) -> List[dict]:
+    """listMarketCatalogue entries with the EVENT, COMPETITION and RUNNER_DESCRIPTION projections."""
+    catalogue = []
+    for fixture in fixture_list:
+        event = {"id": str(30000000 + fixture.id), "name": f"{fixture.home} v {fixture.away}", "countryCode": "GB",
+                 "timezone": "GMT", "openDate": fixture.start_time.isoformat(timespec= 'milliseconds') + 'Z'}
+        competition = {"id": str(1000 + int(fixture.league.split()[-1])), "name": fixture.league}
+        for i, (market_name, runners) in enumerate(_catalogue_markets(fixture, markets_per_event, handicap_lines)):
+            # Asian Handicap runners of one team share a selection id and differ by handicap
+            selection_ids: Dict[str, int] = {}
+            for runner_name, _ in runners:
+                selection_ids.setdefault(runner_name, 50000 + len(selection_ids))
+            catalogue.append({
+                "marketId": f"1.{200000000 + 100 * fixture.id + i}",
+                "marketName": market_name,
+                "totalMatched": 1000.0,
+                "event": event,
+                "competition": competition,
+                "runners": [{"selectionId": selection_ids[name], "runnerName": name, "handicap": handicap, "sortPriority": j + 1}
+                            for j, (name, handicap) in enumerate(runners)],
+            })
+    return catalogue
+
+
+def betfair_market_books(catalogue: List[dict], ladder_depth: int, seed: int) -> Dict[str, dict]:
+    """Lightweight listMarketBook dicts for every catalogue market, ladder_depth prices a side."""
+    rand = random.Random(seed)
+    books = {}
+    for market in catalogue:
+        runners = []
+        for runner in market["runners"]:
+            best_back = _price(rand)
+            runners.append({
+                "selectionId": runner["selectionId"],
+                "handicap": runner["handicap"],
+                "status": "ACTIVE",
+                "ex": {
+                    "availableToBack": [{"price": round(best_back - 0.02 * level, 2), "size": round(rand.uniform(2, 500), 2)} for level in range(ladder_depth)],
+                    "availableToLay": [{"price": round(best_back + 0.02 * (level + 1), 2), "size": round(rand.uniform(2, 500), 2)} for level in range(ladder_depth)],
+                    "tradedVolume": [],
+                },
+            })
+        books[market["marketId"]] = {"marketId": market["marketId"], "isMarketDataDelayed": False, "status": "OPEN",
+                                     "inplay": False, "totalMatched": market["totalMatched"], "runners": runners}
+    return books
+
+
+class SyntheticBetting:
+    """Betting_Limitless stand-in serving a fixed catalogue and market books."""
+
+    def __init__(self, catalogue: List[dict], market_books: Dict[str, dict]) -> None:
+        self.catalogue = catalogue
+        self.market_books = market_books
+
+    def list_all_market_catalogue(self, *args, **kwargs) -> List[dict]:
+        return self.catalogue
+
+    def list_all_market_book(self, market_id_runners_table: Dict[str, int], *args, **kwargs) -> Dict[str, dict]:
+        return {market_id: self.market_books[market_id] for market_id in market_id_runners_table if market_id in self.market_books}
+
+    def list_market_book(self, market_ids: List[str], *args, **kwargs) -> List[dict]:
+        return [self.market_books[market_id] for market_id in market_ids if market_id in self.market_books]
+
+
+def offline_the_odds_api(bookmaker_table: MemoryBookmakerTable, name: str = "the-odds-api") -> TheOddsAPI_V4:
+    """A TheOddsAPI_V4 that can build events from responses, it has no session, cache or API key."""
+    api = TheOddsAPI_V4.__new__(TheOddsAPI_V4)
+    BaseAPI.__init__(api, name, bookmaker_table)     # type: ignore
+    api.default_params = {"markets": ["h2h", "spreads", "totals"]}
+    return api
+
+
+def offline_betfair(bookmaker_table: MemoryBookmakerTable, betting: SyntheticBetting, name: str = "betfair") -> Betfair:
+    """A Betfair client that never logs in, its catalogue and market book calls are answered by betting."""
+    api = Betfair.__new__(Betfair)
+    BaseAPI.__init__(api, name, bookmaker_table)    # type: ignore
+    api.bookmaker_name = "betfair_ex_uk"
+    if api.bookmaker_name not in bookmaker_table:
+        bookmaker_table[api.bookmaker_name] = UserBookmaker(api.bookmaker_name)
+    api.default_start_time_range = (DAY_START, DAY_START + timedelta(days= 1))
+    api.betting = betting       # type: ignore
+    api.streams = []
+    api._market_streams = {}
+    api._stream_events = {}
+    api.capture = None
+    return api
+
+
+def name_table(fixture_list: List[Fixture], odds_api: TheOddsAPI_V4, betfair: Betfair, known: float = 1.0, seed: int = 0) -> Dict[str, dict]:
+    """API_Handler name table content where the known share of fixtures already have both APIs' names recorded."""
+    rand = random.Random(seed)
+    table: Dict[str, dict] = {odds_api.name: {"team_names": {}, "league_names": {}}, betfair.name: {"team_names": {}, "league_names": {}}}
+    for fixture in fixture_list:
+        if rand.random() >= known:
+            continue
+        for api in (odds_api, betfair):
+            table[api.name]["team_names"].update({fixture.home: fixture.home, fixture.away: fixture.away})
+            table[api.name]["league_names"][fixture.league] = fixture.league
+    return table
@@ -0,0 +1,84 @@
+"""Benchmark TeamNameMatcher against the linear SequenceMatcher scan it replaced.
+
+Replays the runner-name lookups Betfair._build_bets makes for a day of soccer: each event's Match Odds,
+Asian Handicap, Match Odds and Both teams to Score and Match Odds and Over/Under markets, refreshed several times.
+
+Run from the repository root:
+    python -m benchmarks.team_name_matcher --events 500 --refreshes 5
+"""
+import argparse
+import random
+import time
+from difflib import SequenceMatcher
+from typing import List, Tuple
+
+from arb_search.utils import TeamNameMatcher, get_team_name_matcher
+
+# (betfair event name, betfair runner name) pairs, runner names are often shortened
+TEAMS = [
+    ("Arsenal", "Arsenal"), ("Man City", "Man City"), ("Man Utd", "Man Utd"), ("Tottenham", "Tottenham"),
+    ("Newcastle", "Newcastle"), ("Brighton", "Brighton"), ("Wolves", "Wolves"), ("Nottm Forest", "Nottm Forest"),
+    ("Sheff Utd", "Sheff Utd"), ("West Ham", "West Ham"), ("Crystal Palace", "C Palace"), ("Bournemouth", "Bournemouth"),
+    ("Real Madrid", "Real Madrid"), ("Atletico Madrid", "Atletico Madrid"), ("Ath Bilbao", "Athletic Bilbao"),
+    ("Bayern Munich", "Bayern Munich"), ("Dortmund", "Dortmund"), ("B Monchengladbach", "Mgladbach"),
+    ("Inter", "Inter Milan"), ("AC Milan", "AC Milan"), ("Paris St-G", "Paris St-G"), ("Marseille", "Marseille"),
+    ("Ajax", "Ajax"), ("PSV", "PSV Eindhoven"), ("Feyenoord", "Feyenoord"), ("Celtic", "Celtic"), ("Rangers", "Rangers"),
+    ("Benfica", "Benfica"), ("Sporting Lisbon", "Sporting Lisbon"), ("FC Porto", "Porto"),
+]
+
+
+def legacy_team_name_matcher(name: str, team_names: List[str]) -> str:
+    return max(team_names, key= lambda x: SequenceMatcher(None, name.lower(), x.lower()).ratio())
+
+
+def build_lookups(events: int, seed: int) -> List[Tuple[str, List[str]]]:
+    """Every (query, candidates) lookup one refresh of all events makes."""
+    rand = random.Random(seed)
+    lookups = []
+    for _ in range(events):
+        (home, home_runner), (away, away_runner) = rand.sample(TEAMS, 2)
+        team_names = [home.lower(), away.lower(), "the draw", "draw"]
+        outcomes = [home_runner, away_runner, "The Draw"]
+        lookups += [(runner, team_names) for runner in outcomes]                              # Match Odds
+        lookups += [(runner, team_names) for runner in outcomes[:2] for _ in range(10)]       # Asian Handicap lines
+        lookups += [(runner, team_names) for runner in outcomes for _ in range(2)]            # Result/BTTS
+        lookups += [(runner, team_names) for runner in outcomes for _ in range(6)]            # Result/OU 1.5 - 3.5
+    return lookups
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description= __doc__, formatter_class= argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type= int, default= 500)
+    parser.add_argument("--refreshes", type= int, default= 5)
+    parser.add_argument("--seed", type= int, default= 0)
+    args = parser.parse_args()
+
+    lookups = build_lookups(args.events, args.seed)
+
+    start = time.perf_counter()
+    for _ in range(args.refreshes):
+        legacy_results = [legacy_team_name_matcher(name, team_names) for name, team_names in lookups]
+    legacy_s = time.perf_counter() - start
+
+    # uncached matcher: pre-normalized candidates and ratio bounds only
+    start = time.perf_counter()
+    for _ in range(args.refreshes):
+        uncached_results = [TeamNameMatcher(team_names, cache_size= 0).match(name) for name, team_names in lookups]
+    uncached_s = time.perf_counter() - start
+
+    get_team_name_matcher.cache_clear()
+    start = time.perf_counter()
+    for _ in range(args.refreshes):
+        results = [get_team_name_matcher(tuple(team_names)).match(name) for name, team_names in lookups]
+    cached_s = time.perf_counter() - start
+
+    assert results == legacy_results == uncached_results, "matcher disagrees with the linear scan"
+
+    total = len(lookups) * args.refreshes
+    print(f"{total} lookups ({args.events} events x {args.refreshes} refreshes), identical answers")
+    for label, seconds in [("linear SequenceMatcher", legacy_s), ("TeamNameMatcher (no cache)", uncached_s), ("TeamNameMatcher (cached)", cached_s)]:
+        print(f"{label:>28}: {seconds:8.3f}s  {1e6 * seconds / total:8.2f}us/lookup  {legacy_s / seconds:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,6 @@
 from datetime import datetime, timedelta
-from arb_search import API_Handler, TheOddsAPI_V4, SportType, Betfair, BookmakerStoredDict
-import json
-import threading
+from arb_search import API_Handler, TheOddsAPI_V4, SportType, Betfair, BookmakerStoredDict, CalculatorDispatcher, ArbitragePreScreen, CalculatorCache, metrics, config, dump_file, get_codec
 import os
-import time
 import shutil
 
 # Delete the contents of the unprocessed folder
@@ -12,9 +9,10 @@ for folder in ['unprocessed', 'results']:
     os.mkdir(folder)
 
 profitable_events = []
-threads = []
 
-rapid_api_key = json.load(open("settings/api_keys.json", "r"))["rapid-api"]
+metrics.enable()
+
+rapid_api_key = config.api_key("rapid-api")
 
 # time_range_start = datetime(2023, 10, 3, 0, 0, 0, 0) 
 time_range_start = datetime.now() - timedelta(hours=1)
@@ -22,41 +20,43 @@ time_range = (time_range_start, time_range_start + timedelta(hours=7))
 
 bookmaker_table = BookmakerStoredDict()
 
-the_odds_api = TheOddsAPI_V4(bookmaker_table, time_range)
+the_odds_api = TheOddsAPI_V4(bookmaker_table, time_range, scan_quota_budget= 250)
 # the_odds_api = TheOddsAPI_V4(bookmaker_table)
 betfair_api = Betfair(bookmaker_table, time_range)
 
 handler = API_Handler(apis= [the_odds_api]) #, betfair_api])
 
-all_events = handler.gather_all_sport_type(sport_types= [SportType.Soccer], gather_new_leagues= True)
+gathered_events = handler.gather_all_sport_type(sport_types= [SportType.Soccer], gather_new_leagues= True)
+all_events = list(gathered_events)
 
 print(f"{len(all_events)} events found")
 
-def save_to_file(event, output_folder: str = 'results', compact: bool = True):
+# every gathered event is written to unprocessed/, in the compact binary format (read them back with load_file),
+# profitable events to results/ as readable JSON
+unprocessed_codec = get_codec('msgpack+zstd')
+result_codec = get_codec('json', indent= 4)
+
+def save_to_file(event, output_folder: str = 'results', compact: bool = True, codec = result_codec):
     name = event.get_name()
     os.makedirs(output_folder, exist_ok=True)
-    with open(f'{output_folder}/{name}.json', 'w') as f:
-        json.dump(event.as_dict(compact), f, indent=4)
+    dump_file(f'{output_folder}/{name}{codec.extension}', event.as_dict(compact), codec)
 
 for event in all_events:
     event.wager_precision = 2
-    save_to_file(event, "unprocessed", False)
-    # x = threading.Thread(target= event.send_to_RapidAPI, args= (rapid_api_key, 0.8,))
-    # threads.append(x)
-    # x.start()
-    # time.sleep(0.2)
-    event.send_to_RapidAPI(rapid_api_key)
-    print('+', end='', flush= True)
+    save_to_file(event, "unprocessed", False, unprocessed_codec)
+
+prescreen = ArbitragePreScreen()
+all_events = prescreen.screen(all_events)
+print(f"{prescreen.last_pruned} events cannot be profitable, sending {len(all_events)} to the calculator")
+
+calculator_cache = CalculatorCache(path= 'storage/calculator_cache.pkl')
+dispatcher = CalculatorDispatcher(rapid_api_key, cache= calculator_cache)
+for result in dispatcher.dispatch(all_events):
+    print('+' if result.error is None else 'x', end='', flush= True)
 else:
     print()
 
-# for thread in threads:
-#     print('-', end='', flush= True)
-#     if thread is None:
-#         continue
-#     thread.join()
-# else:
-#     print()
+the_odds_api.record_scan_results(gathered_events)
 
 i = 0
 while i < len(all_events):
@@ -84,11 +84,12 @@ for event in all_events:
     print(event.get_name())
     for _ in range(3):
         wager_indexes = [i for i in range(len(event.bets)) if event.bets[i].wager > 0]
-        if handler.update_bet_data(event, wager_indexes):
-            print("updates needed")
-            event.send_to_RapidAPI(rapid_api_key, 0.5)
-        else:
+        delta = handler.update_bet_data(event, wager_indexes)
+        # prices that moved in our favour or kept enough volume don't change the wagers, skip the calculator
+        if not delta.needs_recalculation:
             break
+        print(f"updates needed: {delta}")
+        event.send_to_RapidAPI(rapid_api_key, 0.5, calculator_cache)
     else:
         print("too many updates needed")
         continue
@@ -97,4 +98,8 @@ for event in all_events:
     print(event.profit)
     print('!')
 
+calculator_cache.flush()
+print(f"calculator cache: {calculator_cache.stats()}")
+metrics.write_prometheus('storage/metrics.prom')
+metrics.write_json('storage/metrics.json')
 print("done")
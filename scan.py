@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+from arb_search import API_Handler, TheOddsAPI_V4, SportType, Betfair, BookmakerStoredDict, CalculatorDispatcher, CalculatorCache, CaptureWriter, Scanner, metrics, config, dump_file, get_codec
+import json
+import os
+import signal
+
+# Long running version of main.py: events are gathered every half hour and refreshed in between, sooner the closer
+# they are to kicking off or to an arbitrage. Profitable events are written to results/ as they are found.
+
+rapid_api_key = config.api_key("rapid-api")
+
+time_range_start = datetime.now() - timedelta(hours=1)
+time_range = (time_range_start, time_range_start + timedelta(hours=7))
+
+bookmaker_table = BookmakerStoredDict()
+
+# capture = CaptureWriter('storage/captures') records the APIs' responses for replaying with ReplayTheOddsAPI, see benchmarks/replay.py
+capture = None
+
+the_odds_api = TheOddsAPI_V4(bookmaker_table, time_range, scan_quota_budget= 250, refresh_quota_per_hour= 250, capture= capture)
+# betfair_api = Betfair(bookmaker_table, time_range, capture= capture)
+
+handler = API_Handler(apis= [the_odds_api]) #, betfair_api])
+
+result_codec = get_codec('json', indent= 4)   # get_codec('msgpack+zstd') for smaller files, read back with load_file
+
+def save_to_file(event, output_folder: str = 'results', compact: bool = True):
+    name = event.get_name()
+    os.makedirs(output_folder, exist_ok=True)
+    dump_file(f'{output_folder}/{name}{result_codec.extension}', event.as_dict(compact), result_codec)
+
+def on_opportunity(event):
+    print(f"{event.get_name()} {event.start_time} {event.profit}")
+    save_to_file(event)
+
+def on_cycle(stats):
+    if stats.gathered or stats.candidates:
+        print(f"cycle: {stats.gathered} gathered, {stats.refreshed} refreshed, {stats.candidates} candidates, "
+              f"{stats.opportunities} opportunities in {stats.total_time:.2f}s")
+    for api_name, error in stats.failed_updates.items():
+        print(f"{api_name} failed to update events ({error!r})")
+    for event_name, error in stats.failed_calculations.items():
+        print(f"Calculator failed for {event_name}: {error!r}")
+
+metrics.enable()
+calculator_cache = CalculatorCache(path= 'storage/calculator_cache.pkl')
+scanner = Scanner(handler, [SportType.Soccer], CalculatorDispatcher(rapid_api_key, cache= calculator_cache, capture= capture), on_opportunity= on_opportunity,
+                  on_cycle= on_cycle, metrics_path= 'storage/metrics.prom')
+
+signal.signal(signal.SIGINT, lambda *_: scanner.stop())
+signal.signal(signal.SIGTERM, lambda *_: scanner.stop())
+
+scanner.run()
+
+calculator_cache.flush()
+print(json.dumps(scanner.timing_summary(), indent=4))
+print(f"calculator cache: {calculator_cache.stats()}")
+metrics.write_json('storage/metrics.json')
+print("done")
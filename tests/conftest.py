@@ -0,0 +1,15 @@
+import os
+
+import pytest
+
+from arb_search import config
+
+SETTINGS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'settings')
+
+
+@pytest.fixture(autouse= True, scope= 'session')
+def settings_directory():
+    """Read the repository's settings wherever pytest is run from."""
+    config.set_directory(SETTINGS_DIR)
+    yield
+    config.set_directory(None)
@@ -0,0 +1,183 @@
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pytest
+from betting_event import BetType
+
+from arb_search.api_handler import API_Handler
+from arb_search.sport_types import SportType
+from arb_search.user_event import UserBet, UserBookmaker, UserEvent
+from arb_search.utils import BookmakerStoredDict, StoredDict
+
+START = datetime(2024, 1, 1, 15)
+
+
+class FakeAPI:
+    """Gathers one event per fixture (home, away, league), optionally after release is set or by raising error."""
+
+    def __init__(self, name: str, fixtures: List[Tuple[str, str, str]], release: Optional[threading.Event] = None,
+                 error: Optional[Exception] = None) -> None:
+        self.name = name
+        self.fixtures = fixtures
+        self.release = release
+        self.error = error
+        self.threads: List[threading.Thread] = []
+
+    def gather_events(self, sport_types: List[SportType], leagues: Optional[List[str]] = None) -> List[UserEvent]:
+        self.threads.append(threading.current_thread())
+        if self.release is not None:
+            self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return [UserEvent(start_time= START, api_specific_data= {self: {"fixture": fixture}}) for fixture in self.fixtures]
+
+    def read_event_comparison_data(self, event: UserEvent) -> Tuple[str, str, str, str]:
+        return (self.name, *event.api_specific_data[self]["fixture"])
+
+
+def handler_of(tmp_path, apis: List[FakeAPI], **kwargs) -> API_Handler:
+    return API_Handler(apis, name_comparison_table= StoredDict(str(tmp_path / 'names.pkl')),     # type: ignore
+                       bookmaker_table= BookmakerStoredDict(StoredDict(str(tmp_path / 'bookmakers.json'), method= 'json')), **kwargs)
+
+
+@pytest.fixture
+def release():
+    release = threading.Event()
+    yield release
+    release.set()
+
+
+def test_failed_and_late_apis_are_left_out(tmp_path, release):
+    good = FakeAPI("good", [("Arsenal", "Chelsea", "Premier League")])
+    slow = FakeAPI("slow", [("Arsenal", "Chelsea", "Premier League")], release= release)
+    broken = FakeAPI("broken", [], error= ConnectionError("refused"))
+    handler = handler_of(tmp_path, [good, slow, broken], gather_timeouts= {"slow": 0.2})
+
+    start = time.monotonic()
+    events = handler.gather_all_sport_type([SportType.Soccer], gather_new_leagues= True)
+    assert time.monotonic() - start < 2
+
+    assert [event.api_specific_data.keys() for event in events] == [{good: None}.keys()]
+    assert set(handler.failed_apis) == {"slow", "broken"}
+    assert isinstance(handler.failed_apis["broken"], ConnectionError)
+    # the stuck gather runs on in a daemon thread, which doesn't hold up interpreter exit
+    assert slow.threads[0].daemon and slow.threads[0].is_alive()
+
+
+def test_default_deadline(tmp_path, release):
+    slow = FakeAPI("slow", [], release= release)
+    handler = handler_of(tmp_path, [slow], default_gather_timeout= 0.1)
+    assert handler.gather_all_sport_type([SportType.Soccer], gather_new_leagues= True) == []
+    assert set(handler.failed_apis) == {"slow"}
+
+
+def test_api_is_skipped_until_its_late_gather_finishes(tmp_path, release):
+    slow = FakeAPI("slow", [("Arsenal", "Chelsea", "Premier League")], release= release)
+    handler = handler_of(tmp_path, [slow], default_gather_timeout= 0.1)
+    handler.gather_all_sport_type([SportType.Soccer], gather_new_leagues= True)
+
+    assert handler.gather_all_sport_type([SportType.Soccer], gather_new_leagues= True) == []
+    assert "still running" in str(handler.failed_apis["slow"])
+    assert len(slow.threads) == 1
+
+    release.set()
+    slow.threads[0].join(timeout= 5)
+    # the late gather's events were dropped, the next gather starts afresh
+    events = handler.gather_all_sport_type([SportType.Soccer], gather_new_leagues= True)
+    assert len(events) == 1 and handler.failed_apis == {}
+    assert len(slow.threads) == 2
+
+
+
+def test_registry_is_built_from_the_name_table(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    names = StoredDict(str(tmp_path / 'names.pkl'))
+    names["good"] = {"team_names": {"Arsenal FC": "Arsenal"}, "league_names": {"EPL": "Premier League"}}
+    handler = API_Handler([FakeAPI("good", [])], name_comparison_table= names,     # type: ignore
+                          bookmaker_table= BookmakerStoredDict(StoredDict(str(tmp_path / 'bookmakers.json'), method= 'json')))
+
+    arsenal = handler.registry.lookup("team_names", "good", "Arsenal FC")
+    assert arsenal is not None and handler.registry.name("team_names", arsenal) == "Arsenal"
+    assert handler.registry.lookup("league_names", "good", "EPL") is not None
+    # the name table is the only store, the registry is rebuilt from it
+    assert os.listdir(tmp_path) == ['names.pkl']
+
+
+class OracleHandler(API_Handler):
+    """Answers user_verify from the fixture each team name belongs to."""
+
+    fixture_of: Dict[str, int] = {}
+
+    def user_verify(self, api_names: List[str], home_names: List[str], away_names: List[str], league_names: List[str]) -> bool:
+        return len(set(self.fixture_of[name] for name in home_names + away_names)) == 1
+
+
+def match_events_pairwise(handler: API_Handler, apis_events: Dict[FakeAPI, List[UserEvent]]) -> List[UserEvent]:
+    """The matcher match_events replaced, which tried events_match on every pair of events."""
+    apis_list = list(apis_events.keys())
+    for api_1 in apis_list[:-1]:
+        for api_2 in apis_list[apis_list.index(api_1) + 1:]:
+            for event_1 in apis_events[api_1]:
+                for i, event_2 in enumerate(apis_events[api_2]):
+                    if handler.events_match((event_1, event_2), (api_1, api_2)):     # type: ignore
+                        event_1.update_from_event(event_2, api_2)    # type: ignore
+                        del apis_events[api_2][i]
+                        break
+    return [event for events in apis_events.values() for event in events]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_indexed_match_events_matches_pairwise_matcher(tmp_path, seed):
+    rng = random.Random(seed)
+    leagues = [("Premier League", "EPL"), ("La Liga", "Spain 1")]
+    fixtures = []
+    fixture_of: Dict[str, int] = {}
+    for i in range(40):
+        league, league_alias = rng.choice(leagues)
+        home, away = f"Team {2 * i}", f"Team {2 * i + 1}"
+        fixtures.append((home, away, league, f"{home} FC", f"{away} FC", league_alias, START + timedelta(hours= rng.randrange(4))))
+        for name in (home, away, f"{home} FC", f"{away} FC"):
+            fixture_of[name] = i
+
+    # the second api's names are partly in the name table already
+    known: Dict[str, Dict[str, str]] = {"team_names": {}, "league_names": {}}
+    for home, away, league, home_alias, away_alias, league_alias, _ in fixtures:
+        for alias, name, kind in ((home_alias, home, "team_names"), (away_alias, away, "team_names"), (league_alias, league, "league_names")):
+            if rng.random() < 0.6:
+                known[kind][alias] = name
+
+    # fixtures each api found, and the order the second api found them in
+    found = [(rng.random() < 0.9, rng.random() < 0.9) for _ in fixtures]
+    order = rng.sample(range(len(fixtures)), len(fixtures))
+
+    results = []
+    for matcher in ("indexed", "pairwise"):
+        odds_api, betfair = FakeAPI("the-odds-api", []), FakeAPI("betfair", [])
+        bookmakers = {odds_api: UserBookmaker("bet365"), betfair: UserBookmaker("betfair_ex_uk")}
+        apis_events: Dict[FakeAPI, List[UserEvent]] = {odds_api: [], betfair: []}
+        for api, side in ((odds_api, 0), (betfair, 1)):
+            for i in (range(len(fixtures)) if api is odds_api else order):
+                if not found[i][side]:
+                    continue
+                fixture = fixtures[i][3 * side:3 * side + 3]
+                # the odds tell which fixture and api an event came from once events are merged
+                bet = UserBet(BetType.MatchWinner, "home", 2 + i / 100 + side / 1000, bookmakers[api])
+                apis_events[api].append(UserEvent(start_time= fixtures[i][6], bets= [bet], api_specific_data= {api: {"fixture": fixture}}))
+
+        names = StoredDict(str(tmp_path / f'{matcher}.pkl'), write_behind= True)
+        names.update({"betfair": {kind: dict(aliases) for kind, aliases in known.items()}})
+        handler = OracleHandler([odds_api, betfair], name_comparison_table= names,     # type: ignore
+                                bookmaker_table= BookmakerStoredDict(StoredDict(str(tmp_path / 'bookmakers.json'), method= 'json')))
+        handler.fixture_of = fixture_of
+
+        merged = handler.match_events(apis_events) if matcher == "indexed" else match_events_pairwise(handler, apis_events)    # type: ignore
+        results.append(sorted(sorted(bet.odds for bet in event.bets) for event in merged))
+
+    indexed, pairwise = results
+    assert len(indexed) == len(pairwise)
+    assert indexed == pairwise
+    assert any(len(odds) == 2 for odds in indexed)
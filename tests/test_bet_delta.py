@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+from typing import List
+
+import pytest
+from betting_event import BetType
+
+from arb_search.user_event import BetDelta, UserBet, UserBookmaker, UserEvent
+
+START = datetime(2024, 1, 1, 12)
+
+
+@pytest.fixture
+def exchange() -> UserBookmaker:
+    return UserBookmaker("betfair_ex_uk")
+
+
+def price(bookmaker: UserBookmaker, value: str, odds: float, lay: bool = False, volume: float = 100.0, wager: float = 0.0,
+          bet_type: BetType = BetType.MatchWinner) -> UserBet:
+    return UserBet(bet_type, value, odds, bookmaker, lay= lay, volume= volume, wager= wager, update_time= START)
+
+
+def refresh(event: UserEvent, new_bets: List[UserBet], watched: List[UserBet]) -> BetDelta:
+    return event.refresh_bets(new_bets, lambda bet: bet.bet_type == BetType.MatchWinner, watched)
+
+
+def test_unchanged_price_is_updated_in_place(exchange):
+    bet = price(exchange, "home", 2.0, wager= 10.0)
+    event = UserEvent(bets= [bet])
+    new = price(exchange, "home", 2.0, volume= 50.0)
+    new.update_time = START + timedelta(seconds= 5)
+
+    delta = refresh(event, [new], [bet])
+    assert not delta
+    assert (delta.moved, delta.shrunk, delta.vanished) == ([], [], [])
+    assert event.bets == [bet] and event.bets[0] is bet
+    assert bet.volume == 50.0 and bet.wager == 10.0 and bet.update_time == START + timedelta(seconds= 5)
+
+
+def test_shrunk(exchange):
+    bet = price(exchange, "home", 2.0, wager= 10.0)
+    event = UserEvent(bets= [bet])
+
+    delta = refresh(event, [price(exchange, "home", 2.0, volume= 4.0)], [bet])
+    assert delta
+    assert delta.shrunk == [bet] and delta.worsened == [bet]
+    assert event.bets[0] is bet
+
+
+def test_volume_unknown_is_not_shrunk(exchange):
+    bet = price(exchange, "home", 2.0, wager= 10.0)
+    event = UserEvent(bets= [bet])
+    assert not refresh(event, [price(exchange, "home", 2.0, volume= -1.0)], [bet])
+
+
+@pytest.mark.parametrize("lay, new_odds, worse", [
+    (False, 1.9, True),
+    (False, 2.1, False),
+    (True, 2.1, True),
+    (True, 1.9, False),
+])
+def test_moved(exchange, lay, new_odds, worse):
+    bet = price(exchange, "home", 2.0, lay= lay, wager= 10.0)
+    event = UserEvent(bets= [bet])
+    # the best odds on offer are reported, the highest for back bets and the lowest for lay bets
+    offers = [price(exchange, "home", new_odds, lay= lay), price(exchange, "home", 1.5 if not lay else 2.5, lay= lay)]
+
+    delta = refresh(event, offers, [bet])
+    assert delta.moved == [(bet, new_odds)]
+    assert bool(delta) is worse
+    assert delta.worsened == ([bet] if worse else [])
+    # a bet that moved to worse odds is removed, one that moved to better odds is kept at its odds
+    assert any(existing is bet for existing in event.bets) is not worse
+    assert sorted(existing.odds for existing in event.bets if existing is not bet) == sorted(offer.odds for offer in offers)
+
+
+def test_vanished(exchange):
+    bet = price(exchange, "home", 2.0, wager= 10.0)
+    event = UserEvent(bets= [bet, price(exchange, "away", 3.0)])
+
+    delta = refresh(event, [price(exchange, "away", 3.0), price(exchange, "home", 2.0, lay= True)], [bet])
+    assert delta.vanished == [bet]
+    assert delta
+    assert all(existing is not bet for existing in event.bets)
+
+
+def test_unwatched_and_unrefreshed_bets(exchange):
+    unwatched = price(exchange, "draw", 3.5)
+    unrefreshed = price(exchange, "over", 1.9, bet_type= BetType.Goals_OverUnder)
+    event = UserEvent(bets= [unwatched, unrefreshed])
+
+    delta = refresh(event, [price(exchange, "draw", 3.4)], [])
+    assert (delta.moved, delta.shrunk, delta.vanished) == ([], [], [])
+    assert [(bet.value, bet.odds) for bet in event.bets] == [("over", 1.9), ("draw", 3.4)]
+    assert event.bets[0] is unrefreshed
+
+
+def test_combined_deltas(exchange):
+    back, lay = price(exchange, "home", 2.0), price(exchange, "home", 2.0, lay= True)
+    delta = BetDelta(moved= [(back, 2.2)])
+    assert not delta
+    delta |= BetDelta(moved= [(lay, 2.2)])
+    assert delta and delta.worsened == [lay]
+    delta |= BetDelta(vanished= [back])
+    assert delta.worsened == [lay, back]
+    assert repr(delta) == "BetDelta(moved= 2, shrunk= 0, vanished= 1)"
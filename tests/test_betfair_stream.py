@@ -0,0 +1,206 @@
+import time
+from types import SimpleNamespace
+from typing import Callable
+
+import pytest
+from betting_event import BetType
+
+from arb_search.apis.base_api import BaseAPI
+from arb_search.apis.betfair import BetfairMarketStream, LocalStreamServer
+from arb_search.apis.betfair.betfair import Betfair
+from arb_search.user_event import UserBookmaker, UserEvent
+
+MARKET_ID = "1.100"
+# Asian handicap runners share a selectionId, one per line
+OUTCOMES = {
+    (1, -0.5): (BetType.AsianHandicap, "home -0.5"),
+    (1, -1.0): (BetType.AsianHandicap, "home -1.0"),
+    (2, 0.5): (BetType.AsianHandicap, "away 0.5"),
+}
+
+
+def wait_until(condition: Callable[[], bool], timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def ladder(stream: BetfairMarketStream, selection_id: int, handicap: float, side: str = "availableToBack") -> dict:
+    for market_book in stream.snap([MARKET_ID]):
+        for runner in market_book["runners"]:
+            if runner["selectionId"] == selection_id and runner["handicap"] == handicap:
+                return {price["price"]: price["size"] for price in runner["ex"][side]}
+    return {}
+
+
+def offline_betfair() -> Betfair:
+    betfair = Betfair.__new__(Betfair)
+    BaseAPI.__init__(betfair, "betfair", {"betfair_ex_uk": UserBookmaker("betfair_ex_uk")})   # type: ignore
+    betfair.bookmaker_name = "betfair_ex_uk"
+    betfair.streams = []
+    betfair._market_streams = {}
+    betfair._stream_events = {}
+    betfair.capture = None
+    return betfair
+
+
+def betfair_event(betfair: Betfair) -> UserEvent:
+    return UserEvent(bookmakers= [betfair.bookmaker_table["betfair_ex_uk"]],
+                     api_specific_data= {betfair: {"markets": {MARKET_ID: {"runners": [], "outcomes": dict(OUTCOMES)}}}})
+
+
+def market_book(runners: dict, status: str = "OPEN") -> dict:
+    """runners: (selectionId, handicap) -> (back prices, lay prices), each price -> size."""
+    return {"marketId": MARKET_ID, "status": status, "runners": [
+        {"selectionId": selection_id, "handicap": handicap, "ex": {
+            "availableToBack": [{"price": price, "size": size} for price, size in back.items()],
+            "availableToLay": [{"price": price, "size": size} for price, size in lay.items()]}}
+        for (selection_id, handicap), (back, lay) in runners.items()]}
+
+
+@pytest.fixture
+def server():
+    server = LocalStreamServer()
+    server.add_market(MARKET_ID, list(OUTCOMES))
+    server.set_prices(MARKET_ID, 1, back= {1.9: 100.0, 1.88: 50.0}, lay= {1.92: 80.0}, handicap= -0.5)
+    server.set_prices(MARKET_ID, 1, back= {2.4: 30.0}, handicap= -1.0)
+    server.set_prices(MARKET_ID, 2, back= {2.05: 70.0}, handicap= 0.5)
+    with server:
+        yield server
+
+
+def open_stream(server: LocalStreamServer, **kwargs) -> BetfairMarketStream:
+    client = SimpleNamespace(app_key= "app", session_token= "token")
+    stream = BetfairMarketStream(client, host= server.host, port= server.port, use_ssl= False, timeout= 5, reconnect_delay= 0.05, **kwargs)   # type: ignore
+    stream.start([MARKET_ID])
+    return stream
+
+
+@pytest.fixture
+def stream(server: LocalStreamServer):
+    stream = open_stream(server)
+    yield stream
+    stream.stop()
+
+
+def test_initial_image(stream: BetfairMarketStream):
+    assert stream.wait_for_image(timeout= 5)
+    assert stream.has_market(MARKET_ID)
+    assert ladder(stream, 1, -0.5) == {1.9: 100.0, 1.88: 50.0}
+    assert ladder(stream, 1, -0.5, "availableToLay") == {1.92: 80.0}
+    assert ladder(stream, 1, -1.0) == {2.4: 30.0}
+    assert ladder(stream, 2, 0.5) == {2.05: 70.0}
+
+
+def test_incremental_delta(server: LocalStreamServer, stream: BetfairMarketStream):
+    assert stream.wait_for_image(timeout= 5)
+    updates = stream.updates_applied
+
+    server.set_prices(MARKET_ID, 1, back= {1.9: 0.0, 1.91: 25.0}, handicap= -0.5)
+
+    assert wait_until(lambda: ladder(stream, 1, -0.5) == {1.91: 25.0, 1.88: 50.0})
+    # the other line of the same selection is untouched
+    assert ladder(stream, 1, -1.0) == {2.4: 30.0}
+    assert wait_until(lambda: stream.updates_applied > updates)
+
+
+def test_reconnect_resubscribes(server: LocalStreamServer, stream: BetfairMarketStream):
+    assert stream.wait_for_image(timeout= 5)
+
+    server.disconnect_all()
+    assert wait_until(lambda: len(server._clients) == 1 and next(iter(server._clients.values()))[0] == [MARKET_ID])
+
+    server.set_prices(MARKET_ID, 2, back= {2.1: 15.0}, handicap= 0.5)
+    assert wait_until(lambda: ladder(stream, 2, 0.5) == {2.1: 15.0, 2.05: 70.0})
+    assert stream.running and stream.error is None
+
+
+def test_apply_market_book_updates_bets_in_place():
+    betfair = offline_betfair()
+    event = betfair_event(betfair)
+    betfair._stream_events = {MARKET_ID: event}
+
+    betfair._apply_market_book(market_book({(1, -0.5): ({1.9: 100.0}, {1.92: 80.0}), (1, -1.0): ({1.9: 30.0}, {})}))
+    bets = event.bets
+    assert sorted((bet.value, bet.lay, bet.odds, bet.volume) for bet in bets) == [
+        ("home -0.5", False, 1.9, 100.0), ("home -0.5", True, 1.92, 80.0), ("home -1.0", False, 1.9, 30.0)]
+    home_half = next(bet for bet in bets if bet.value == "home -0.5" and not bet.lay)
+    home_one = next(bet for bet in bets if bet.value == "home -1.0")
+    home_one.wager = 5.0
+
+    # same selection and price on both lines: each runner keeps its own bet
+    betfair._apply_market_book(market_book({(1, -0.5): ({1.9: 60.0}, {}), (2, 0.5): ({2.05: 70.0}, {})}))
+
+    assert event.bets is bets
+    assert home_half in bets and home_half.volume == 60.0
+    # gone from the ladder but wagered on, so kept with no volume
+    assert home_one in bets and home_one.volume == 0.0
+    assert not any(bet.value == "home -0.5" and bet.lay for bet in bets)
+    assert any(bet.value == "away 0.5" and bet.odds == 2.05 for bet in bets)
+
+
+def test_stream_applies_to_event(server: LocalStreamServer):
+    betfair = offline_betfair()
+    event = betfair_event(betfair)
+    betfair._stream_events = {MARKET_ID: event}
+    stream = open_stream(server, on_market_update= betfair._apply_market_book)
+    try:
+        assert stream.wait_for_image(timeout= 5)
+        with event.lock:
+            assert {(bet.value, bet.lay, bet.odds) for bet in event.bets} == {
+                ("home -0.5", False, 1.9), ("home -0.5", False, 1.88), ("home -0.5", True, 1.92), ("home -1.0", False, 2.4), ("away 0.5", False, 2.05)}
+            home_one = next(bet for bet in event.bets if bet.value == "home -1.0")
+
+        server.set_prices(MARKET_ID, 1, back= {2.4: 12.0}, handicap= -1.0)
+
+        assert wait_until(lambda: home_one.volume == 12.0)
+        assert home_one in event.bets
+    finally:
+        stream.stop()
+
+
+def test_apply_market_book_updates_compacted_event_in_place():
+    betfair = offline_betfair()
+    event = betfair_event(betfair)
+    betfair._stream_events = {MARKET_ID: event}
+    betfair._apply_market_book(market_book({(1, -0.5): ({1.9: 100.0}, {1.92: 80.0}), (1, -1.0): ({1.9: 30.0}, {})}))
+    book = event.compact()
+    book.wager[next(row for row in range(len(book)) if book.outcome_key(row)[1] == "home -1.0")] = 5.0
+
+    betfair._apply_market_book(market_book({(1, -0.5): ({1.9: 60.0}, {}), (2, 0.5): ({2.05: 70.0}, {})}))
+
+    assert event.compacted and event.odds_book is book
+    assert sorted((book.outcome_key(row)[1], bool(book.lay[row]), book.odds[row], book.volume[row]) for row in range(len(book))) == [
+        ("away 0.5", False, 2.05, 70.0), ("home -0.5", False, 1.9, 60.0), ("home -1.0", False, 1.9, 0.0)]
+
+
+def test_subscription_limit(server: LocalStreamServer):
+    client = SimpleNamespace(app_key= "app", session_token= "token")
+    stream = BetfairMarketStream(client, host= server.host, port= server.port, use_ssl= False, max_markets= 1)   # type: ignore
+    with pytest.raises(ValueError):
+        stream.start([MARKET_ID, "1.101"])
+    assert not stream.running and not stream.has_market(MARKET_ID)
+
+
+def test_start_stream_splits_markets(server: LocalStreamServer):
+    market_ids = [MARKET_ID, "1.101", "1.102"]
+    for market_id in market_ids[1:]:
+        server.add_market(market_id, [(3, 0.0)])
+        server.set_prices(market_id, 3, back= {3.0: 10.0})
+    betfair = offline_betfair()
+    betfair._ensure_login = lambda: None     # type: ignore
+    betfair.app_key, betfair.session_token = "app", "token"
+    event = UserEvent(api_specific_data= {betfair: {"markets": {market_id: {"runners": [], "outcomes": {(3, 0.0): (BetType.MatchWinner, "home")}}
+                                                                for market_id in market_ids}}})
+
+    streams = betfair.start_stream([event], markets_per_stream= 2, host= server.host, port= server.port, use_ssl= False, timeout= 5)
+    try:
+        assert [stream.market_ids for stream in streams] == [market_ids[:2], market_ids[2:]]
+        assert all(betfair._market_streams[market_id].has_market(market_id) for market_id in market_ids)
+        assert wait_until(lambda: len(event.bets) == 2)
+    finally:
+        betfair.stop_stream()
+    assert betfair.streams == [] and betfair._market_streams == {}
@@ -0,0 +1,59 @@
+import math
+import random
+from typing import Dict, Hashable, List
+
+import pytest
+
+from arb_search.apis.utils import weighted_bin_packer
+
+
+def assert_within_limits(bins: List[list], weight_table: Dict[Hashable, int], max_weight: int, max_items: int) -> None:
+    packed = [key for bin_items in bins for key in bin_items]
+    assert sorted(packed) == sorted(weight_table)
+    for bin_items in bins:
+        assert 0 < len(bin_items) <= max_items
+        if len(bin_items) > 1:
+            assert sum(weight_table[key] for key in bin_items) <= max_weight
+
+
+def lower_bound(weight_table: Dict[Hashable, int], max_weight: int, max_items: int) -> int:
+    return max(math.ceil(len(weight_table) / max_items), math.ceil(sum(weight_table.values()) / max_weight))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_item_limit_bound(seed):
+    # markets of 2 to 14 runners in requests of at most 40 markets and 200 runners, the item count needs more bins
+    rng = random.Random(seed)
+    weight_table = {f'1.{i}': rng.randint(2, 14) for i in range(500)}
+    bins = weighted_bin_packer(weight_table, 1000, 40)
+    assert_within_limits(bins, weight_table, 1000, 40)
+    assert len(bins) <= lower_bound(weight_table, 1000, 40) + 1
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_weight_limit_bound(seed):
+    rng = random.Random(seed)
+    weight_table = {i: rng.randint(1, 60) for i in range(300)}
+    bins = weighted_bin_packer(weight_table, 200, 40)
+    assert_within_limits(bins, weight_table, 200, 40)
+    assert len(bins) <= math.ceil(lower_bound(weight_table, 200, 40) * 1.1) + 1
+
+
+def test_exact_fit():
+    weight_table = {i: 50 for i in range(8)}
+    bins = weighted_bin_packer(weight_table, 200, 4)
+    assert_within_limits(bins, weight_table, 200, 4)
+    assert len(bins) == 2
+
+
+def test_oversized_item_gets_own_bin():
+    weight_table = {'big': 300, 'a': 100, 'b': 50, 'c': 20}
+    for max_items in (2, 10):
+        bins = weighted_bin_packer(weight_table, 200, max_items)
+        assert ['big'] in bins
+        assert_within_limits(bins, weight_table, 200, max_items)
+
+
+def test_empty_table():
+    assert weighted_bin_packer({}, 200, 40) == []
+
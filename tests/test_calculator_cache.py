@@ -0,0 +1,120 @@
+import random
+import time
+from typing import List
+
+import pytest
+from betting_event import BetType
+
+from arb_search.calculator_cache import CalculatorCache
+from arb_search.user_event import UserBet, UserBookmaker, UserEvent
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(time, "time", clock)
+    return clock
+
+
+def event_of(odds: List[float], volume: float = 100.0) -> UserEvent:
+    bookmakers = [UserBookmaker("bet365", commission= 0.0), UserBookmaker("betfair_ex_uk", commission= 0.02)]
+    bets = [UserBet(BetType.MatchWinner, value, price, bookmakers[i % 2], volume= volume)
+            for i, (value, price) in enumerate(zip(("home", "draw", "away"), odds))]
+    return UserEvent(bets= bets)
+
+
+def solve(event: UserEvent) -> None:
+    """Stands in for the calculator: a wager and a profit every bet can be told apart by."""
+    event.profit = [sum(bet.odds for bet in event.bets), 1.0]
+    for bet in event.bets:
+        bet.wager = bet.odds * 10
+
+
+def send(cache: CalculatorCache, event: UserEvent, volume_percentage: float = 1.0) -> bool:
+    """What send_to_RapidAPI does with the cache, returns whether the result was cached."""
+    fingerprint, bets = cache.key(event, volume_percentage)
+    if cache.restore(fingerprint, bets, event):
+        return True
+    solve(event)
+    cache.store(fingerprint, bets, event)
+    return False
+
+
+def test_hit_and_miss(clock):
+    cache = CalculatorCache()
+    assert not send(cache, event_of([2.0, 3.5, 4.0]))
+
+    event = event_of([2.0, 3.5, 4.0])
+    assert send(cache, event)
+    assert [bet.wager for bet in event.bets] == [20.0, 35.0, 40.0] and event.profit == [9.5, 1.0]
+
+    assert not send(cache, event_of([2.0, 3.5, 4.1]))
+    assert not send(cache, event_of([2.0, 3.5, 4.0], volume= 50.0))
+    assert not send(cache, event_of([2.0, 3.5, 4.0]), volume_percentage= 0.25)
+    assert cache.stats() == {'entries': 4, 'hits': 1, 'misses': 4, 'hit_rate': 0.2}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_bet_order_does_not_matter(clock, seed):
+    rng = random.Random(seed)
+    cache = CalculatorCache()
+    odds = [round(rng.uniform(1.1, 10.0), 2) for _ in range(3)]
+    send(cache, event_of(odds))
+
+    shuffled = event_of(odds)
+    rng.shuffle(shuffled.bets)
+    assert send(cache, shuffled)
+    # each bet gets back the wager it was given, not the one in its position
+    assert all(bet.wager == bet.odds * 10 for bet in shuffled.bets)
+
+
+def test_ttl(clock):
+    cache = CalculatorCache(ttl= 60.0)
+    send(cache, event_of([2.0, 3.5, 4.0]))
+    clock.now += 60.0
+    assert send(cache, event_of([2.0, 3.5, 4.0]))
+    clock.now += 60.5
+    assert not send(cache, event_of([2.0, 3.5, 4.0]))
+
+    cache = CalculatorCache(ttl= None)
+    send(cache, event_of([2.0, 3.5, 4.0]))
+    clock.now += 365 * 24 * 3600
+    assert send(cache, event_of([2.0, 3.5, 4.0]))
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = CalculatorCache(max_entries= 2)
+    send(cache, event_of([2.0, 3.0, 4.0]))
+    send(cache, event_of([2.1, 3.0, 4.0]))
+    assert send(cache, event_of([2.0, 3.0, 4.0]))
+    send(cache, event_of([2.2, 3.0, 4.0]))
+
+    assert len(cache) == 2
+    assert send(cache, event_of([2.0, 3.0, 4.0]))
+    assert not send(cache, event_of([2.1, 3.0, 4.0]))
+
+
+def test_persisted_across_restarts(clock, tmp_path):
+    path = str(tmp_path / 'calculator_cache.pkl')
+    cache = CalculatorCache(ttl= 60.0, path= path)
+    send(cache, event_of([2.0, 3.0, 4.0]))
+    clock.now += 30.0
+    send(cache, event_of([2.1, 3.0, 4.0]))
+    cache.flush()
+
+    clock.now += 45.0
+    restarted = CalculatorCache(ttl= 60.0, path= path)
+    # the older entry expired while the cache was down
+    assert len(restarted) == 1
+    event = event_of([2.1, 3.0, 4.0])
+    assert send(restarted, event)
+    assert [bet.wager for bet in event.bets] == [21.0, 30.0, 40.0]
+    assert not send(restarted, event_of([2.0, 3.0, 4.0]))
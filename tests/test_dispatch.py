@@ -0,0 +1,119 @@
+import threading
+import time
+from typing import List, Optional
+
+import pytest
+import requests
+from betting_event import BetType
+
+from arb_search.dispatch import CalculatorDispatcher, DispatchResult
+from arb_search.user_event import UserBet, UserBookmaker, UserEvent
+
+
+class FakeEvent(UserEvent):
+    """Fails with each of errors in turn, then, once release is set, wagers 10 on every bet."""
+
+    def __init__(self, bookmaker: UserBookmaker, errors: List[Exception] = [], release: Optional[threading.Event] = None) -> None:
+        super().__init__(bets= [UserBet(BetType.MatchWinner, value, 2.0, bookmaker) for value in ("home", "away")])
+        # shared with the copies the dispatcher sends
+        self.errors = list(errors)
+        self.release = release
+        self.sent: List[float] = []
+        self.finished = threading.Event()
+
+    def send_to_RapidAPI(self, api_key=None, volume_percentage=1.0, cache=None, capture=None):
+        self.sent.append(time.monotonic())
+        if self.errors:
+            raise self.errors.pop(0)
+        if self.release is not None:
+            self.release.wait()
+        self.profit = [1.0, 1.0]
+        for bet in self.bets:
+            bet.wager = 10.0
+        self.finished.set()
+        return self
+
+
+def http_error(status_code: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f"{status_code} error", response= response)
+
+
+def dispatch(events: List[UserEvent], **kwargs) -> List[DispatchResult]:
+    kwargs.setdefault("backoff", 0.0)
+    return list(CalculatorDispatcher("key", **kwargs).dispatch(events))
+
+
+@pytest.fixture
+def bookmaker() -> UserBookmaker:
+    return UserBookmaker("bet365", commission= 0.0)
+
+
+@pytest.fixture
+def release():
+    release = threading.Event()
+    yield release
+    release.set()
+
+
+@pytest.mark.parametrize("error", [ConnectionError("reset"), TimeoutError("slow"), requests.ConnectionError("refused"),
+                                   requests.Timeout("read timed out"), http_error(429), http_error(503)])
+def test_transient_errors_are_retried(bookmaker, error):
+    event = FakeEvent(bookmaker, errors= [error])
+    result, = dispatch([event])
+    assert result.error is None and result.attempts == 2
+    # the result is copied back to the event that was dispatched
+    assert result.event is event
+    assert [bet.wager for bet in event.bets] == [10.0, 10.0] and event.profit == [1.0, 1.0]
+
+
+@pytest.mark.parametrize("error", [ValueError("bad event"), http_error(400), http_error(403)])
+def test_other_errors_are_not_retried(bookmaker, error):
+    event = FakeEvent(bookmaker, errors= [error])
+    result, = dispatch([event])
+    assert result.error is error and result.attempts == 1
+    assert [bet.wager for bet in event.bets] == [0.0, 0.0]
+
+
+def test_retries_are_limited(bookmaker):
+    event = FakeEvent(bookmaker, errors= [ConnectionError("reset")] * 5)
+    result, = dispatch([event], max_retries= 2)
+    assert isinstance(result.error, ConnectionError) and result.attempts == 3
+    assert len(event.sent) == 3
+
+
+def test_rate_limit(bookmaker):
+    events = [FakeEvent(bookmaker, errors= [http_error(502)]) for _ in range(3)]
+    results = dispatch(events, rate= 20.0, burst= 1.0)
+    assert all(result.error is None for result in results)
+
+    sent = sorted(sent for event in events for sent in event.sent)
+    assert len(sent) == 6
+    # one token to start with, then one every 1/20 s
+    assert sent[-1] - sent[0] >= 5 / 20 - 0.01
+
+
+def test_late_result_is_discarded(bookmaker, release):
+    event = FakeEvent(bookmaker, release= release)
+    start = time.monotonic()
+    result, = dispatch([event], timeout= 0.2)
+    assert isinstance(result.error, TimeoutError) and result.event is event
+    assert time.monotonic() - start < 2
+
+    release.set()
+    assert event.finished.wait(timeout= 5)
+    assert [bet.wager for bet in event.bets] == [0.0, 0.0] and event.profit == [0.0, 0.0]
+
+
+def test_queued_event_runs_once_the_stuck_worker_is_free(bookmaker, release):
+    stuck = FakeEvent(bookmaker, release= release)
+    queued = FakeEvent(bookmaker)
+    timer = threading.Timer(0.5, release.set)
+    timer.start()
+
+    results = {id(result.event): result for result in dispatch([stuck, queued], max_workers= 1, timeout= 0.2)}
+    timer.join()
+    assert isinstance(results[id(stuck)].error, TimeoutError)
+    assert results[id(queued)].error is None
+    assert [bet.wager for bet in queued.bets] == [10.0, 10.0]
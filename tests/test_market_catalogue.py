@@ -0,0 +1,99 @@
+import random
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+import pytest
+from betfairlightweight.endpoints import Betting
+
+from arb_search.apis.betfair.endpoints.betting import Betting_Limitless
+from arb_search.apis.betfair.utils import betfair_to_datetime, datetime_to_betfair_format
+
+START = datetime(2024, 1, 1, 12)
+PAGE = 10
+
+
+class FakeCatalogue:
+    """Answers listMarketCatalogue like Betfair: markets starting within the inclusive from/to range, first to start first."""
+
+    def __init__(self, start_times: List[datetime]) -> None:
+        self.markets = [{"marketId": f"1.{i}", "marketStartTime": datetime_to_betfair_format(start_time),
+                         "event": {"openDate": datetime_to_betfair_format(start_time)}}
+                        for i, start_time in enumerate(start_times)]
+        self.requests: List[Tuple[Optional[datetime], Optional[datetime]]] = []
+        self._lock = threading.Lock()
+
+    def list_market_catalogue(self, filter, market_projection= None, sort= None, max_results= 1, *args) -> list:
+        time_range = filter.get("marketStartTime", {})
+        start = betfair_to_datetime(time_range["from"]) if "from" in time_range else None
+        end = betfair_to_datetime(time_range["to"]) if "to" in time_range else None
+        with self._lock:
+            self.requests.append((start, end))
+        markets = [market for market in self.markets
+                   if (start is None or betfair_to_datetime(market["marketStartTime"]) >= start)
+                   and (end is None or betfair_to_datetime(market["marketStartTime"]) <= end)]
+        return sorted(markets, key= lambda market: market["marketStartTime"])[:max_results]
+
+
+@pytest.fixture
+def betting(monkeypatch) -> Betting_Limitless:
+    monkeypatch.setattr(Betting_Limitless, "_catalogue_max_results", staticmethod(lambda market_projection: PAGE))
+    monkeypatch.setattr("arb_search.apis.betfair.endpoints.betting.sleep", lambda seconds: None)
+    return Betting_Limitless.__new__(Betting_Limitless)
+
+
+def catalogue_of(monkeypatch, start_times: List[datetime]) -> FakeCatalogue:
+    catalogue = FakeCatalogue(start_times)
+    monkeypatch.setattr(Betting, "list_market_catalogue", lambda betting, *args: catalogue.list_market_catalogue(*args))
+    return catalogue
+
+
+def time_filter(start: datetime, end: datetime) -> dict:
+    return {"marketStartTime": {"from": datetime_to_betfair_format(start), "to": datetime_to_betfair_format(end)}}
+
+
+def market_ids(markets: list) -> List[str]:
+    return sorted(market["marketId"] for market in markets)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_full_windows_are_split(betting, monkeypatch, seed):
+    rng = random.Random(seed)
+    # minutes only, so many markets fall on the boundaries the windows share
+    start_times = [START + timedelta(minutes= rng.randrange(8 * 60)) for _ in range(rng.randint(50, 300))]
+    catalogue = catalogue_of(monkeypatch, start_times)
+
+    markets = betting.list_all_market_catalogue(time_filter(START, START + timedelta(hours= 8)), partitions= 4)
+    assert market_ids(markets) == market_ids(catalogue.markets)
+    # every window that came back full was fetched again as two halves
+    assert len(catalogue.requests) > 4
+
+
+def test_boundary_markets_are_not_duplicated(betting, monkeypatch):
+    boundaries = [START + timedelta(hours= hour) for hour in range(9)]
+    catalogue = catalogue_of(monkeypatch, boundaries * 2)
+
+    markets = betting.list_all_market_catalogue(time_filter(START, START + timedelta(hours= 8)), partitions= 8)
+    assert market_ids(markets) == market_ids(catalogue.markets)
+    assert len(catalogue.requests) == 8
+
+
+def test_crowded_minute_is_paged_serially(betting, monkeypatch):
+    crowded = [START + timedelta(hours= 1)] * (PAGE + 5)
+    others = [START + timedelta(minutes= minute) for minute in range(0, 120, 7)]
+    catalogue = catalogue_of(monkeypatch, others + crowded)
+
+    markets = betting.list_all_market_catalogue(time_filter(START, START + timedelta(hours= 2)), partitions= 2,
+                                                min_window= timedelta(minutes= 1))
+    ids = market_ids(markets)
+    assert len(ids) == len(set(ids))
+    # a page holds only PAGE of the crowded minute's markets, every other market is found
+    assert set(market_ids(catalogue.markets[:len(others)])) <= set(ids)
+    assert len(ids) >= len(others) + PAGE
+
+
+def test_open_range_is_paged_serially(betting, monkeypatch):
+    catalogue = catalogue_of(monkeypatch, [START + timedelta(minutes= minute) for minute in range(35)])
+    markets = betting.list_all_market_catalogue({"marketStartTime": {"from": datetime_to_betfair_format(START)}})
+    assert market_ids(markets) == market_ids(catalogue.markets)
+    assert all(end is None for _, end in catalogue.requests)
@@ -0,0 +1,118 @@
+import random
+from datetime import datetime, timedelta
+from typing import Any, List
+
+import pytest
+from betting_event import BetType
+
+from arb_search.user_event import OddsBook, UserBet, UserBookmaker, UserEvent
+
+START = datetime(2024, 1, 1, 12)
+OUTCOMES = [(BetType.MatchWinner, "home"), (BetType.MatchWinner, "draw"), (BetType.MatchWinner, "away")]
+APIS = ["the-odds-api", "betfair"]
+
+
+@pytest.fixture
+def bookmakers() -> List[UserBookmaker]:
+    return [UserBookmaker("bet365"), UserBookmaker("betfair_ex_uk")]
+
+
+def merge_bets(bets: List[UserBet], new_bets: List[UserBet], api: Any) -> List[UserBet]:
+    """The merge UserEvent.update_from_event made before OddsBook.merge."""
+    bets = list(bets)
+    current_bet_indexes = list(range(len(bets)))
+    for new_bet in new_bets:
+        for i in current_bet_indexes:
+            if bets[i] == new_bet:
+                bets[i] = bets[i].update_from_bet(new_bet)
+                break
+        else:
+            bets.append(new_bet)
+            continue
+
+        current_bet_indexes.remove(i)
+
+    for i in current_bet_indexes[::-1]:
+        if api in bets[i].api_specific_data.keys():
+            del bets[i]
+    return bets
+
+
+def fields(bet: UserBet) -> tuple:
+    return (bet.bet_type, bet.value, bet.odds, id(bet.bookmaker), bet.lay, bet.volume, bet.wager, bet.previous_wager,
+            bet.update_time, bet.api_specific_data)
+
+
+def random_bets(rng: random.Random, count: int, api: str, bookmakers: List[UserBookmaker]) -> List[UserBet]:
+    bets = []
+    for _ in range(count):
+        bet_type, value = rng.choice(OUTCOMES)
+        bets.append(UserBet(bet_type, value, rng.choice([1.5, 2.0, 2.5, 3.0]), rng.choice(bookmakers), lay= rng.random() < 0.3,
+                            volume= float(rng.randint(1, 100)), update_time= START + timedelta(seconds= rng.randint(0, 60)),
+                            api_specific_data= {api: {"id": rng.randint(0, 3)}}))
+    return bets
+
+
+@pytest.mark.parametrize("separate_bookmakers", [False, True])
+@pytest.mark.parametrize("seed", range(100))
+def test_merge_matches_bet_merge(seed, separate_bookmakers, bookmakers):
+    rng = random.Random(seed)
+    current = random_bets(rng, rng.randint(0, 30), rng.choice(APIS), bookmakers)
+    api = rng.choice(APIS)
+    # each API may build its own, equal, bookmaker objects
+    new_bookmakers = [UserBookmaker(bookmaker.name) for bookmaker in bookmakers] if separate_bookmakers else bookmakers
+    new = random_bets(rng, rng.randint(0, 30), api, new_bookmakers)
+
+    book = OddsBook.from_bets(current)
+    book.merge(OddsBook.from_bets(new), api)
+
+    # the reference merge mutates the bets it is given, so it gets its own copies
+    expected = merge_bets(OddsBook.from_bets(current).to_bets(), OddsBook.from_bets(new).to_bets(), api)
+    assert [fields(bet) for bet in book.to_bets()] == [fields(bet) for bet in expected]
+
+
+def test_merge_keeps_newer_price_and_both_sources(bookmakers):
+    bookmaker = bookmakers[0]
+    book = OddsBook.from_bets([UserBet(BetType.MatchWinner, "home", 2.0, bookmaker, volume= 10.0, update_time= START,
+                                       api_specific_data= {"betfair": {"id": 1}})])
+    new = OddsBook.from_bets([UserBet(BetType.MatchWinner, "home", 2.0, bookmaker, volume= 20.0, update_time= START + timedelta(seconds= 5),
+                                      api_specific_data= {"the-odds-api": {"id": 2}})])
+    book.merge(new, "the-odds-api")
+
+    bet, = book.to_bets()
+    assert bet.volume == 20.0
+    assert bet.update_time == START + timedelta(seconds= 5)
+    assert bet.api_specific_data == {"betfair": {"id": 1}, "the-odds-api": {"id": 2}}
+
+
+def test_merge_pairs_equal_bookmakers(bookmakers):
+    book = OddsBook.from_bets([UserBet(BetType.MatchWinner, "home", 2.0, bookmakers[0], update_time= START,
+                                       api_specific_data= {"betfair": {}})])
+    reloaded = UserBookmaker(bookmakers[0].name)
+    book.merge(OddsBook.from_bets([UserBet(BetType.MatchWinner, "home", 2.0, reloaded, update_time= START + timedelta(seconds= 5),
+                                           api_specific_data= {"the-odds-api": {}})]), "the-odds-api")
+
+    bet, = book.to_bets()
+    assert bet.bookmaker is reloaded
+    assert bet.api_specific_data == {"betfair": {}, "the-odds-api": {}}
+
+
+def test_merge_drops_stale_prices_of_api_only(bookmakers):
+    bookmaker = bookmakers[0]
+    book = OddsBook.from_bets([
+        UserBet(BetType.MatchWinner, "home", 2.0, bookmaker, update_time= START, api_specific_data= {"betfair": {}}),
+        UserBet(BetType.MatchWinner, "away", 3.0, bookmaker, update_time= START, api_specific_data= {"the-odds-api": {}}),
+    ])
+    book.merge(OddsBook.from_bets([UserBet(BetType.MatchWinner, "draw", 3.5, bookmaker, update_time= START,
+                                           api_specific_data= {"the-odds-api": {}})]), "the-odds-api")
+    assert [(bet.value, bet.odds) for bet in book.to_bets()] == [("home", 2.0), ("draw", 3.5)]
+
+
+def test_update_from_event(bookmakers):
+    event = UserEvent(bets= random_bets(random.Random(0), 10, "betfair", bookmakers))
+    new_event = UserEvent(bookmakers= list(bookmakers), bets= random_bets(random.Random(1), 10, "the-odds-api", bookmakers))
+    expected = merge_bets(event.odds_book.to_bets(), new_event.odds_book.to_bets(), "the-odds-api")
+
+    assert event.update_from_event(new_event, "the-odds-api") is event      # type: ignore
+    assert event.bookmakers == bookmakers
+    assert [fields(bet) for bet in event.bets] == [fields(bet) for bet in expected]
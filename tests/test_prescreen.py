@@ -0,0 +1,131 @@
+import math
+import random
+from typing import List, Tuple
+
+import numpy as np
+import pytest
+from betting_event import BetType
+
+from arb_search.prescreen import ArbitragePreScreen, _settlement
+from arb_search.user_event import UserBet, UserBookmaker, UserEvent
+
+Price = Tuple[BetType, str, float]
+
+MULTI_MARKET = [(BetType.MatchWinner, value) for value in ("home", "draw", "away")] + \
+    [(BetType.Goals_OverUnder, f"{side} {line}") for line in (1.5, 2.5, 3.5) for side in ("over", "under")] + \
+    [(BetType.AsianHandicap, f"home {line}") for line in (-1.0, -0.75, -0.5, -0.25, 0.0, 0.5)] + \
+    [(BetType.AsianHandicap, f"away {-line}") for line in (-1.0, -0.75, -0.5, -0.25, 0.0, 0.5)] + \
+    [(BetType.BothTeamsToScore, "yes"), (BetType.BothTeamsToScore, "no")] + \
+    [(BetType.ExactScore, f"{home}:{away}") for home in range(3) for away in range(3)]
+
+
+@pytest.fixture
+def bookmaker() -> UserBookmaker:
+    return UserBookmaker("bet365", commission= 0.0)
+
+
+def event_of(bookmaker: UserBookmaker, prices: List[Price], lays: List[Price] = []) -> UserEvent:
+    bets = [UserBet(bet_type, value, odds, bookmaker) for bet_type, value, odds in prices]
+    bets += [UserBet(bet_type, value, odds, bookmaker, lay= True) for bet_type, value, odds in lays]
+    return UserEvent(bets= bets)
+
+
+def model_prices(home_goals: float, away_goals: float, overround: float) -> List[Price]:
+    """MULTI_MARKET priced from independent Poisson goals, each price's return cut by overround."""
+    home = np.array([math.exp(-home_goals) * home_goals ** k / math.factorial(k) for k in range(8)])
+    away = np.array([math.exp(-away_goals) * away_goals ** k / math.factorial(k) for k in range(8)])
+    probability = np.outer(home, away).ravel()
+    probability /= probability.sum()
+
+    prices = []
+    for bet_type, value in MULTI_MARKET:
+        won, pushed = _settlement((bet_type, value))
+        # a fair price returns the stake on average: won * (odds - 1) = lost
+        fair = (1 - probability @ pushed) / (probability @ won)
+        prices.append((bet_type, value, round(fair / (1 + overround), 2)))
+    return prices
+
+
+def test_single_market(bookmaker):
+    screen = ArbitragePreScreen()
+    fair = event_of(bookmaker, [(BetType.MatchWinner, "home", 2.0), (BetType.MatchWinner, "draw", 4.0), (BetType.MatchWinner, "away", 4.0)])
+    arbitrage = event_of(bookmaker, [(BetType.MatchWinner, "home", 2.1), (BetType.MatchWinner, "draw", 4.0), (BetType.MatchWinner, "away", 4.0)])
+    assert screen.screen([fair, arbitrage]) == [arbitrage]
+    assert fair.best_implied_sum == pytest.approx(1.0)
+    assert arbitrage.best_implied_sum == pytest.approx(1 / 2.1 + 0.5)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_multi_market_event_is_dropped(seed, bookmaker):
+    rng = random.Random(seed)
+    event = event_of(bookmaker, model_prices(rng.uniform(0.6, 2.2), rng.uniform(0.6, 2.2), 0.04))
+    screen = ArbitragePreScreen()
+    assert screen.screen([event]) == []
+    assert screen.last_pruned == 1
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_cross_market_arbitrage_is_kept(seed, bookmaker):
+    rng = random.Random(seed)
+    prices = model_prices(rng.uniform(0.6, 2.2), rng.uniform(0.6, 2.2), 0.04)
+    odds = {(bet_type, value): price for bet_type, value, price in prices}
+    # home and away +0.5 (away or draw) cover every result, neither market alone is profitable
+    home = odds[(BetType.MatchWinner, "home")]
+    prices.append((BetType.AsianHandicap, "away 0.5", round(1 / (0.99 - 1 / home), 2)))
+    event = event_of(bookmaker, prices)
+    assert ArbitragePreScreen().screen([event]) == [event]
+
+
+def test_lay_arbitrage_across_markets_is_kept(bookmaker):
+    prices = [(BetType.MatchWinner, "home", 2.0), (BetType.MatchWinner, "draw", 3.4), (BetType.MatchWinner, "away", 4.0),
+              (BetType.Goals_OverUnder, "over 2.5", 1.8), (BetType.Goals_OverUnder, "under 2.5", 1.9)]
+    screen = ArbitragePreScreen()
+    assert screen.screen([event_of(bookmaker, prices)]) == []
+    # laying home -0.5 at 1.9 backs a draw or away win at 2.11, with the match winner back on home that covers every result
+    kept = event_of(bookmaker, prices, lays= [(BetType.AsianHandicap, "home -0.5", 1.9)])
+    assert screen.screen([kept]) == [kept]
+    assert kept.best_implied_sum > 1
+
+
+def test_unknown_outcome_keeps_event(bookmaker):
+    prices = model_prices(1.4, 1.1, 0.04) + [(BetType.DoubleChance, "arsenal/draw", 1.3)]
+    event = event_of(bookmaker, prices)
+    assert ArbitragePreScreen().screen([event]) == [event]
+
+
+def test_margin(bookmaker):
+    event = event_of(bookmaker, model_prices(1.4, 1.1, 0.04))
+    assert ArbitragePreScreen(margin= 0.02).screen([event]) == []
+    assert ArbitragePreScreen(margin= 0.1).screen([event]) == [event]
+
+
+@pytest.mark.parametrize("key, score, won, pushed", [
+    ((BetType.AsianHandicap, "home -0.25"), (1, 1), 0.0, 0.5),
+    ((BetType.AsianHandicap, "home -0.25"), (2, 1), 1.0, 0.0),
+    ((BetType.AsianHandicap, "away 0.75"), (1, 0), 0.0, 0.5),
+    ((BetType.AsianHandicap, "away 1.0"), (1, 0), 0.0, 1.0),
+    ((BetType.Goals_OverUnder, "over 2.25"), (1, 1), 0.0, 0.5),
+    ((BetType.Goals_OverUnder, "over 2.25"), (2, 1), 1.0, 0.0),
+    ((BetType.Goals_OverUnder, "under 2.75"), (2, 1), 0.0, 0.5),
+    ((BetType.Team_OverUnder, "away over 0.5"), (0, 1), 1.0, 0.0),
+    ((BetType.Team_WinToNil, "home yes"), (2, 0), 1.0, 0.0),
+    ((BetType.Result_OverUnder, "draw/under 2.5"), (1, 1), 1.0, 0.0),
+    ((BetType.Result_BothTeamsScore, "home/yes"), (2, 0), 0.0, 0.0),
+    ((BetType.DoubleChance, "draw/away"), (0, 0), 1.0, 0.0),
+    ((BetType.OddEven, "odd"), (2, 1), 1.0, 0.0),
+])
+def test_settlement(key, score, won, pushed):
+    settlement = _settlement(key)
+    assert settlement is not None
+    state = score[0] * 8 + score[1]
+    assert (settlement[0][state], settlement[1][state]) == (won, pushed)
+
+
+@pytest.mark.parametrize("key", [
+    (BetType.Result_OverUnder, "home/over 2.25"),
+    (BetType.AsianHandicap, "draw 0.5"),
+    (BetType.MatchWinner, "arsenal"),
+    (BetType.Goals_OverUnder, "over x"),
+])
+def test_unknown_settlement(key):
+    assert _settlement(key) is None
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Iterable, Iterator, List, Tuple
+
+from arb_search.dispatch import DispatchResult
+from arb_search.entity_registry import EntityRegistry
+from arb_search.scanner import CycleStats, RefreshScheduler, Scanner
+from arb_search.sport_types import SportType
+from arb_search.user_event import UserEvent
+
+
+class FakeAPI:
+    name = "fake"
+
+    def __init__(self, fixtures: List[Tuple[str, str]]) -> None:
+        self.fixtures = fixtures
+
+    def read_event_comparison_data(self, event: UserEvent) -> Tuple[str, str, str, str]:
+        return (self.name, *event.api_specific_data[self]["fixture"], "Premier League")
+
+    def update_events(self, events: List[UserEvent]) -> None:
+        raise ConnectionError("refused")
+
+
+class FailingDispatcher:
+    def dispatch(self, events: Iterable[UserEvent]) -> Iterator[DispatchResult]:
+        for event in events:
+            yield DispatchResult(event, ValueError("bad event"), 1, 0.0)
+
+
+def test_failures_are_returned_in_cycle_stats():
+    api = FakeAPI([("Arsenal", "Chelsea")])
+    start_time = datetime.now() + timedelta(hours= 1)
+    events = [UserEvent(start_time= start_time, api_specific_data= {api: {"fixture": fixture}}) for fixture in api.fixtures]
+    handler = SimpleNamespace(apis= [api], registry= EntityRegistry(), gather_all_sport_type= lambda **kwargs: list(events))
+    cycles: List[CycleStats] = []
+    scanner = Scanner(handler, [SportType.Soccer], FailingDispatcher(), prescreen= SimpleNamespace(screen= list),    # type: ignore
+                      scheduler= RefreshScheduler(min_interval= 0.0, max_interval= 0.0), idle_sleep= 0.0, on_cycle= cycles.append)
+
+    scanner.run(cycles= 2)
+    gather, refresh = cycles
+    assert gather.gathered == 1 and gather.failed_updates == {}
+    assert refresh.refreshed == 1
+    assert isinstance(refresh.failed_updates["fake"], ConnectionError)
+    for stats in cycles:
+        assert list(stats.failed_calculations) == ["Arsenal v Chelsea"]
+        assert isinstance(stats.failed_calculations["Arsenal v Chelsea"], ValueError)
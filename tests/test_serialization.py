@@ -0,0 +1,67 @@
+from datetime import datetime
+
+import pytest
+
+from arb_search.serialization import JSONCodec, dump_file, get_codec, load_file
+
+# a the-odds-api odds response, as the response cache stores it
+ODDS = [{
+    "id": "e912304de2b2ce35b473ce2ecd3d1502",
+    "sport_key": "soccer_epl",
+    "commence_time": "2024-01-01T15:00:00Z",
+    "home_team": "Arsenal",
+    "away_team": "Chelsea",
+    "bookmakers": [{
+        "key": "betfair_ex_uk",
+        "last_update": "2024-01-01T14:58:31Z",
+        "markets": [{"key": "h2h", "outcomes": [{"name": "Arsenal", "price": 2.1}, {"name": "Chelsea", "price": 3.65},
+                                                {"name": "Draw", "price": 3.4}]},
+                    {"key": "h2h_lay", "outcomes": [{"name": "Arsenal", "price": 2.12}]},
+                    {"key": "spreads", "outcomes": [{"name": "Arsenal", "price": 1.91, "point": -0.5}]}],
+    }],
+}]
+DATA = {"odds": ODDS, "remaining": 498, "empty": [], "nothing": None, "flag": True, "unicode": "Atlético Madrid",
+        "big": 2 ** 40, "small": -1.5e-9}
+
+
+@pytest.fixture(params= ['json', 'msgpack+zstd'])
+def codec(request):
+    if request.param == 'msgpack+zstd':
+        pytest.importorskip('msgpack')
+        pytest.importorskip('zstandard')
+    return get_codec(request.param)
+
+
+def test_round_trip(codec):
+    assert codec.loads(codec.dumps(DATA)) == DATA
+
+
+def test_file_round_trip(codec, tmp_path):
+    filename = str(tmp_path / f'odds{codec.extension}')
+    dump_file(filename, DATA, codec)
+    # the codec is found from the extension
+    assert load_file(filename) == DATA
+
+    dump_file(filename, ODDS, codec.name, atomic= True)
+    assert load_file(filename, codec.name) == ODDS
+    assert [path.name for path in tmp_path.iterdir()] == [f'odds{codec.extension}']
+
+
+def test_tuples_and_objects(codec):
+    when = datetime(2024, 1, 1, 15)
+    assert codec.loads(codec.dumps({"pair": (1, 2), "when": when})) == {"pair": [1, 2], "when": str(when)}
+
+
+def test_invalid_payload(codec):
+    with pytest.raises(ValueError):
+        codec.loads(b'\x00not a payload')
+
+
+def test_get_codec():
+    codec = JSONCodec(indent= 2)
+    assert get_codec(codec) is codec
+    assert get_codec('json', indent= 2).dumps({"a": 1}) == codec.dumps({"a": 1}) == b'{\n  "a": 1\n}'
+    with pytest.raises(ValueError):
+        get_codec('pickle')
+    with pytest.raises(ValueError):
+        load_file('odds.pkl')
@@ -0,0 +1,151 @@
+import gc
+import json
+import os
+import pickle
+import threading
+import time
+import weakref
+
+import pytest
+
+from arb_search.utils import StoredDict, atomic_write
+
+
+def read_pickle(path: str) -> dict:
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def test_atomic_write_replaces_file(tmp_path):
+    path = str(tmp_path / 'data.json')
+    atomic_write(path, lambda f: f.write('old'), binary= False)
+    atomic_write(path, lambda f: f.write('new'), binary= False)
+
+    with open(path) as f:
+        assert f.read() == 'new'
+    assert os.listdir(tmp_path) == ['data.json']
+
+
+def test_atomic_write_keeps_original_on_error(tmp_path):
+    path = str(tmp_path / 'data.json')
+    atomic_write(path, lambda f: f.write('old'), binary= False)
+
+    def failing_writer(f):
+        f.write('partial')
+        raise RuntimeError('writer failed')
+
+    with pytest.raises(RuntimeError):
+        atomic_write(path, failing_writer, binary= False)
+
+    with open(path) as f:
+        assert f.read() == 'old'
+    # the temporary file is removed
+    assert os.listdir(tmp_path) == ['data.json']
+
+
+def test_writes_every_mutation(tmp_path):
+    path = str(tmp_path / 'store.json')
+    store = StoredDict(path, method= 'json')
+    store['a'] = 1
+    with open(path) as f:
+        assert json.load(f) == {'a': 1}
+
+    store.update(b= 2)
+    del store['a']
+    assert StoredDict(path, method= 'json') == {'b': 2}
+
+
+def test_write_behind_flushes_after_flush_every(tmp_path):
+    path = str(tmp_path / 'store.pkl')
+    store = StoredDict(path, write_behind= True, flush_every= 3, flush_interval= 3600)
+    store['a'] = 1
+    store['b'] = 2
+    assert not os.path.exists(path)
+
+    store['c'] = 3
+    assert read_pickle(path) == {'a': 1, 'b': 2, 'c': 3}
+
+
+def test_write_behind_flushes_after_flush_interval(tmp_path):
+    path = str(tmp_path / 'store.pkl')
+    store = StoredDict(path, write_behind= True, flush_every= 1000, flush_interval= 0)
+    store['a'] = 1
+    assert read_pickle(path) == {'a': 1}
+
+
+def test_quiet_store_is_flushed_by_timer(tmp_path):
+    path = str(tmp_path / 'store.pkl')
+    store = StoredDict(path, write_behind= True, flush_every= 1000, flush_interval= 0.1)
+    store['a'] = 1
+    store['b'] = 2
+    assert not os.path.exists(path)
+
+    deadline = time.monotonic() + 5
+    while not os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert read_pickle(path) == {'a': 1, 'b': 2}
+    assert store._flush_timer is None
+
+
+def test_concurrent_mutations_are_all_written(tmp_path):
+    path = str(tmp_path / 'store.pkl')
+    store = StoredDict(path, write_behind= True, flush_every= 7, flush_interval= 3600)
+
+    def writer(thread: int) -> None:
+        for i in range(200):
+            store[(thread, i)] = i
+            if i % 3 == 0:
+                del store[(thread, i)]
+
+    threads = [threading.Thread(target= writer, args= (thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.flush()
+    assert read_pickle(path) == dict(store)
+    assert len(store) == 8 * (200 - 67)
+
+
+def test_write_behind_flush_and_with_block(tmp_path):
+    path = str(tmp_path / 'store.pkl')
+    store = StoredDict(path, write_behind= True, flush_every= 1000, flush_interval= 3600)
+    store['a'] = 1
+    store.flush()
+    assert read_pickle(path) == {'a': 1}
+
+    with store:
+        store['b'] = 2
+        assert read_pickle(path) == {'a': 1}
+    assert read_pickle(path) == {'a': 1, 'b': 2}
+
+
+def test_mark_dirty_applies_threshold(tmp_path):
+    path = str(tmp_path / 'store.pkl')
+    store = StoredDict(path, write_behind= True, flush_every= 3, flush_interval= 3600)
+    store['table'] = {}
+    store['table']['a'] = 1
+    store.mark_dirty()
+    assert not os.path.exists(path)
+
+    store['table']['b'] = 2
+    store.mark_dirty()
+    assert read_pickle(path) == {'table': {'a': 1, 'b': 2}}
+
+
+def test_mark_dirty_writes_without_write_behind(tmp_path):
+    path = str(tmp_path / 'store.json')
+    store = StoredDict(path, method= 'json')
+    store['table'] = {}
+    store['table']['a'] = 1
+    store.mark_dirty()
+    with open(path) as f:
+        assert json.load(f) == {'table': {'a': 1}}
+
+
+def test_write_behind_store_can_be_collected(tmp_path):
+    store = StoredDict(str(tmp_path / 'store.pkl'), write_behind= True)
+    ref = weakref.ref(store)
+    del store
+    gc.collect()
+    assert ref() is None
@@ -0,0 +1,71 @@
+import random
+import string
+from difflib import SequenceMatcher
+from typing import List
+
+import pytest
+
+from arb_search.utils import TeamNameMatcher, team_name_matcher
+
+WORDS = ["United", "City", "Athletic", "Rovers", "Wanderers", "Real", "Sporting", "Inter", "FC", "AFC", "Town", "Albion",
+         "Madrid", "Milan", "Porto", "Lyon", "Leeds", "Bristol", "Hull", "Derby"]
+
+
+def linear_match(name: str, candidates: List[str]) -> str:
+    """The scan TeamNameMatcher replaced."""
+    return max(candidates, key= lambda candidate: SequenceMatcher(None, name.lower(), candidate.lower()).ratio())
+
+
+def misspell(rng: random.Random, name: str) -> str:
+    """name with a few characters dropped, swapped or replaced, and its case or word order changed."""
+    characters = list(name)
+    for _ in range(rng.randint(0, 3)):
+        i = rng.randrange(len(characters))
+        edit = rng.random()
+        if edit < 0.3 and len(characters) > 1:
+            del characters[i]
+        elif edit < 0.6:
+            characters[i] = rng.choice(string.ascii_letters)
+        else:
+            characters.insert(i, rng.choice(string.ascii_lowercase))
+    misspelt = ''.join(characters)
+    if rng.random() < 0.3:
+        misspelt = misspelt.upper()
+    if rng.random() < 0.2:
+        misspelt = ' '.join(reversed(misspelt.split()))
+    return misspelt
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_same_answer_as_linear_scan(seed):
+    rng = random.Random(seed)
+    candidates = list(dict.fromkeys(' '.join(rng.sample(WORDS, rng.randint(1, 3))) for _ in range(rng.randint(1, 80))))
+    matcher = TeamNameMatcher(candidates, cache_size= rng.choice([0, 8, 4096]))
+
+    for _ in range(100):
+        name = misspell(rng, rng.choice(candidates)) if rng.random() < 0.8 else ' '.join(rng.sample(WORDS, 2))
+        assert matcher.match(name) == linear_match(name, candidates), name
+
+
+def test_ties_go_to_first_candidate():
+    # no candidate shares a character with the name
+    assert TeamNameMatcher(["Leeds", "Hull", "Leeds"]).match("xyz") == linear_match("xyz", ["Leeds", "Hull", "Leeds"]) == "Leeds"
+    # candidates equal once lowercased
+    candidates = ["Derby County", "derby county", "Derby"]
+    assert TeamNameMatcher(candidates).match("DERBY COUNTY") == "Derby County"
+
+
+def test_cached_answer_and_eviction():
+    matcher = TeamNameMatcher(["Arsenal", "Aston Villa", "Chelsea"], cache_size= 2)
+    for name in ["arsenal fc", "villa", "chelsea", "arsenal fc"]:
+        assert matcher.match(name) == linear_match(name, matcher.candidates)   # type: ignore
+    assert list(matcher._cache) == ["chelsea", "arsenal fc"]
+
+
+def test_shared_matcher():
+    assert team_name_matcher("Man Utd", ["Manchester City", "Manchester United"]) == linear_match("Man Utd", ["Manchester City", "Manchester United"])
+
+
+def test_no_candidates():
+    with pytest.raises(ValueError):
+        TeamNameMatcher([])
@@ -0,0 +1,170 @@
+import json
+import os
+import time
+from datetime import timedelta
+from typing import List
+
+import pytest
+
+from arb_search.apis.the_odds_api import RefreshBudgetExhausted, ScanPlan, ScanPlanner, TheOddsAPI_V4
+from arb_search.utils import StoredDict
+
+
+class FakeResponse:
+    status_code = 200
+    raw = None
+    elapsed = timedelta(0)
+
+    def __init__(self, data) -> None:
+        self.text = json.dumps(data)
+        self.content = self.text.encode()
+        self.headers = {'x-requests-used': '1', 'x-requests-remaining': '499'}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeSession:
+    """Answers every GET with the number of requests made so far."""
+
+    def __init__(self) -> None:
+        self.requests: List[dict] = []
+
+    def get(self, url: str, params: dict, timeout: float) -> FakeResponse:
+        self.requests.append({'url': url, **params})
+        return FakeResponse({'request': len(self.requests)})
+
+
+@pytest.fixture(params= ['json', 'msgpack+zstd'])
+def api(request, tmp_path) -> TheOddsAPI_V4:
+    if request.param == 'msgpack+zstd':
+        pytest.importorskip('msgpack')
+        pytest.importorskip('zstandard')
+    planner = ScanPlanner(StoredDict(str(tmp_path / 'scan_history.json'), method= 'json'))
+    api = TheOddsAPI_V4({}, session= FakeSession(), api_key= 'key', cache_codec= request.param, planner= planner)    # type: ignore
+    api.cache_dir = str(tmp_path)
+    return api
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    return now
+
+
+def test_normalize_params_sorts_lists_and_drops_api_key():
+    params = {'api_key': 'secret', 'markets': ['totals', 'h2h'], 'regions': 'us,eu', 'oddsFormat': 'decimal'}
+    assert TheOddsAPI_V4._normalize_params(params) == {'markets': 'h2h,totals', 'regions': 'eu,us', 'oddsFormat': 'decimal'}
+
+
+def test_cache_path_ignores_order_and_api_key(api):
+    path = api._cache_path('sports/soccer_epl/odds', {'api_key': 'a', 'markets': 'h2h,totals', 'regions': ['uk', 'eu']})
+    assert path == api._cache_path('sports/soccer_epl/odds', {'regions': 'eu,uk', 'markets': ['totals', 'h2h'], 'api_key': 'b'})
+    assert path.startswith(api.cache_dir + '/sports/soccer_epl/odds/')
+    assert path.endswith(api.cache_codec.extension)
+
+    assert path != api._cache_path('sports/soccer_epl/odds', {'markets': 'h2h', 'regions': 'eu,uk'})
+    assert path != api._cache_path('sports/soccer_fa_cup/odds', {'markets': 'h2h,totals', 'regions': 'eu,uk'})
+
+
+def test_cache_ttl_matches_endpoint_suffix(api):
+    assert api._cache_ttl('sports') == 6 * 60 * 60
+    assert api._cache_ttl('sports/soccer_epl/odds') == 30.0
+    assert api._cache_ttl('sports/soccer_epl/events/abc/odds') == 30.0
+    assert api._cache_ttl('sports/soccer_epl/scores') == 60.0
+    assert api._cache_ttl('sports/soccer_epl/odds-history') is None
+    assert api._cache_ttl('sports/soccer_epl/participants') == 0.0
+
+
+def test_equivalent_params_share_cache_entry(api, clock):
+    first = api._get_scores('soccer_epl', params= {'api_key': 'a', 'daysFrom': 1, 'eventIds': ['b', 'a']})
+    second = api._get_scores('soccer_epl', params= {'eventIds': 'a,b', 'daysFrom': '1', 'api_key': 'b'})
+    assert first == second == {'request': 1}
+    assert len(api.session.requests) == 1
+
+
+def test_cached_response_expires_after_ttl(api, clock):
+    assert api._get_scores('soccer_epl', params= {}) == {'request': 1}
+
+    clock[0] += 59
+    assert api._get_scores('soccer_epl', params= {}) == {'request': 1}
+    assert api.cache_age('sports/soccer_epl/scores', {}) == pytest.approx(59)
+
+    clock[0] += 2
+    assert api._get_scores('soccer_epl', params= {}) == {'request': 2}
+    assert api.cache_age('sports/soccer_epl/scores', {}) == pytest.approx(0)
+
+
+def test_params_are_not_mutated(api, clock):
+    defaults = dict(api.default_params)
+    params = {'markets': ['h2h', 'totals'], 'regions': 'uk'}
+    api._get_odds('soccer_epl', params= params, start_time_range= (None, None))
+    api._get_odds('soccer_epl', start_time_range= (None, None))
+    api._get_event_odds('soccer_epl', 'a', params= params)
+    api._get_event_odds('soccer_epl', 'a')
+    assert params == {'markets': ['h2h', 'totals'], 'regions': 'uk'}
+    assert api.default_params == defaults
+
+
+def test_max_age_and_force_update_override_ttl(api, clock):
+    api._get_scores('soccer_epl', params= {})
+    clock[0] += 10
+    assert api._get_scores('soccer_epl', params= {}, max_age= 5) == {'request': 2}
+    assert api._get_scores('soccer_epl', params= {}, force_update= True) == {'request': 3}
+    assert api._get_scores('soccer_epl', params= {}) == {'request': 3}
+
+
+def test_unexpiring_endpoint_is_never_refetched(api, clock):
+    api._get_historical_odds('soccer_epl', params= {})
+    clock[0] += 365 * 24 * 60 * 60
+    assert api._get_historical_odds('soccer_epl', params= {}) == {'request': 1}
+
+
+@pytest.mark.parametrize('params, cost', [
+    ({'markets': 'h2h,spreads,totals', 'regions': 'uk,eu'}, 6),
+    ({'markets': ['h2h', 'spreads', 'totals'], 'regions': ['uk', 'eu']}, 6),
+    ({'markets': ('h2h',), 'regions': ['uk']}, 1),
+    ({'regions': 'uk,eu,us'}, 3),
+    ({}, 1),
+])
+def test_request_cost_of_list_and_string_params(params, cost):
+    assert TheOddsAPI_V4.request_cost('sports/soccer_epl/odds', params) == cost
+    assert TheOddsAPI_V4.request_cost('sports/soccer_epl/events/abc/odds', params) == cost
+
+
+def test_request_cost_of_other_endpoints():
+    assert TheOddsAPI_V4.request_cost('sports', {'markets': 'h2h,totals'}) == 0
+    assert TheOddsAPI_V4.request_cost('sports/soccer_epl/scores', {}) == 1
+
+
+def test_default_planner_opens_its_history_lazily(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    api = TheOddsAPI_V4({}, session= FakeSession(), api_key= 'key')    # type: ignore
+    assert api.planner.path == 'storage/the-odds-API_v4/scan_history.json'
+    assert not os.path.exists('storage/the-odds-API_v4')
+
+
+def test_only_requests_to_the_api_are_charged(api, clock):
+    plan = ScanPlan(1, [])
+    params = {'markets': 'h2h', 'regions': 'uk'}
+    assert api._get_event_odds('soccer_epl', 'a', params= dict(params), budget= plan) == {'request': 1}
+    assert api._get_event_odds('soccer_epl', 'a', params= dict(params), budget= plan) == {'request': 1}
+    assert plan.spent == 1
+
+    with pytest.raises(RefreshBudgetExhausted):
+        api._get_event_odds('soccer_epl', 'b', params= dict(params), budget= plan)
+    assert plan.spent == 1
+    assert len(api.session.requests) == 1
+
+
+def test_cached_sports_are_planned_free(api, clock):
+    api._get_odds('soccer_epl')
+    assert api.is_cached('sports/soccer_epl/odds', api._odds_params())
+    assert not api.is_cached('sports/soccer_fa_cup/odds', api._odds_params())
+
+    plan = api.planner.plan(['soccer_epl', 'soccer_fa_cup'], 3, odds_cost= 3, alternates_cost_per_event= 3, cached= {'soccer_epl'})
+    assert (plan['soccer_epl'].odds_cost, plan['soccer_fa_cup'].odds_cost) == (0, 3)
+
+    clock[0] += 31
+    assert not api.is_cached('sports/soccer_epl/odds', api._odds_params())
@@ -0,0 +1,47 @@
+import pytest
+from betting_event import BetType
+
+from arb_search.apis.the_odds_api import ScanPlanner, TheOddsAPI_V4
+from arb_search.utils import BookmakerStoredDict, StoredDict
+
+
+@pytest.fixture
+def api(tmp_path) -> TheOddsAPI_V4:
+    bookmaker_table = BookmakerStoredDict(StoredDict(str(tmp_path / 'bookmakers.json'), method= 'json'))
+    planner = ScanPlanner(StoredDict(str(tmp_path / 'scan_history.json'), method= 'json'))
+    return TheOddsAPI_V4(bookmaker_table, api_key= 'key', planner= planner)
+
+
+def response_of(markets: dict) -> dict:
+    return {
+        'home_team': 'Arsenal', 'away_team': 'Chelsea',
+        'bookmakers': [{'key': 'bet365', 'markets': [{'key': key, 'last_update': '2024-01-01T12:00:00Z', 'outcomes': outcomes}
+                                                     for key, outcomes in markets.items()]}],
+    }
+
+
+def test_every_alternate_market_is_built(api):
+    outcomes = {
+        'alternate_spreads': [{'name': 'Arsenal', 'price': 2.1, 'point': -1.5}, {'name': 'Chelsea', 'price': 1.8, 'point': 1.5}],
+        'alternate_totals': [{'name': 'Over', 'price': 1.9, 'point': 3.5}, {'name': 'Under', 'price': 1.95, 'point': 3.5}],
+        'btts': [{'name': 'Yes', 'price': 1.7}, {'name': 'No', 'price': 2.2}],
+        'draw_no_bet': [{'name': 'Arsenal', 'price': 1.5}, {'name': 'Chelsea', 'price': 2.6}],
+        'h2h_3_way': [{'name': 'Arsenal', 'price': 2.0}, {'name': 'Draw', 'price': 3.4}, {'name': 'Chelsea', 'price': 3.9}],
+    }
+    assert set(outcomes) == set(api.alternate_markets)
+
+    bets = api._build_odds_book(response_of(outcomes)).to_bets()
+    assert [(bet.bet_type, bet.value, bet.odds) for bet in bets] == [
+        (BetType.AsianHandicap, 'home -1.5', 2.1), (BetType.AsianHandicap, 'away 1.5', 1.8),
+        (BetType.Goals_OverUnder, 'over 3.5', 1.9), (BetType.Goals_OverUnder, 'under 3.5', 1.95),
+        (BetType.BothTeamsToScore, 'yes', 1.7), (BetType.BothTeamsToScore, 'no', 2.2),
+        (BetType.AsianHandicap, 'home 0.0', 1.5), (BetType.AsianHandicap, 'away 0.0', 2.6),
+        (BetType.MatchWinner, 'home', 2.0), (BetType.MatchWinner, 'draw', 3.4), (BetType.MatchWinner, 'away', 3.9),
+    ]
+    # the price is the bet's odds and isn't repeated in api_specific_data
+    assert bets[0].api_specific_data[api] == {'name': 'Arsenal', 'point': -1.5, 'market_key': 'alternate_spreads'}
+
+
+def test_unknown_market_is_rejected(api):
+    with pytest.raises(Exception, match= 'Unknown market'):
+        api._build_odds_book(response_of({'player_goals': [{'name': 'Saka', 'price': 3.0}]}))